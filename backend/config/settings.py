@@ -39,7 +39,9 @@ CORS_ALLOW_CREDENTIALS = True
 from corsheaders.defaults import default_headers
 CORS_ALLOW_HEADERS = list(default_headers) + [
     "accept-encoding",
+    "if-none-match",
 ]
+CORS_EXPOSE_HEADERS = ["etag"]
 # ----------------------------------
 
 INSTALLED_APPS = [
@@ -106,3 +108,114 @@ USE_TZ = True
 STATIC_URL = 'static/'
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 MAPBOX_ACCESS_TOKEN = os.environ.get("MAPBOX_ACCESS_TOKEN", "")
+
+# --- GEOCODE CACHE ---
+# In-process LRU in front of Mapbox geocoding, optionally backed by the default database.
+GEOCODE_CACHE_MAX_ENTRIES = int(os.environ.get("GEOCODE_CACHE_MAX_ENTRIES", "5000"))
+GEOCODE_CACHE_TTL_SECONDS = int(os.environ.get("GEOCODE_CACHE_TTL_SECONDS", str(7 * 24 * 3600)))
+GEOCODE_CACHE_PERSISTENT = os.environ.get("GEOCODE_CACHE_PERSISTENT", "true").lower() in ("1", "true", "yes")
+GEOCODE_CACHE_DB_MAX_ENTRIES = int(os.environ.get("GEOCODE_CACHE_DB_MAX_ENTRIES", "100000"))
+
+# --- DIRECTIONS CACHE ---
+# Repeat lanes are served from memory; waypoints are rounded to ROUTE_CACHE_PRECISION decimals.
+ROUTE_CACHE_MAX_ENTRIES = int(os.environ.get("ROUTE_CACHE_MAX_ENTRIES", "500"))
+ROUTE_CACHE_TTL_SECONDS = int(os.environ.get("ROUTE_CACHE_TTL_SECONDS", str(6 * 3600)))
+ROUTE_CACHE_PRECISION = int(os.environ.get("ROUTE_CACHE_PRECISION", "4"))
+
+# Overall budget for resolving a plan's trip endpoints (lookups run concurrently).
+GEOCODE_DEADLINE_SECONDS = float(os.environ.get("GEOCODE_DEADLINE_SECONDS", "10"))
+
+# --- MAPBOX HTTP ---
+# Pooled keep-alive session; GETs are retried with backoff on 429/5xx.
+MAPBOX_POOL_SIZE = int(os.environ.get("MAPBOX_POOL_SIZE", "10"))
+MAPBOX_MAX_RETRIES = int(os.environ.get("MAPBOX_MAX_RETRIES", "2"))
+MAPBOX_RETRY_BACKOFF_SECONDS = float(os.environ.get("MAPBOX_RETRY_BACKOFF_SECONDS", "0.3"))
+MAPBOX_GEOCODE_TIMEOUT_SECONDS = float(os.environ.get("MAPBOX_GEOCODE_TIMEOUT_SECONDS", "10"))
+MAPBOX_DIRECTIONS_TIMEOUT_SECONDS = float(os.environ.get("MAPBOX_DIRECTIONS_TIMEOUT_SECONDS", "15"))
+# Connections per ASGI worker for the async client; one worker holds many in-flight plans.
+MAPBOX_ASYNC_POOL_SIZE = int(os.environ.get("MAPBOX_ASYNC_POOL_SIZE", "100"))
+# Coordinates per Directions request; longer multi-stop trips are routed in chunks.
+DIRECTIONS_MAX_WAYPOINTS = int(os.environ.get("DIRECTIONS_MAX_WAYPOINTS", "25"))
+
+# --- PLACE SUGGESTIONS CACHE ---
+# Autocomplete results; longer prefixes reuse a cached complete shorter-prefix result.
+PLACES_CACHE_MAX_ENTRIES = int(os.environ.get("PLACES_CACHE_MAX_ENTRIES", "20000"))
+PLACES_CACHE_TTL_SECONDS = int(os.environ.get("PLACES_CACHE_TTL_SECONDS", str(24 * 3600)))
+
+# --- BATCH PLANNING ---
+# /api/plan/batch/: item limit, concurrent Mapbox calls, engine worker processes (0 = CPU count).
+PLAN_BATCH_MAX_ITEMS = int(os.environ.get("PLAN_BATCH_MAX_ITEMS", "5000"))
+PLAN_BATCH_CONCURRENCY = int(os.environ.get("PLAN_BATCH_CONCURRENCY", "16"))
+PLAN_PROCESS_POOL_WORKERS = int(os.environ.get("PLAN_PROCESS_POOL_WORKERS", "0"))
+
+# --- MULTI-STOP TRIPS ---
+# Most stops (after the current location) a plan request may list in "stops".
+PLAN_MAX_STOPS = int(os.environ.get("PLAN_MAX_STOPS", "100"))
+
+# --- LOG SHEETS ---
+# Default home terminal time zone (IANA name) for log sheet days when a plan
+# request does not send home_terminal_timezone. Empty keeps the start time's zone.
+HOME_TERMINAL_TIMEZONE = os.environ.get("HOME_TERMINAL_TIMEZONE", "")
+
+# --- RE-PLANNING ---
+# Plans are kept this long so /api/plan/replan/ can resume them from a checkpoint.
+# 0 disables storing plans (no plan_id is returned). The store must be shared by all
+# workers: by default the PLAN_STORE_CACHE alias is a table in the default database
+# (created by `manage.py createcachetable`); PLAN_STORE_REDIS_URL switches it to redis.
+PLAN_STORE_TTL_SECONDS = int(os.environ.get("PLAN_STORE_TTL_SECONDS", str(24 * 3600)))
+PLAN_STORE_CACHE = "plan_store"
+PLAN_STORE_REDIS_URL = os.environ.get("PLAN_STORE_REDIS_URL", "")
+PLAN_STORE_MAX_ENTRIES = int(os.environ.get("PLAN_STORE_MAX_ENTRIES", "100000"))
+
+# --- WHAT-IF SCENARIOS ---
+# /api/plan/scenarios/: most start time x cycle hours combinations per request.
+PLAN_SCENARIO_MAX_ITEMS = int(os.environ.get("PLAN_SCENARIO_MAX_ITEMS", "2000"))
+
+# --- ROUTING ---
+# "mapbox" (Directions API) or "local" (offline shortest paths on a road graph; no token needed
+# when every location is sent with coords). An empty graph path loads the bundled sample graph.
+ROUTING_BACKEND = os.environ.get("ROUTING_BACKEND", "mapbox")
+ROUTING_GRAPH_PATH = os.environ.get("ROUTING_GRAPH_PATH", "")
+ROUTING_MAX_SNAP_MILES = float(os.environ.get("ROUTING_MAX_SNAP_MILES", "25"))
+
+# --- LOCAL GAZETTEER ---
+# Tab-separated place names (see trips/gazetteer.py) answered before Mapbox geocoding and
+# autocomplete; e.g. trips/data/sample_gazetteer.tsv. Empty disables the gazetteer.
+GAZETTEER_PATH = os.environ.get("GAZETTEER_PATH", "")
+
+# --- TRUCK STOPS / REST AREAS ---
+# Tab-separated POIs (see trips/pois.py); when set, fuel stops and rests move to truck
+# stops / rest areas within POI_CORRIDOR_MILES of the route. Empty disables snapping.
+POI_PATH = os.environ.get("POI_PATH", "")
+POI_CORRIDOR_MILES = float(os.environ.get("POI_CORRIDOR_MILES", "3"))
+
+# --- PLAN RESPONSE CACHE ---
+# Whole /api/plan/ bodies keyed on the normalized trip request, start time bucketed to
+# PLAN_CACHE_START_BUCKET_MINUTES. 0 seconds disables it. With PLAN_CACHE_DIR set the
+# "plans" cache is file-based (shared by workers on one host), else local memory.
+PLAN_CACHE_TTL_SECONDS = int(os.environ.get("PLAN_CACHE_TTL_SECONDS", "300"))
+PLAN_CACHE_START_BUCKET_MINUTES = int(os.environ.get("PLAN_CACHE_START_BUCKET_MINUTES", "15"))
+PLAN_CACHE_ALIAS = "plans"
+PLAN_CACHE_DIR = os.environ.get("PLAN_CACHE_DIR", "")
+PLAN_CACHE_MAX_ENTRIES = int(os.environ.get("PLAN_CACHE_MAX_ENTRIES", "1000"))
+CACHES = {
+    "default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"},
+    PLAN_CACHE_ALIAS: {
+        "BACKEND": (
+            "django.core.cache.backends.filebased.FileBasedCache"
+            if PLAN_CACHE_DIR
+            else "django.core.cache.backends.locmem.LocMemCache"
+        ),
+        "LOCATION": PLAN_CACHE_DIR or "trips-plans",
+        "OPTIONS": {"MAX_ENTRIES": PLAN_CACHE_MAX_ENTRIES},
+    },
+    PLAN_STORE_CACHE: (
+        {"BACKEND": "django.core.cache.backends.redis.RedisCache", "LOCATION": PLAN_STORE_REDIS_URL}
+        if PLAN_STORE_REDIS_URL
+        else {
+            "BACKEND": "django.core.cache.backends.db.DatabaseCache",
+            "LOCATION": "trips_plan_store",
+            "OPTIONS": {"MAX_ENTRIES": PLAN_STORE_MAX_ENTRIES},
+        }
+    ),
+}
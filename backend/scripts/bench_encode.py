@@ -0,0 +1,123 @@
+"""
+Benchmark plan body encoding for a 30-day timeline.
+
+    cd backend
+    python scripts/bench_encode.py [--days 30] [--vertices 20000]
+
+Plans one long trip over the synthetic route from bench_geometry, then times
+encoding the same plan parts:
+- json.dumps(plan_trip(...)) as the view did before encode_plan (dicts per
+  segment, then the stdlib encoder);
+- encode_plan with orjson, when installed;
+- encode_plan on its stdlib path.
+Each is timed for the whole body and for the stops and log sheets alone
+(the route geometry, encoded by the stdlib json module on every path but
+orjson's, dominates the whole body on long routes). Both encode_plan
+outputs are checked against json.dumps first. Timings are the best of
+--repeat runs; the planning itself is timed once for scale.
+"""
+
+import argparse
+import json
+import sys
+from datetime import datetime
+from pathlib import Path
+from zoneinfo import ZoneInfo
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from bench_geometry import best_ms, synthetic_route  # noqa: E402
+from trips import encoders  # noqa: E402
+from trips.log_sheet_generator import build_log_sheets  # noqa: E402
+from trips.planner import build_stops_and_rests  # noqa: E402
+from trips.schemas import Route, RouteLeg, TripRequest  # noqa: E402
+from trips.serializers import daily_log_to_dict, route_to_dict  # noqa: E402
+from trips.timeline_engine import build_timeline, request_legs  # noqa: E402
+
+# Road miles a 70hr/8-day driver covers per calendar day on long trips, roughly.
+MILES_PER_DAY = 600
+
+
+def dumps_plan(route: dict, stops_and_rests: list, log_sheets: list) -> bytes:
+    """The plan body as built before encode_plan: plan_trip's dict, then json.dumps."""
+    body = {
+        "route": route,
+        "stops_and_rests": stops_and_rests,
+        "log_sheets": [daily_log_to_dict(log) for log in log_sheets],
+    }
+    return json.dumps(body).encode()
+
+
+def encode_stdlib(route: dict, stops_and_rests: list, log_sheets: list) -> bytes:
+    saved, encoders.orjson = encoders.orjson, None
+    try:
+        return encoders.encode_plan(route, stops_and_rests, log_sheets)
+    finally:
+        encoders.orjson = saved
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--days", type=int, default=30)
+    parser.add_argument("--vertices", type=int, default=20_000)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--repeat", type=int, default=9)
+    args = parser.parse_args()
+
+    geometry = synthetic_route(args.vertices, args.seed)
+    half = len(geometry) // 2
+    leg_miles = args.days * MILES_PER_DAY / 2
+    route = Route(
+        geometry,
+        2 * leg_miles,
+        2 * leg_miles / 55,
+        [
+            RouteLeg(leg_miles, leg_miles / 55, geometry[: half + 1]),
+            RouteLeg(leg_miles, leg_miles / 55, geometry[half:]),
+        ],
+        [geometry[0], geometry[half], geometry[-1]],
+    )
+    trip = TripRequest(
+        current_location="Chicago, IL",
+        pickup_location="Dallas, TX",
+        dropoff_location="Denver, CO",
+        current_cycle_used_hrs=35,
+        start_time=datetime(2024, 10, 20, 8, 0, tzinfo=ZoneInfo("America/Chicago")),
+    )
+
+    def plan_parts():
+        timeline = build_timeline(trip, route)
+        log_sheets = build_log_sheets(timeline, trip)
+        stops = build_stops_and_rests(timeline, route, request_legs(trip, route))
+        return timeline, stops, log_sheets
+
+    planning_ms = best_ms(plan_parts, 1)
+    timeline, stops_and_rests, log_sheets = plan_parts()
+    segments = sum(len(log.segments) for log in log_sheets)
+    print(
+        f"{len(timeline)} timeline rows, {len(log_sheets)} days, {segments} log segments, "
+        f"{len(geometry)} route vertices; planning {planning_ms:.1f} ms"
+    )
+    if encoders.orjson is None:
+        print("  (orjson is not installed; only the stdlib encode_plan path is timed)")
+
+    for title, parts in (
+        ("whole body", (route_to_dict(route), stops_and_rests, log_sheets)),
+        ("stops and log sheets", ({}, stops_and_rests, log_sheets)),
+    ):
+        expected = json.loads(dumps_plan(*parts))
+        rows = [("json.dumps(plan_trip(...))", lambda: dumps_plan(*parts))]
+        if encoders.orjson is not None:
+            rows.append(("encode_plan, orjson", lambda: encoders.encode_plan(*parts)))
+        rows.append(("encode_plan, stdlib", lambda: encode_stdlib(*parts)))
+        for label, fn in rows[1:]:
+            if json.loads(fn()) != expected:
+                raise SystemExit(f"{label}: output differs from json.dumps(plan_trip(...))")
+
+        print(f" {title}")
+        for label, fn in rows:
+            print(f"  {label:<30} {best_ms(fn, args.repeat):8.2f} ms  {len(fn()):>9} bytes")
+
+
+if __name__ == "__main__":
+    main()
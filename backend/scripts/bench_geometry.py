@@ -0,0 +1,115 @@
+"""
+Benchmark stop placement along a long route polyline.
+
+    cd backend
+    python scripts/bench_geometry.py [--vertices 50000] [--stops 20] [--seed 1]
+
+Builds a seeded synthetic route (a random walk south-west from Chicago) and times
+GeometryIndex construction and lookups against the per-stop walk it
+replaced, which re-measured the whole polyline for every stop. Timings are
+the best of --repeat runs. The index's points are checked against the walk
+before anything is timed.
+"""
+
+import argparse
+import math
+import random
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from trips.geometry import EARTH_RADIUS_MILES, GeometryIndex  # noqa: E402
+
+
+def synthetic_route(vertices: int, seed: int) -> list:
+    """[[lng, lat], ...] random walk south-west from Chicago, ~0.05 mile per step like a Directions polyline."""
+    rng = random.Random(seed)
+    lng, lat = -87.63, 41.88
+    points = [[lng, lat]]
+    for _ in range(vertices - 1):
+        lng -= rng.uniform(-0.0002, 0.0012)
+        lat -= rng.uniform(-0.0002, 0.0008)
+        points.append([lng, lat])
+    return points
+
+
+def walk_point_along(geometry, progress: float):
+    """The per-stop walk GeometryIndex replaced, with great-circle segment lengths."""
+    def miles(p0, p1):
+        lng0, lat0, lng1, lat1 = map(math.radians, (*p0, *p1))
+        a = (
+            math.sin((lat1 - lat0) / 2) ** 2
+            + math.cos(lat0) * math.cos(lat1) * math.sin((lng1 - lng0) / 2) ** 2
+        )
+        return 2 * EARTH_RADIUS_MILES * math.asin(math.sqrt(min(1.0, a)))
+
+    if not geometry:
+        return None
+    if len(geometry) == 1:
+        return geometry[0]
+    progress = max(0.0, min(1.0, float(progress)))
+    segment_lengths = [miles(geometry[i - 1], geometry[i]) for i in range(1, len(geometry))]
+    total_length = sum(segment_lengths)
+    if total_length <= 0:
+        return geometry[-1]
+    target = total_length * progress
+    walked = 0.0
+    for i, seg_len in enumerate(segment_lengths, start=1):
+        next_walked = walked + seg_len
+        if next_walked >= target:
+            if seg_len <= 0:
+                return geometry[i]
+            t = (target - walked) / seg_len
+            x0, y0 = geometry[i - 1]
+            x1, y1 = geometry[i]
+            return [x0 + (x1 - x0) * t, y0 + (y1 - y0) * t]
+        walked = next_walked
+    return geometry[-1]
+
+
+def best_ms(fn, repeat: int) -> float:
+    best = math.inf
+    for _ in range(repeat):
+        started = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - started)
+    return best * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--vertices", type=int, default=50_000)
+    parser.add_argument("--stops", type=int, default=20)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    geometry = synthetic_route(args.vertices, args.seed)
+    rng = random.Random(args.seed)
+    progresses = sorted(rng.random() for _ in range(args.stops))
+
+    index = GeometryIndex(geometry)
+    worst = max(
+        max(abs(a - b) for a, b in zip(point, walk_point_along(geometry, progress)))
+        for progress, point in zip(progresses, index.points_at(progresses))
+    )
+    print(f"{args.vertices} vertices, {index.total_length:.0f} miles, {args.stops} stops")
+    print(f"max |index - walk| = {worst:.2e} degrees")
+
+    rows = [
+        ("per-stop walk", lambda: [walk_point_along(geometry, p) for p in progresses]),
+        ("GeometryIndex build", lambda: GeometryIndex(geometry)),
+        ("GeometryIndex points_at", lambda: index.points_at(progresses)),
+        ("GeometryIndex build + points_at", lambda: GeometryIndex(geometry).points_at(progresses)),
+        ("GeometryIndex point_at_distance x stops", lambda: [
+            index.point_at_distance(p * index.total_length) for p in progresses
+        ]),
+    ]
+    for label, fn in rows:
+        print(f"  {label:<42} {best_ms(fn, args.repeat):9.3f} ms")
+
+
+if __name__ == "__main__":
+    main()
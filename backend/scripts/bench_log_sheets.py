@@ -0,0 +1,130 @@
+"""
+Benchmark log sheet assembly for a 90-day timeline.
+
+    cd backend
+    python scripts/bench_log_sheets.py [--days 90] [--zone America/Chicago]
+
+Simulates one long trip that starts in --zone and runs through both DST
+changes, then times:
+- the date-bucketing generator LogSheetBuilder replaced;
+- build_log_sheets with and without a home terminal zone;
+- the DayBoundaries lookups alone.
+The new output is checked against the old before anything is timed.
+Timings are the best of --repeat runs, at several cycle hours.
+"""
+
+import argparse
+import sys
+from collections import defaultdict
+from datetime import datetime, time, timedelta
+from pathlib import Path
+from zoneinfo import ZoneInfo
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from bench_geometry import best_ms  # noqa: E402
+from trips.log_sheet_generator import DayBoundaries, build_log_sheets  # noqa: E402
+from trips.schemas import (  # noqa: E402
+    DailyLog,
+    DutyStatus,
+    LogGridSegment,
+    Route,
+    RouteLeg,
+    TripRequest,
+    timeline_rows,
+)
+from trips.timeline_engine import build_timeline  # noqa: E402
+
+# Road miles a 70hr/8-day driver covers per calendar day on long trips, roughly.
+MILES_PER_DAY = 600
+
+
+def legacy_build_log_sheets(timeline, request: TripRequest) -> list[DailyLog]:
+    """build_log_sheets as it was before LogSheetBuilder: bucket by date, then sort and total."""
+    by_day = defaultdict(list)
+    for status, start, end, remaining_min, description, *_ in timeline_rows(timeline):
+        tz = start.tzinfo
+        current_start = start
+        while remaining_min > 0 and current_start < end:
+            day_start = datetime.combine(current_start.date(), time(0, 0), tzinfo=tz)
+            segment_end = min(end, day_start + timedelta(days=1))
+            chunk_min = (segment_end - current_start).total_seconds() / 60
+            if chunk_min <= 0:
+                break
+            by_day[current_start.date()].append(
+                LogGridSegment(status, current_start, segment_end, chunk_min, description)
+            )
+            remaining_min -= chunk_min
+            current_start = segment_end
+
+    logs = []
+    for i, log_date in enumerate(sorted(by_day)):
+        segments = sorted(by_day[log_date], key=lambda s: s.start_time)
+        hours = defaultdict(float)
+        for segment in segments:
+            hours[segment.status] += segment.duration_minutes / 60
+        driving = hours[DutyStatus.DRIVING]
+        logs.append(
+            DailyLog(
+                log_date=log_date,
+                from_place=request.current_location if i == 0 else request.pickup_location,
+                to_place=request.pickup_location if i == 0 else request.dropoff_location,
+                segments=segments,
+                total_driving_hours=round(driving, 2),
+                total_on_duty_hours=round(driving + hours[DutyStatus.ON_DUTY_NOT_DRIVING], 2),
+                total_off_duty_hours=round(hours[DutyStatus.OFF_DUTY], 2),
+                total_sleeper_hours=round(hours[DutyStatus.SLEEPER_BERTH], 2),
+            )
+        )
+    return logs
+
+
+def day_lookups(starts: list, zone):
+    days = DayBoundaries(zone, starts[0])
+    return [days.day_of(start) for start in starts]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--days", type=int, default=90)
+    parser.add_argument("--zone", default="America/Chicago")
+    parser.add_argument("--home-zone", default="America/New_York")
+    parser.add_argument("--cycle-hours", default="0,35,69")
+    parser.add_argument("--repeat", type=int, default=9)
+    args = parser.parse_args()
+
+    zone = ZoneInfo(args.zone)
+    home_zone = ZoneInfo(args.home_zone)
+    leg_miles = args.days * MILES_PER_DAY / 2
+    route = Route([], 2 * leg_miles, 2 * leg_miles / 55, [RouteLeg(leg_miles, leg_miles / 55)] * 2)
+
+    for cycle_hours in (float(h) for h in args.cycle_hours.split(",")):
+        trip = TripRequest(
+            current_location="A",
+            pickup_location="B",
+            dropoff_location="C",
+            current_cycle_used_hrs=cycle_hours,
+            start_time=datetime(2024, 2, 20, 8, 0, tzinfo=zone),
+        )
+        timeline = build_timeline(trip, route)
+        logs = build_log_sheets(timeline, trip)
+        if logs != legacy_build_log_sheets(timeline, trip):
+            raise SystemExit(f"cycle {cycle_hours:g}: build_log_sheets differs from the old generator")
+
+        starts = [row[1] for row in timeline.rows()]
+        print(f"cycle {cycle_hours:g} hrs: {len(timeline)} rows, {len(logs)} days")
+        rows = [
+            ("old generator", lambda: legacy_build_log_sheets(timeline, trip)),
+            ("build_log_sheets", lambda: build_log_sheets(timeline, trip)),
+            (
+                f"build_log_sheets, home zone {args.home_zone}",
+                lambda: build_log_sheets(timeline, trip, home_zone),
+            ),
+            ("DayBoundaries.day_of per row start", lambda: day_lookups(starts, zone)),
+        ]
+        for label, fn in rows:
+            print(f"  {label:<48} {best_ms(fn, args.repeat):8.2f} ms")
+
+
+if __name__ == "__main__":
+    main()
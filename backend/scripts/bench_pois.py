@@ -0,0 +1,106 @@
+"""
+Benchmark the truck stop / rest area corridor query.
+
+    cd backend
+    python scripts/bench_pois.py [--pois 50000] [--vertices 20000] [--radius 3]
+
+Scatters --pois POIs over the lower 48 states, with --on-route of them
+within ~10 miles of the synthetic route from bench_geometry (truck stops
+cluster on the interstates), then times POIIndex construction and the
+corridor query on the whole route.
+Before anything is timed, the corridor of a --check-pois subset is
+compared with a brute-force scan of every POI against every segment.
+Timings are the best of --repeat runs.
+"""
+
+import argparse
+import random
+import sys
+from pathlib import Path
+
+import numpy as np
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from bench_geometry import best_ms, synthetic_route  # noqa: E402
+from trips.geometry import GeometryIndex  # noqa: E402
+from trips.pois import MILES_PER_DEGREE_LAT, POIIndex  # noqa: E402
+
+
+# Lower 48 bounding box, [lng, lat].
+CONUS = ((-124.7, 24.5), (-67.0, 49.4))
+
+
+def synthetic_pois(geometry: list, count: int, on_route: float, seed: int) -> POIIndex:
+    """count POIs, the on_route fraction of them near geometry and the rest anywhere in CONUS."""
+    rng = random.Random(seed)
+    (west, south), (east, north) = CONUS
+    names, kinds, lng, lat = [], [], [], []
+    for i in range(count):
+        if rng.random() >= on_route:
+            x, y = rng.uniform(west, east), rng.uniform(south, north)
+        else:
+            x, y = rng.choice(geometry)
+            x += rng.uniform(-0.2, 0.2)
+            y += rng.uniform(-0.15, 0.15)
+        names.append(f"POI {i}")
+        kinds.append("truck_stop" if i % 3 else "rest_area")
+        lng.append(x)
+        lat.append(y)
+    return POIIndex(names, kinds, lng, lat)
+
+
+def brute_force_names(index: POIIndex, geometry: list, radius_miles: float) -> set:
+    """Names of POIs within radius_miles of any segment, checked one POI at a time."""
+    coords = np.asarray(geometry, dtype=float)
+    found = set()
+    for name, lng, lat in zip(index.names, index.lng, index.lat):
+        x_scale = MILES_PER_DEGREE_LAT * np.cos(np.radians(lat))
+        a = (coords[:-1] - (lng, lat)) * (x_scale, MILES_PER_DEGREE_LAT)
+        d = (coords[1:] - coords[:-1]) * (x_scale, MILES_PER_DEGREE_LAT)
+        length_sq = (d * d).sum(axis=1)
+        t = np.clip(-(a * d).sum(axis=1) / np.where(length_sq > 0, length_sq, 1.0), 0.0, 1.0)
+        if np.hypot(*(a + t[:, None] * d).T).min() <= radius_miles:
+            found.add(name)
+    return found
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--pois", type=int, default=50_000)
+    parser.add_argument("--on-route", type=float, default=0.02)
+    parser.add_argument("--check-pois", type=int, default=2_000)
+    parser.add_argument("--vertices", type=int, default=20_000)
+    parser.add_argument("--radius", type=float, default=3.0)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    geometry = synthetic_route(args.vertices, args.seed)
+    road_miles = GeometryIndex(geometry).total_length
+
+    check = synthetic_pois(geometry, args.check_pois, 0.5, args.seed + 1)
+    expected = brute_force_names(check, geometry, args.radius)
+    found = set(check.corridor(geometry, road_miles, args.radius).names)
+    if found != expected:
+        raise SystemExit(
+            f"corridor differs from brute force: {len(expected - found)} missed, "
+            f"{len(found - expected)} extra"
+        )
+
+    index = synthetic_pois(geometry, args.pois, args.on_route, args.seed)
+    sites = index.corridor(geometry, road_miles, args.radius)
+    print(
+        f"{args.pois} POIs, {args.vertices} vertices, {road_miles:.0f} miles, "
+        f"{len(sites)} within {args.radius:g} miles ({len(expected)} of {args.check_pois} checked)"
+    )
+    rows = [
+        ("POIIndex build", lambda: POIIndex(index.names, index.kinds, index.lng, index.lat)),
+        ("corridor, whole route", lambda: index.corridor(geometry, road_miles, args.radius)),
+    ]
+    for label, fn in rows:
+        print(f"  {label:<28} {best_ms(fn, args.repeat):8.2f} ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,64 @@
+"""
+Benchmark encoded-polyline output for route geometry.
+
+    cd backend
+    python scripts/bench_polyline.py [--vertices 50000] [--seed 1]
+
+Encodes the synthetic route from bench_geometry with encode_polyline and
+with the reference one-value-at-a-time algorithm, checks the two strings
+are identical, and prints the best of --repeat timings for each precision.
+"""
+
+import argparse
+import math
+import sys
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from bench_geometry import best_ms, synthetic_route  # noqa: E402
+from trips.geometry import POLYLINE_PRECISION, encode_polyline  # noqa: E402
+
+
+def scalar_encode_polyline(coords, precision: int = 5) -> str:
+    """The reference encoded-polyline algorithm, one value at a time."""
+    factor = 10 ** precision
+    chars = []
+    previous = [0, 0]
+    for lng, lat in coords:
+        for axis, coordinate in enumerate((lat, lng)):
+            scaled = coordinate * factor
+            rounded = int(math.copysign(math.floor(abs(scaled) + 0.5), scaled))
+            value = rounded - previous[axis]
+            previous[axis] = rounded
+            value = ~(value << 1) if value < 0 else value << 1
+            while value >= 0x20:
+                chars.append(chr((0x20 | (value & 0x1F)) + 63))
+                value >>= 5
+            chars.append(chr(value + 63))
+    return "".join(chars)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--vertices", type=int, default=50_000)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    coords = synthetic_route(args.vertices, args.seed)
+    print(f"{args.vertices} vertices")
+    for name, precision in POLYLINE_PRECISION.items():
+        encoded = encode_polyline(coords, precision)
+        if encoded != scalar_encode_polyline(coords, precision):
+            raise SystemExit(f"{name}: encode_polyline differs from the reference encoder")
+        scalar = best_ms(lambda: scalar_encode_polyline(coords, precision), args.repeat)
+        vectorized = best_ms(lambda: encode_polyline(coords, precision), args.repeat)
+        print(
+            f"  {name:<10} {len(encoded):8d} chars  reference {scalar:8.2f} ms"
+            f"  encode_polyline {vectorized:7.2f} ms  ({scalar / vectorized:.1f}x)"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,62 @@
+"""
+Benchmark route simplification for map zooms.
+
+    cd backend
+    python scripts/bench_simplify.py [--vertices 50000] [--seed 1]
+
+Simplifies the synthetic route from bench_geometry at the tolerance of
+several zoom levels and prints, per zoom, the vertices kept, the largest
+deviation of any input vertex from the simplified line as a fraction of the
+tolerance (must stay at or below 1), and the best of --repeat timings.
+"""
+
+import argparse
+import sys
+from pathlib import Path
+
+import numpy as np
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from bench_geometry import best_ms, synthetic_route  # noqa: E402
+from trips.geometry import simplify, tolerance_for_zoom  # noqa: E402
+
+
+def max_deviation(coords, kept, tolerance: float) -> float:
+    """Largest distance from an input vertex to its kept segment, in tolerances (Mercator units)."""
+    points = np.asarray(coords, dtype=float)
+    x = points[:, 0]
+    y = points[:, 1] / np.cos(np.radians(points[:, 1].mean()))
+    worst = 0.0
+    for a, b in zip(kept[:-1], kept[1:]):
+        chord = np.array([x[b] - x[a], y[b] - y[a]])
+        inner = np.column_stack((x[a + 1 : b] - x[a], y[a + 1 : b] - y[a]))
+        if not len(inner):
+            continue
+        chord_sq = chord @ chord
+        t = np.clip(inner @ chord / chord_sq, 0.0, 1.0) if chord_sq > 0 else np.zeros(len(inner))
+        worst = max(worst, float(np.hypot(*(inner - t[:, None] * chord).T).max()))
+    return worst / tolerance
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--vertices", type=int, default=50_000)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--zooms", default="4,6,8,10,12,14")
+    args = parser.parse_args()
+
+    coords = synthetic_route(args.vertices, args.seed)
+    print(f"{args.vertices} vertices")
+    print(f"  {'zoom':>4} {'kept':>7} {'max dev':>8} {'time':>10}")
+    for zoom in (float(z) for z in args.zooms.split(",")):
+        tolerance = tolerance_for_zoom(zoom)
+        kept = simplify(coords, tolerance)
+        deviation = max_deviation(coords, kept, tolerance)
+        elapsed = best_ms(lambda: simplify(coords, tolerance), args.repeat)
+        print(f"  {zoom:4g} {len(kept):7d} {deviation:8.3f} {elapsed:7.2f} ms")
+
+
+if __name__ == "__main__":
+    main()
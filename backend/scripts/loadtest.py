@@ -0,0 +1,187 @@
+"""
+Load test /api/plan/ under WSGI and ASGI workers and print latency percentiles.
+
+    cd backend
+    python scripts/loadtest.py                      # launch both servers and compare
+    python scripts/loadtest.py --url http://host:8000 --requests 500
+
+With no --url, gunicorn is started twice on a local port, once with the sync
+WSGI worker (config.wsgi) and once with the uvicorn ASGI worker (config.asgi),
+each with --workers processes, and the same load is run against both. Servers
+use the bundled offline road graph (ROUTING_BACKEND=local) so no Mapbox token
+or network is needed. Plan requests send Cache-Control: no-cache, so every one
+is planned rather than served from the plan cache; mix in autocomplete
+requests with --suggest to see whether cheap requests queue behind plans.
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+from pathlib import Path
+
+import httpx
+
+BACKEND_DIR = Path(__file__).resolve().parent.parent
+
+# Pairs of cities in trips/data/sample_road_graph.json.
+TRIPS = [
+    ("Chicago, IL", [-87.63, 41.88], "Dallas, TX", [-96.8, 32.78], "Denver, CO", [-104.99, 39.74]),
+    ("Atlanta, GA", [-84.39, 33.75], "Nashville, TN", [-86.78, 36.16], "St. Louis, MO", [-90.2, 38.63]),
+    ("Phoenix, AZ", [-112.07, 33.45], "Albuquerque, NM", [-106.65, 35.08], "Oklahoma City, OK", [-97.52, 35.47]),
+]
+
+SERVERS = {
+    "wsgi": ["config.wsgi:application"],
+    "asgi": ["config.asgi:application", "-k", "uvicorn_worker.UvicornWorker"],
+}
+
+
+def plan_payload(i: int) -> dict:
+    current, current_xy, pickup, pickup_xy, dropoff, dropoff_xy = TRIPS[i % len(TRIPS)]
+    return {
+        "current_location": current,
+        "current_location_coords": current_xy,
+        "pickup_location": pickup,
+        "pickup_location_coords": pickup_xy,
+        "dropoff_location": dropoff,
+        "dropoff_location_coords": dropoff_xy,
+        "current_cycle_used_hrs": i % 40,
+    }
+
+
+def percentile(sorted_values: list[float], pct: float) -> float:
+    if not sorted_values:
+        return 0.0
+    k = min(len(sorted_values) - 1, max(0, round(pct / 100 * (len(sorted_values) - 1))))
+    return sorted_values[k]
+
+
+async def run_load(base_url: str, total: int, concurrency: int, suggest_every: int) -> dict:
+    """Send total requests with concurrency in flight; latencies in ms by request kind."""
+    latencies = {"plan": [], "suggest": []}
+    errors = 0
+    counter = iter(range(total))
+
+    async def worker(client: httpx.AsyncClient):
+        nonlocal errors
+        for i in counter:
+            if suggest_every and i % suggest_every == 0:
+                kind = "suggest"
+                request = client.build_request("GET", "/api/places/", params={"q": "dal"})
+            else:
+                kind = "plan"
+                request = client.build_request(
+                    "POST",
+                    "/api/plan/",
+                    content=json.dumps(plan_payload(i)),
+                    headers={"Content-Type": "application/json", "Cache-Control": "no-cache"},
+                )
+            started = time.perf_counter()
+            try:
+                response = await client.send(request)
+                ok = response.status_code < 400
+            except httpx.HTTPError:
+                ok = False
+            elapsed = (time.perf_counter() - started) * 1000
+            if ok:
+                latencies[kind].append(elapsed)
+            else:
+                errors += 1
+
+    limits = httpx.Limits(max_connections=concurrency)
+    async with httpx.AsyncClient(base_url=base_url, timeout=120, limits=limits) as client:
+        started = time.perf_counter()
+        await asyncio.gather(*(worker(client) for _ in range(concurrency)))
+        wall = time.perf_counter() - started
+    return {"latencies": latencies, "errors": errors, "wall": wall, "total": total}
+
+
+def report(label: str, result: dict):
+    done = sum(len(v) for v in result["latencies"].values())
+    print(
+        f"{label}: {done}/{result['total']} ok, {result['errors']} errors, "
+        f"{done / result['wall']:.1f} req/s"
+    )
+    for kind, values in result["latencies"].items():
+        if not values:
+            continue
+        values.sort()
+        print(
+            f"  {kind:<8} n={len(values):<5} mean={statistics.fmean(values):8.1f} ms"
+            f"  p50={percentile(values, 50):8.1f}  p95={percentile(values, 95):8.1f}"
+            f"  p99={percentile(values, 99):8.1f}  max={values[-1]:8.1f}"
+        )
+
+
+def wait_until_up(base_url: str, server: subprocess.Popen, timeout: float = 30.0):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if server.poll() is not None:
+            raise RuntimeError("server exited during startup")
+        try:
+            httpx.get(base_url + "/api/places/", params={"q": "a"}, timeout=2)
+            return
+        except httpx.HTTPError:
+            time.sleep(0.2)
+    raise RuntimeError(f"server at {base_url} did not start within {timeout:.0f}s")
+
+
+def launch(mode: str, port: int, workers: int) -> subprocess.Popen:
+    env = {
+        **os.environ,
+        "ROUTING_BACKEND": "local",
+        "DJANGO_DEBUG": "False",
+        "DJANGO_ALLOWED_HOSTS": "127.0.0.1,localhost",
+    }
+    command = [
+        sys.executable, "-m", "gunicorn", *SERVERS[mode],
+        "--bind", f"127.0.0.1:{port}",
+        "--workers", str(workers),
+        "--log-level", "warning",
+    ]
+    return subprocess.Popen(command, cwd=BACKEND_DIR, env=env)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--url", help="test a running server instead of launching wsgi and asgi")
+    parser.add_argument("--modes", default="wsgi,asgi", help="servers to launch (default wsgi,asgi)")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--workers", type=int, default=2, help="gunicorn worker processes")
+    parser.add_argument("--requests", type=int, default=200)
+    parser.add_argument("--concurrency", type=int, default=32)
+    parser.add_argument(
+        "--suggest", type=int, default=5, help="every Nth request is an autocomplete (0 for none)"
+    )
+    args = parser.parse_args()
+
+    if args.url:
+        result = asyncio.run(run_load(args.url.rstrip("/"), args.requests, args.concurrency, args.suggest))
+        report(args.url, result)
+        return
+
+    # The plan store and plan cache tables, as the deploy commands create them.
+    for command in (["migrate", "--noinput"], ["createcachetable"]):
+        subprocess.run([sys.executable, "manage.py", *command], cwd=BACKEND_DIR, check=True)
+
+    for mode in args.modes.split(","):
+        base_url = f"http://127.0.0.1:{args.port}"
+        server = launch(mode, args.port, args.workers)
+        try:
+            wait_until_up(base_url, server)
+            # Warm each worker's graph, gazetteer and imports before measuring.
+            asyncio.run(run_load(base_url, args.workers * 4, args.workers * 2, 0))
+            result = asyncio.run(run_load(base_url, args.requests, args.concurrency, args.suggest))
+        finally:
+            server.terminate()
+            server.wait(timeout=30)
+        report(f"{mode} ({args.workers} workers, concurrency {args.concurrency})", result)
+
+
+if __name__ == "__main__":
+    main()
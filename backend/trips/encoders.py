@@ -0,0 +1,119 @@
+"""
+Encode plan responses straight to JSON bytes.
+Log sheets are written from the DailyLog / LogGridSegment objects without
+building per-segment dicts. orjson is used when installed; otherwise a
+stdlib path formats segments directly and reuses formatted timestamps.
+Both produce the same document as json.dumps(plan_trip(...)).
+"""
+
+import json
+from datetime import date, datetime
+from functools import lru_cache
+
+from .schemas import DailyLog
+
+try:
+    import orjson
+except ImportError:  # optional speedup; the stdlib path below covers it
+    orjson = None
+
+_compact_dumps = json.JSONEncoder(separators=(",", ":")).encode
+
+
+@lru_cache(maxsize=1024)
+def _json_str(value: str) -> str:
+    """Quoted JSON string; descriptions and place names repeat across segments."""
+    return _compact_dumps(value)
+
+
+def _json_number(value) -> str:
+    return _compact_dumps(value) if value is None else repr(value)
+
+
+def _json_datetime(dt: datetime, formatted: dict) -> str:
+    if dt is None:
+        return "null"
+    text = formatted.get(dt)
+    if text is None:
+        text = formatted[dt] = '"%s"' % dt.isoformat()
+    return text
+
+
+def _json_date(d: date) -> str:
+    return '"%s"' % d.isoformat() if d else "null"
+
+
+def _daily_log_json(log: DailyLog, formatted: dict) -> str:
+    segments = ",".join(
+        '{"status":"%s","start_time":%s,"end_time":%s,"duration_minutes":%s,"description":%s}'
+        % (
+            seg.status.value,
+            _json_datetime(seg.start_time, formatted),
+            _json_datetime(seg.end_time, formatted),
+            _json_number(seg.duration_minutes),
+            _json_str(seg.description),
+        )
+        for seg in log.segments
+    )
+    return (
+        '{"log_date":%s,"from_place":%s,"to_place":%s,"segments":[%s],'
+        '"total_driving_hours":%s,"total_on_duty_hours":%s,'
+        '"total_off_duty_hours":%s,"total_sleeper_hours":%s}'
+        % (
+            _json_date(log.log_date),
+            _json_str(log.from_place),
+            _json_str(log.to_place),
+            segments,
+            _json_number(log.total_driving_hours),
+            _json_number(log.total_on_duty_hours),
+            _json_number(log.total_off_duty_hours),
+            _json_number(log.total_sleeper_hours),
+        )
+    )
+
+
+def encode_plan(
+    route: dict,
+    stops_and_rests: list,
+    log_sheets: list[DailyLog],
+    plan_id: str | None = None,
+) -> bytes:
+    """
+    JSON bytes for a plan body. route and stops_and_rests are the small dicts
+    from route_to_dict / build_stops_and_rests; log_sheets are schema objects.
+    plan_id, when given, is written first so clients can re-plan the trip.
+    """
+    if orjson is not None:
+        # orjson writes dataclasses, enums, dates and datetimes natively, in
+        # field order, which matches daily_log_to_dict key for key.
+        body = {"route": route, "stops_and_rests": stops_and_rests, "log_sheets": log_sheets}
+        if plan_id is not None:
+            body = {"plan_id": plan_id, **body}
+        return orjson.dumps(body)
+
+    formatted: dict = {}
+    return (
+        '{%s"route":%s,"stops_and_rests":%s,"log_sheets":[%s]}'
+        % (
+            '"plan_id":%s,' % _json_str(plan_id) if plan_id is not None else "",
+            _compact_dumps(route),
+            _compact_dumps(stops_and_rests),
+            ",".join(_daily_log_json(log, formatted) for log in log_sheets),
+        )
+    ).encode()
+
+
+def with_plan_id(body: bytes, plan_id: str) -> bytes:
+    """A plan body encoded without plan_id, with plan_id written first as encode_plan does."""
+    return b'{"plan_id":' + _json_str(plan_id).encode() + b"," + body[1:]
+
+
+def encode_plan_line(kind: str, value) -> bytes:
+    """One NDJSON line {"<kind>": value} for streamed plans; value may be a DailyLog."""
+    if orjson is not None:
+        return orjson.dumps({kind: value}, option=orjson.OPT_APPEND_NEWLINE)
+    if isinstance(value, DailyLog):
+        body = _daily_log_json(value, {})
+    else:
+        body = _compact_dumps(value)
+    return ("{%s:%s}\n" % (_json_str(kind), body)).encode()
@@ -0,0 +1,114 @@
+"""
+Local gazetteer: the city, postcode and facility names that make up most
+location queries, answered from memory before Mapbox is asked. Every name
+and alias is indexed by its normalized text in one sorted list, so an exact
+lookup is a bisect and a prefix autocomplete is two bisects over the keys
+that share the prefix.
+
+GAZETTEER_PATH points at a tab-separated file with a header row and the
+columns name, lng, lat, kind (city / postcode / facility) and aliases
+(optional, separated by "|"). Earlier rows rank first in suggestions and win
+when two names normalize alike. trips/data/sample_gazetteer.tsv is a small
+example.
+"""
+
+import csv
+import heapq
+import re
+import threading
+from bisect import bisect_left
+from pathlib import Path
+
+from django.conf import settings
+
+SAMPLE_GAZETTEER_PATH = Path(__file__).resolve().parent / "data" / "sample_gazetteer.tsv"
+
+_gazetteer = None
+_gazetteer_loaded = False
+_gazetteer_lock = threading.Lock()
+
+
+def normalize_query(query: str) -> str:
+    """Lookup key for a location query: case, whitespace and comma spacing folded."""
+    text = " ".join((query or "").lower().split())
+    return re.sub(r"\s*,\s*", ", ", text).strip(" ,")
+
+
+class Gazetteer:
+    """Sorted name index over places given as (name, lng, lat, kind, aliases) rows."""
+
+    def __init__(self, places):
+        self.names = []
+        self.kinds = []
+        self.coords = []
+        pairs = {}
+        for row, (name, lng, lat, kind, aliases) in enumerate(places):
+            self.names.append(name)
+            self.kinds.append(kind)
+            self.coords.append((float(lng), float(lat)))
+            for alias in (name, *aliases):
+                pairs.setdefault(normalize_query(alias), row)
+        pairs.pop("", None)
+        self.keys = sorted(pairs)
+        self.rows = [pairs[key] for key in self.keys]
+
+    @classmethod
+    def load(cls, path) -> "Gazetteer":
+        with open(path, newline="", encoding="utf-8") as handle:
+            reader = csv.DictReader(handle, delimiter="\t")
+            return cls(
+                (
+                    row["name"],
+                    row["lng"],
+                    row["lat"],
+                    row.get("kind") or "",
+                    [alias for alias in (row.get("aliases") or "").split("|") if alias.strip()],
+                )
+                for row in reader
+            )
+
+    def __len__(self) -> int:
+        return len(self.names)
+
+    def lookup(self, key: str) -> list:
+        """[lng, lat] for a normalized name or alias, or [] when it is not listed."""
+        i = bisect_left(self.keys, key)
+        if i < len(self.keys) and self.keys[i] == key:
+            return list(self.coords[self.rows[i]])
+        return []
+
+    def complete(self, key: str, limit: int = 5) -> list[dict]:
+        """Up to limit places with a name or alias starting with the normalized key, best ranked first."""
+        if not key:
+            return []
+        start = bisect_left(self.keys, key)
+        end = bisect_left(self.keys, key + "\uffff", start)
+        rows = heapq.nsmallest(limit, set(self.rows[start:end]))
+        return [
+            {"name": self.names[row], "coordinates": list(self.coords[row])}
+            for row in rows
+        ]
+
+
+def get_gazetteer() -> Gazetteer | None:
+    """The GAZETTEER_PATH gazetteer, loaded once per process; None when not configured."""
+    global _gazetteer, _gazetteer_loaded
+    if not _gazetteer_loaded:
+        with _gazetteer_lock:
+            if not _gazetteer_loaded:
+                path = getattr(settings, "GAZETTEER_PATH", "")
+                _gazetteer = Gazetteer.load(path) if path else None
+                _gazetteer_loaded = True
+    return _gazetteer
+
+
+def lookup(key: str) -> list:
+    """[lng, lat] from the configured gazetteer for a normalized query, or []."""
+    gazetteer = get_gazetteer()
+    return gazetteer.lookup(key) if gazetteer is not None else []
+
+
+def complete(key: str, limit: int = 5) -> list[dict]:
+    """Autocomplete suggestions from the configured gazetteer for a normalized query."""
+    gazetteer = get_gazetteer()
+    return gazetteer.complete(key, limit) if gazetteer is not None else []
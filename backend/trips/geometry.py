@@ -0,0 +1,255 @@
+"""
+Polyline helpers: an index for placing stops along route geometry, plus
+simplification and encoding for compact route responses.
+Great-circle segment lengths and their prefix sums are computed once per
+polyline in vectorized form; distance queries are then a binary search
+plus one interpolation each.
+"""
+
+from itertools import chain
+
+import numpy as np
+
+EARTH_RADIUS_MILES = 3958.8
+
+# Mapbox GL renders 512px tiles; one pixel at zoom z spans this many degrees of longitude.
+TILE_SIZE_PX = 512
+POLYLINE_PRECISION = {"polyline": 5, "polyline6": 6}
+
+
+def as_coords(geometry) -> np.ndarray:
+    """
+    (n, 2) float array from [[lng, lat], ...]. Flattening through fromiter
+    is several times faster than np.asarray on nested lists.
+    """
+    if geometry is None or not len(geometry):
+        return np.empty((0, 2))
+    if isinstance(geometry, np.ndarray):
+        return geometry.astype(float, copy=False).reshape(-1, 2)
+    return np.fromiter(
+        chain.from_iterable(geometry), dtype=float, count=2 * len(geometry)
+    ).reshape(-1, 2)
+
+
+def segment_lengths_miles(coords: np.ndarray) -> np.ndarray:
+    """Haversine length in miles of each consecutive [lng, lat] pair."""
+    lng = np.radians(coords[:, 0])
+    lat = np.radians(coords[:, 1])
+    dlat = np.diff(lat)
+    dlng = np.diff(lng)
+    a = np.sin(dlat / 2) ** 2 + np.cos(lat[:-1]) * np.cos(lat[1:]) * np.sin(dlng / 2) ** 2
+    return 2 * EARTH_RADIUS_MILES * np.arcsin(np.sqrt(np.clip(a, 0.0, 1.0)))
+
+
+class GeometryIndex:
+    """Prefix-sum index over a [[lng, lat], ...] polyline, lengths in miles."""
+
+    def __init__(self, geometry):
+        self.geometry = geometry
+        coords = as_coords(geometry)
+        self.coords = coords
+        if len(coords) > 1:
+            self.cumulative = np.concatenate(([0.0], np.cumsum(segment_lengths_miles(coords))))
+        else:
+            self.cumulative = np.zeros(len(coords))
+        self.total_length = float(self.cumulative[-1]) if len(coords) else 0.0
+
+    def point_at(self, progress: float):
+        """[lng, lat] at fractional progress (0..1) along the polyline, or None if empty."""
+        points = self.points_at([progress])
+        return points[0] if points else None
+
+    def points_at(self, progresses) -> list:
+        """point_at for many progress values in one vectorized pass."""
+        return self.points_at_distance(
+            np.clip(np.asarray(progresses, dtype=float), 0.0, 1.0) * self.total_length
+        )
+
+    def point_at_distance(self, distance: float):
+        """points_at_distance for a single distance, without the array round trip."""
+        geometry = self.geometry
+        if not geometry:
+            return None
+        if len(geometry) == 1:
+            return geometry[0]
+        if self.total_length <= 0:
+            return geometry[-1]
+
+        target = min(max(float(distance), 0.0), self.total_length)
+        end = int(np.searchsorted(self.cumulative, target, side="left"))
+        end = min(max(end, 1), len(self.coords) - 1)
+        start_length = float(self.cumulative[end - 1])
+        seg_length = float(self.cumulative[end]) - start_length
+        t = (target - start_length) / seg_length if seg_length > 0 else 1.0
+        (x0, y0), (x1, y1) = self.coords[end - 1 : end + 1].tolist()
+        return [x0 + (x1 - x0) * t, y0 + (y1 - y0) * t]
+
+    def points_at_distance(self, distances) -> list:
+        """[lng, lat] at each distance in miles from the start (clamped to the line)."""
+        geometry = self.geometry
+        if not geometry:
+            return [None] * len(distances)
+        if len(geometry) == 1:
+            return [geometry[0]] * len(distances)
+        if self.total_length <= 0:
+            return [geometry[-1]] * len(distances)
+
+        targets = np.clip(np.asarray(distances, dtype=float), 0.0, self.total_length)
+        # First vertex whose cumulative length reaches the target ends the segment.
+        ends = np.clip(np.searchsorted(self.cumulative, targets, side="left"), 1, len(self.coords) - 1)
+        starts = ends - 1
+        seg_lengths = self.cumulative[ends] - self.cumulative[starts]
+        safe_lengths = np.where(seg_lengths > 0, seg_lengths, 1.0)
+        t = np.where(seg_lengths > 0, (targets - self.cumulative[starts]) / safe_lengths, 1.0)
+        points = self.coords[starts] + (self.coords[ends] - self.coords[starts]) * t[:, None]
+        return points.tolist()
+
+    def tail(self, distance: float) -> list:
+        """The polyline from distance miles along it to its end, starting at the interpolated point."""
+        geometry = self.geometry
+        if len(geometry) < 2:
+            return [list(point) for point in geometry]
+        start = self.point_at_distance(distance)
+        first = int(np.searchsorted(self.cumulative, min(max(float(distance), 0.0), self.total_length), side="right"))
+        return [start] + self.coords[min(first, len(self.coords) - 1) :].tolist()
+
+
+def tolerance_for_zoom(zoom: float, pixels: float = 0.5) -> float:
+    """Simplification tolerance (degrees of longitude) that stays under `pixels` at `zoom`."""
+    return pixels * 360.0 / (TILE_SIZE_PX * 2.0 ** zoom)
+
+
+def simplify(coords, tolerance: float, keep=()) -> np.ndarray:
+    """
+    Douglas-Peucker simplification of [[lng, lat], ...] in local Web Mercator
+    units (degrees of longitude). Returns the indices of vertices to keep, in
+    order; the endpoints and any indices in `keep` always survive. Every
+    input vertex ends within tolerance of the kept segment spanning it.
+    Runs breadth-first: each round splits every open span at its farthest
+    vertex in one vectorized pass, so the Python loop runs once per tree
+    level rather than once per kept vertex.
+    """
+    points = as_coords(coords)
+    n = len(points)
+    if n <= 2 or tolerance <= 0:
+        return np.arange(n)
+
+    # Stretch latitude like Mercator does around the polyline's mean latitude.
+    x = points[:, 0]
+    y = points[:, 1] / max(np.cos(np.radians(points[:, 1].mean())), 1e-6)
+
+    # Pre-pass: within a run of vertices sharing one grid cell of half the
+    # tolerance, usually only the run's ends matter, so the rest skip the
+    # split rounds; the final check below measures them again.
+    all_x, all_y = x, y
+    cells = np.floor(np.column_stack((x, y)) / (tolerance / 2)).astype(np.int64)
+    changed = np.any(cells[1:] != cells[:-1], axis=1)
+    pinned = np.zeros(n, dtype=bool)
+    keep = np.asarray(keep, dtype=np.int64)
+    pinned[keep[(keep >= 0) & (keep < n)]] = True
+    pinned[[0, n - 1]] = True
+    survivors = np.flatnonzero(np.r_[True, changed] | np.r_[changed, True] | pinned)
+    x = x[survivors]
+    y = y[survivors]
+    tolerance_sq = tolerance * tolerance
+
+    kept = pinned[survivors]
+    open_points = ~kept
+    while True:
+        candidates = np.flatnonzero(open_points)
+        if not len(candidates):
+            break
+        anchors = np.flatnonzero(kept)
+        # Kept vertices up to each candidate = index of the anchor that closes its span.
+        span = np.cumsum(kept)[candidates]
+        # Candidates are sorted, so each span's points are contiguous.
+        group_starts = np.flatnonzero(np.r_[True, span[1:] != span[:-1]])
+        group_sizes = np.diff(np.r_[group_starts, len(candidates)])
+        first = anchors[span[group_starts] - 1]
+        last = anchors[span[group_starts]]
+        chord_x = x[last] - x[first]
+        chord_y = y[last] - y[first]
+        chord_sq = chord_x * chord_x + chord_y * chord_y
+
+        # The chord is fixed within a span, so the squared cross product ranks
+        # vertices by distance; it is compared against tolerance^2 * |chord|^2.
+        dx = x[candidates] - np.repeat(x[first], group_sizes)
+        dy = y[candidates] - np.repeat(y[first], group_sizes)
+        score = dx * np.repeat(chord_y, group_sizes) - dy * np.repeat(chord_x, group_sizes)
+        score *= score
+        limit = tolerance_sq * chord_sq
+        closed = chord_sq == 0
+        if closed.any():
+            # A span that returns to its start measures plain distance from it.
+            score = np.where(np.repeat(closed, group_sizes), dx * dx + dy * dy, score)
+            limit[closed] = tolerance_sq
+
+        span_max = np.maximum.reduceat(score, group_starts)
+        splits = np.repeat(span_max > limit, group_sizes)
+        farthest = np.flatnonzero(splits & (score == np.repeat(span_max, group_sizes)))
+        # Ties within a span: split at the first farthest vertex only.
+        if len(farthest):
+            farthest = farthest[np.r_[True, span[farthest[1:]] != span[farthest[:-1]]]]
+
+        kept[candidates[farthest]] = True
+        open_points[candidates] = splits
+        open_points[candidates[farthest]] = False
+    return _restore_tolerance(all_x, all_y, survivors[kept], tolerance_sq)
+
+
+def _restore_tolerance(x, y, kept: np.ndarray, tolerance_sq: float) -> np.ndarray:
+    """
+    Split kept spans until every vertex is within tolerance of its span's
+    segment. The split rounds measure distance to the chord's line and skip
+    vertices dropped by the grid pre-pass; both can leave vertices off the
+    segment by more than the tolerance (behind an endpoint, or across a cell).
+    """
+    n = len(x)
+    while True:
+        span = np.searchsorted(kept, np.arange(n), side="right") - 1
+        first = kept[span]
+        last = kept[np.minimum(span + 1, len(kept) - 1)]
+        chord_x = x[last] - x[first]
+        chord_y = y[last] - y[first]
+        chord_sq = chord_x * chord_x + chord_y * chord_y
+        dx = x - x[first]
+        dy = y - y[first]
+        t = np.clip(
+            (dx * chord_x + dy * chord_y) / np.where(chord_sq > 0, chord_sq, 1.0), 0.0, 1.0
+        )
+        off_x = dx - t * chord_x
+        off_y = dy - t * chord_y
+        deviation = off_x * off_x + off_y * off_y
+
+        span_max = np.maximum.reduceat(deviation, kept)
+        over = span_max > tolerance_sq
+        if not over.any():
+            return kept
+        # Split each span that strays at its first farthest vertex.
+        worst = np.flatnonzero(over[span] & (deviation == span_max[span]))
+        worst = worst[np.r_[True, span[worst[1:]] != span[worst[:-1]]]]
+        kept = np.union1d(kept, worst)
+
+
+def encode_polyline(coords, precision: int = 5) -> str:
+    """
+    Google encoded-polyline string for [[lng, lat], ...] (emitted lat,lng as the
+    format expects). Deltas, zigzag and 5-bit chunking run as array operations.
+    """
+    points = as_coords(coords)
+    if not len(points):
+        return ""
+    # Round half away from zero as the reference encoder does (np.round goes to even).
+    scaled = points[:, ::-1] * 10 ** precision
+    scaled = (np.sign(scaled) * np.floor(np.abs(scaled) + 0.5)).astype(np.int64)
+    deltas = np.diff(scaled, axis=0, prepend=np.zeros((1, 2), dtype=np.int64)).ravel()
+    values = np.where(deltas < 0, ~(deltas << 1), deltas << 1)
+
+    # One column per 5-bit chunk, only as many columns as the largest value needs.
+    width = max(1, (int(values.max()).bit_length() + 4) // 5)
+    shifts = np.arange(width, dtype=np.int64) * 5
+    chunks = (values[:, None] >> shifts) & 0x1F
+    counts = 1 + np.count_nonzero((values[:, None] >> shifts[1:]) > 0, axis=1)
+    columns = np.arange(width)
+    encoded = (chunks | np.where(columns < (counts - 1)[:, None], 0x20, 0)) + 63
+    return encoded[columns < counts[:, None]].astype(np.uint8).tobytes().decode("ascii")
@@ -1,12 +1,25 @@
 """
 Split timeline by calendar day and build one DailyLog per day.
-Fills grid segments and totals for each sheet.
+Fills grid segments and totals for each sheet. Days run midnight to
+midnight in the driver's home terminal time zone when the request names
+one, else in the time zone the timeline's start time carries.
 """
 
-from collections import defaultdict
-from datetime import date, datetime, time, timedelta
+from bisect import bisect_right
+from datetime import date, datetime, time, timedelta, tzinfo
 
-from .schemas import DailyLog, DutyStatus, LogGridSegment, TimelineSegment, TripRequest
+from .schemas import (
+    CompactTimeline,
+    DailyLog,
+    DutyStatus,
+    LogGridSegment,
+    TimelineSegment,
+    TripRequest,
+    home_terminal_zone,
+    timeline_rows,
+)
+
+_MICROSECOND = timedelta(microseconds=1)
 
 
 def _segment_to_grid(seg: TimelineSegment) -> LogGridSegment:
@@ -19,105 +32,209 @@ def _segment_to_grid(seg: TimelineSegment) -> LogGridSegment:
     )
 
 
-def _split_segment_by_day(seg: TimelineSegment) -> list[tuple[date, LogGridSegment]]:
-    """Split one timeline segment into (date, LogGridSegment) for each day it touches."""
-    out = []
-    start = seg.start_time
-    end = seg.end_time
-    remaining_min = seg.duration_minutes
-
-    if isinstance(start, str):
-        start = datetime.fromisoformat(start.replace("Z", "+00:00"))
-    if isinstance(end, str):
-        end = datetime.fromisoformat(end.replace("Z", "+00:00"))
-
-    tz = getattr(start, "tzinfo", None)
-    current_start = start
-    while remaining_min > 0 and current_start < end:
-        day_start = datetime.combine(current_start.date(), time(0, 0), tzinfo=tz)
-        day_end = day_start + timedelta(days=1)
-        segment_end = min(end, day_end)
-        chunk_min = (segment_end - current_start).total_seconds() / 60
-        if chunk_min <= 0:
-            break
-        out.append(
-            (
-                current_start.date(),
+class DayBoundaries:
+    """
+    Table of local midnights of `zone`, expressed in the timeline's own
+    tzinfo so bisecting and subtracting against row datetimes is plain
+    comparison. Built from the plan start and extended a block of days at a
+    time as the timeline runs past it. Each midnight is resolved through the
+    zone, so days around DST changes are 23 or 25 hours long.
+    """
+
+    BLOCK_DAYS = 32
+
+    def __init__(self, zone: tzinfo | None, start: datetime):
+        self.timeline_tz = start.tzinfo
+        # A naive timeline has no instant to convert; its days are its own dates.
+        self.zone = zone if self.timeline_tz is not None else None
+        self.dates: list[date] = []
+        self.midnights: list[datetime] = []
+        self._extend(start.astimezone(self.zone).date() if self.zone else start.date())
+
+    def _extend(self, first: date):
+        for offset in range(self.BLOCK_DAYS + 1):
+            day = first + timedelta(days=offset)
+            if self.dates and day <= self.dates[-1]:
+                continue
+            midnight = datetime.combine(day, time(0, 0), tzinfo=self.zone)
+            if self.zone is not self.timeline_tz:
+                midnight = midnight.astimezone(self.timeline_tz)
+            self.dates.append(day)
+            self.midnights.append(midnight)
+
+    def midnight(self, day: int) -> datetime:
+        """Where day `day` starts; day 0 is the one containing start."""
+        while day >= len(self.midnights):
+            self._extend(self.dates[-1])
+        return self.midnights[day]
+
+    def day_of(self, moment: datetime) -> int:
+        """Index of the day containing moment; day i spans midnights[i] to midnights[i + 1]."""
+        while moment >= self.midnights[-1]:
+            self._extend(self.dates[-1])
+        return bisect_right(self.midnights, moment) - 1
+
+
+class LogSheetBuilder:
+    """
+    Build DailyLogs in one pass over timeline rows fed in time order.
+    Each row is cut at the current day's closing midnight, totals are kept
+    running per day, and a day is handed back as soon as a later row starts
+    past its end. Rows are cut on microsecond offsets from epoch (the
+    timeline's, or the first row's start), so nothing is parsed or sorted
+    and a grid time is built once for the segments on either side of it.
+    """
+
+    def __init__(
+        self,
+        request: TripRequest,
+        home_zone: tzinfo | None = None,
+        epoch: datetime | None = None,
+    ):
+        self.request = request
+        if home_zone is None and getattr(request, "home_terminal_timezone", None):
+            home_zone = home_terminal_zone(request.home_terminal_timezone)
+        self.home_zone = home_zone
+        self.epoch = epoch
+        self.log_count = 0
+        self._days: DayBoundaries | None = None
+        self._log_date: date | None = None
+        self._day_end_us: int | None = None
+        self._last_us: int | None = None
+        self._last_time: datetime | None = None
+        self._segments: list[LogGridSegment] = []
+        self._driving = 0.0
+        self._on_duty = 0.0
+        self._off_duty = 0.0
+        self._sleeper = 0.0
+        # Multi-stop trips name each sheet from where its day starts to the
+        # stop the driver is heading for; stops are counted as their rows pass.
+        stops = getattr(request, "stops", None)
+        self._places = [request.current_location] + [stop.location for stop in stops] if stops else None
+        self._stop_descriptions = [stop.description for stop in stops] if stops else []
+        self._stops_done = 0
+        self._day_start_stops = 0
+
+    def feed(self, row) -> list[DailyLog]:
+        """Take a (status, start, end, duration_minutes, description, ...) row of datetimes."""
+        status, start, end, remaining_min, description = row[:5]
+        if self.epoch is None:
+            self.epoch = start
+        start_us = (start - self.epoch) // _MICROSECOND
+        end_us = (end - self.epoch) // _MICROSECOND
+        return self.feed_offsets((status, start_us, end_us, remaining_min, description))
+
+    def feed_offsets(self, row) -> list[DailyLog]:
+        """feed for a row with start and end as offsets from epoch (CompactTimeline.offset_rows)."""
+        status, start_us, end_us, remaining_min, description = row[:5]
+        done = []
+        current = start_us
+        while remaining_min > 0 and current < end_us:
+            if self._day_end_us is None or current >= self._day_end_us:
+                if self._segments:
+                    done.append(self._close_day())
+                self._open_day(current)
+            segment_end = min(end_us, self._day_end_us)
+            chunk_min = (segment_end - current) / 1e6 / 60
+            if chunk_min <= 0:
+                break
+            self._segments.append(
                 LogGridSegment(
-                    status=seg.status,
-                    start_time=current_start,
-                    end_time=segment_end,
+                    status=status,
+                    start_time=self._grid_time(current),
+                    end_time=self._grid_time(segment_end),
                     duration_minutes=chunk_min,
-                    description=seg.description,
-                ),
+                    description=description,
+                )
             )
+            hrs = chunk_min / 60
+            if status == DutyStatus.DRIVING:
+                self._driving += hrs
+            elif status == DutyStatus.ON_DUTY_NOT_DRIVING:
+                self._on_duty += hrs
+            elif status == DutyStatus.OFF_DUTY:
+                self._off_duty += hrs
+            elif status == DutyStatus.SLEEPER_BERTH:
+                self._sleeper += hrs
+            remaining_min -= chunk_min
+            current = segment_end
+        if (
+            self._stops_done < len(self._stop_descriptions)
+            and description == self._stop_descriptions[self._stops_done]
+        ):
+            self._stops_done += 1
+        return done
+
+    def finish(self) -> list[DailyLog]:
+        return [self._close_day()] if self._segments else []
+
+    def _open_day(self, current_us: int):
+        moment = self.epoch + timedelta(microseconds=current_us)
+        if self._days is None:
+            self._days = DayBoundaries(self.home_zone or moment.tzinfo, moment)
+        index = self._days.day_of(moment)
+        self._log_date = self._days.dates[index]
+        self._day_end_us = (self._days.midnights[index + 1] - self.epoch) // _MICROSECOND
+        self._day_start_stops = self._stops_done
+
+    def _grid_time(self, offset_us: int) -> datetime:
+        """
+        The datetime at offset_us, in the home terminal zone when one is set.
+        A segment's end is the next one's start, so the last one is reused.
+        """
+        if offset_us != self._last_us:
+            moment = self.epoch + timedelta(microseconds=offset_us)
+            if self.home_zone is not None and moment.tzinfo is not None:
+                moment = moment.astimezone(self.home_zone)
+            self._last_us = offset_us
+            self._last_time = moment
+        return self._last_time
+
+    def _close_day(self) -> DailyLog:
+        request = self.request
+        if self._places is not None:
+            from_place = self._places[self._day_start_stops]
+            to_place = self._places[min(self._stops_done + 1, len(self._places) - 1)]
+        elif self.log_count == 0:
+            from_place = request.current_location
+            to_place = request.pickup_location
+        else:
+            from_place = request.pickup_location
+            to_place = request.dropoff_location
+        log = DailyLog(
+            log_date=self._log_date,
+            from_place=from_place,
+            to_place=to_place,
+            segments=self._segments,
+            total_driving_hours=round(self._driving, 2),
+            total_on_duty_hours=round(self._driving + self._on_duty, 2),
+            total_off_duty_hours=round(self._off_duty, 2),
+            total_sleeper_hours=round(self._sleeper, 2),
         )
-        remaining_min -= chunk_min
-        current_start = segment_end
-
-    return out
-
-
-def _totals_for_segments(segments: list[LogGridSegment]) -> tuple[float, float, float, float]:
-    driving = 0.0
-    on_duty = 0.0
-    off_duty = 0.0
-    sleeper = 0.0
-    for s in segments:
-        hrs = s.duration_minutes / 60
-        if s.status == DutyStatus.DRIVING:
-            driving += hrs
-        if s.status == DutyStatus.ON_DUTY_NOT_DRIVING:
-            on_duty += hrs
-        if s.status == DutyStatus.OFF_DUTY:
-            off_duty += hrs
-        if s.status == DutyStatus.SLEEPER_BERTH:
-            sleeper += hrs
-    return driving, on_duty, off_duty, sleeper
+        self.log_count += 1
+        self._segments = []
+        self._driving = self._on_duty = self._off_duty = self._sleeper = 0.0
+        return log
 
 
 def build_log_sheets(
-    timeline: list[TimelineSegment],
+    timeline,
     request: TripRequest,
+    home_zone: tzinfo | None = None,
 ) -> list[DailyLog]:
     """
-    Group timeline by calendar day, split segments that span midnight,
-    and build one DailyLog per day with totals.
+    Split time-ordered timeline segments at midnight and build one DailyLog
+    per day with totals. Accepts a CompactTimeline or a list of TimelineSegment.
+    home_zone overrides the request's home_terminal_timezone.
     """
-    by_day: dict[date, list[LogGridSegment]] = defaultdict(list)
-
-    for seg in timeline:
-        for d, grid_seg in _split_segment_by_day(seg):
-            by_day[d].append(grid_seg)
-
-    if not by_day:
-        return []
-
-    sorted_dates = sorted(by_day.keys())
     logs = []
-    for i, log_date in enumerate(sorted_dates):
-        segments = sorted(by_day[log_date], key=lambda s: s.start_time)
-        driving, on_duty_nd, off_duty, sleeper = _totals_for_segments(segments)
-        total_on_duty = driving + on_duty_nd
-
-        if i == 0:
-            from_place = request.current_location
-            to_place = request.pickup_location
-        else:
-            from_place = request.pickup_location
-            to_place = request.dropoff_location
-
-        logs.append(
-            DailyLog(
-                log_date=log_date,
-                from_place=from_place,
-                to_place=to_place,
-                segments=segments,
-                total_driving_hours=round(driving, 2),
-                total_on_duty_hours=round(total_on_duty, 2),
-                total_off_duty_hours=round(off_duty, 2),
-                total_sleeper_hours=round(sleeper, 2),
-            )
-        )
-
+    if isinstance(timeline, CompactTimeline):
+        builder = LogSheetBuilder(request, home_zone, timeline.epoch)
+        for row in timeline.offset_rows():
+            logs.extend(builder.feed_offsets(row))
+    else:
+        builder = LogSheetBuilder(request, home_zone)
+        for row in timeline_rows(timeline):
+            logs.extend(builder.feed(row))
+    logs.extend(builder.finish())
     return logs
@@ -1,50 +1,438 @@
 """
-Mapbox geocoding and directions. Builds a Route from a TripRequest.
+Mapbox geocoding and directions: coordinates for place names and Routes
+through waypoints (routing.py decides which backend routes a trip).
+Blocking functions use a pooled requests session; the a-prefixed
+coroutines share its caches and parsing for the async views. Names in the
+local gazetteer (GAZETTEER_PATH) are geocoded without a Mapbox call, and
+autocomplete asks Mapbox only when the gazetteer has too few matches.
 """
 
+import asyncio
+import os
+import re
+import threading
+import time
+import weakref
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from dataclasses import replace
+from datetime import timedelta
+
+import httpx
 import requests
+from asgiref.sync import sync_to_async
 from django.conf import settings
+from django.db import DatabaseError, connections
+from django.utils import timezone
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 
-from .schemas import Route, RouteLeg, TripRequest
+from . import gazetteer
+from .cache import MISSING, AsyncSingleFlight, SingleFlight, TTLCache
+from .gazetteer import normalize_query as _normalize_query
+from .schemas import Route, RouteLeg, route_from_compact, route_to_compact
 
 GEOCODE_URL = "https://api.mapbox.com/geocoding/v5/mapbox.places"
 DIRECTIONS_URL = "https://api.mapbox.com/directions/v5/mapbox/driving"
 METERS_TO_MILES = 0.000621371
 SECONDS_TO_HOURS = 1 / 3600
+GEOCODE_DB_PRUNE_EVERY = 100
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+# Mapbox and gazetteer suggestions this close (~3 miles) name the same place.
+SUGGESTION_SAME_PLACE_DEGREES = 0.05
+
+_session = None
+_session_pid = None
+_session_lock = threading.Lock()
+_async_clients: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, httpx.AsyncClient]" = (
+    weakref.WeakKeyDictionary()
+)
+
+_geocode_cache = None
+_route_cache = None
+_suggestion_cache = None
+_suggestion_flight = AsyncSingleFlight()
+_sync_suggestion_flight = SingleFlight()
+_route_flight = AsyncSingleFlight()
+_geocode_db_writes = 0
+
+
+def _get_session() -> requests.Session:
+    """
+    Keep-alive session shared by all Mapbox calls in this process. Rebuilt
+    after fork so workers never share sockets inherited from the parent.
+    """
+    global _session, _session_pid
+    pid = os.getpid()
+    if _session is None or _session_pid != pid:
+        with _session_lock:
+            if _session is None or _session_pid != pid:
+                retry = Retry(
+                    total=getattr(settings, "MAPBOX_MAX_RETRIES", 2),
+                    backoff_factor=getattr(settings, "MAPBOX_RETRY_BACKOFF_SECONDS", 0.3),
+                    status_forcelist=RETRY_STATUSES,
+                    allowed_methods=frozenset(["GET"]),
+                    respect_retry_after_header=True,
+                    raise_on_status=False,
+                )
+                pool_size = getattr(settings, "MAPBOX_POOL_SIZE", 10)
+                adapter = HTTPAdapter(
+                    pool_connections=2,
+                    pool_maxsize=pool_size,
+                    max_retries=retry,
+                )
+                session = requests.Session()
+                session.mount("https://", adapter)
+                session.mount("http://", adapter)
+                _session = session
+                _session_pid = pid
+    return _session
+
 
+def _timeout(endpoint: str) -> float:
+    if endpoint == "directions":
+        return getattr(settings, "MAPBOX_DIRECTIONS_TIMEOUT_SECONDS", 15)
+    return getattr(settings, "MAPBOX_GEOCODE_TIMEOUT_SECONDS", 10)
 
-def _geocode(query: str, token: str) -> list:
+
+def _get_async_client() -> httpx.AsyncClient:
+    """Keep-alive async client for the running event loop (one per ASGI worker)."""
+    loop = asyncio.get_running_loop()
+    client = _async_clients.get(loop)
+    if client is None:
+        pool_size = getattr(settings, "MAPBOX_ASYNC_POOL_SIZE", 100)
+        client = httpx.AsyncClient(
+            limits=httpx.Limits(
+                max_connections=pool_size,
+                max_keepalive_connections=pool_size,
+            ),
+        )
+        _async_clients[loop] = client
+    return client
+
+
+async def _aget_json(url: str, params: dict, timeout: float) -> dict:
+    """Async GET with the same retry policy as the pooled sync session."""
+    retries = getattr(settings, "MAPBOX_MAX_RETRIES", 2)
+    backoff = getattr(settings, "MAPBOX_RETRY_BACKOFF_SECONDS", 0.3)
+    attempt = 0
+    while True:
+        resp = await _get_async_client().get(url, params=params, timeout=timeout)
+        if resp.status_code not in RETRY_STATUSES or attempt >= retries:
+            resp.raise_for_status()
+            return resp.json()
+        retry_after = resp.headers.get("Retry-After", "")
+        delay = float(retry_after) if retry_after.isdigit() else backoff * (2 ** attempt)
+        attempt += 1
+        await asyncio.sleep(delay)
+
+
+def _geocode_url(query: str) -> str:
+    return f"{GEOCODE_URL}/{requests.utils.quote(query)}.json"
+
+
+def _parse_geocode(data: dict) -> list:
+    features = data.get("features", [])
+    if not features:
+        return []
+    return features[0]["center"]
+
+
+def _geocode(query: str, token: str, timeout: float | None = None) -> list:
     """Return [lng, lat] for first result, or empty list if not found."""
-    resp = requests.get(
-        f"{GEOCODE_URL}/{requests.utils.quote(query)}.json",
+    resp = _get_session().get(
+        _geocode_url(query),
         params={"access_token": token, "limit": 1, "country": "us"},
-        timeout=10,
+        timeout=timeout or _timeout("geocode"),
     )
     resp.raise_for_status()
-    data = resp.json()
-    features = data.get("features", [])
-    if not features:
+    return _parse_geocode(resp.json())
+
+
+async def _ageocode(query: str, token: str, timeout: float | None = None) -> list:
+    data = await _aget_json(
+        _geocode_url(query),
+        {"access_token": token, "limit": 1, "country": "us"},
+        timeout or _timeout("geocode"),
+    )
+    return _parse_geocode(data)
+
+
+def _get_geocode_cache() -> TTLCache:
+    global _geocode_cache
+    if _geocode_cache is None:
+        _geocode_cache = TTLCache(
+            "geocode",
+            max_entries=getattr(settings, "GEOCODE_CACHE_MAX_ENTRIES", 5000),
+            ttl_seconds=getattr(settings, "GEOCODE_CACHE_TTL_SECONDS", 7 * 24 * 3600),
+        )
+    return _geocode_cache
+
+
+def _persistent_cache_enabled(key: str) -> bool:
+    return bool(getattr(settings, "GEOCODE_CACHE_PERSISTENT", False)) and len(key) <= 255
+
+
+def _db_cache_get(key: str):
+    """Return [lng, lat] / [] from the shared tier, or MISSING if absent or expired."""
+    from .models import GeocodeCacheEntry
+
+    ttl = getattr(settings, "GEOCODE_CACHE_TTL_SECONDS", 7 * 24 * 3600)
+    try:
+        entry = GeocodeCacheEntry.objects.filter(
+            query=key,
+            created_at__gte=timezone.now() - timedelta(seconds=ttl),
+        ).first()
+    except DatabaseError:
+        return MISSING
+    if entry is None:
+        return MISSING
+    if entry.lng is None or entry.lat is None:
         return []
-    return features[0]["center"]
+    return [entry.lng, entry.lat]
+
 
+def _db_cache_set(key: str, coords: list):
+    global _geocode_db_writes
+    from .models import GeocodeCacheEntry
 
-def search_places(query: str, token: str, limit: int = 5) -> list[dict]:
-    """Return autocomplete place suggestions for location inputs."""
+    lng, lat = (coords[0], coords[1]) if coords else (None, None)
+    try:
+        GeocodeCacheEntry.objects.update_or_create(
+            query=key,
+            defaults={"lng": lng, "lat": lat, "created_at": timezone.now()},
+        )
+        _geocode_db_writes += 1
+        if _geocode_db_writes % GEOCODE_DB_PRUNE_EVERY == 0:
+            _db_cache_prune()
+    except DatabaseError:
+        pass
+
+
+def _db_cache_prune():
+    """Drop expired rows, then the oldest rows beyond the configured size limit."""
+    from .models import GeocodeCacheEntry
+
+    ttl = getattr(settings, "GEOCODE_CACHE_TTL_SECONDS", 7 * 24 * 3600)
+    max_entries = getattr(settings, "GEOCODE_CACHE_DB_MAX_ENTRIES", 100000)
+    GeocodeCacheEntry.objects.filter(
+        created_at__lt=timezone.now() - timedelta(seconds=ttl)
+    ).delete()
+    overflow = list(
+        GeocodeCacheEntry.objects.order_by("-created_at")
+        .values_list("created_at", flat=True)[max_entries : max_entries + 1]
+    )
+    if overflow:
+        GeocodeCacheEntry.objects.filter(created_at__lte=overflow[0]).delete()
+
+
+def geocode(query: str, token: str, use_cache: bool = True, timeout: float | None = None) -> list:
+    """
+    Cached front for _geocode: the local gazetteer, then the in-process LRU,
+    then the shared database tier, then Mapbox. use_cache=False skips both
+    cache tiers for lookup but refreshes them. Without a token only the
+    gazetteer can answer; other queries return [].
+    """
+    key = _normalize_query(query)
+    coords = gazetteer.lookup(key)
+    if coords or not token:
+        return coords
+    cache = _get_geocode_cache()
+    persistent = _persistent_cache_enabled(key)
+
+    if use_cache:
+        coords = cache.get(key)
+        if coords is not MISSING:
+            return list(coords)
+        if persistent:
+            coords = _db_cache_get(key)
+            if coords is not MISSING:
+                cache.set(key, tuple(coords))
+                return coords
+
+    coords = _geocode(query, token, timeout=timeout)
+    cache.set(key, tuple(coords))
+    if persistent:
+        _db_cache_set(key, coords)
+    return coords
+
+
+async def ageocode(
+    query: str,
+    token: str,
+    use_cache: bool = True,
+    timeout: float | None = None,
+) -> list:
+    """Async geocode with the same tiers; the database tier runs in a thread."""
+    key = _normalize_query(query)
+    coords = gazetteer.lookup(key)
+    if coords or not token:
+        return coords
+    cache = _get_geocode_cache()
+    persistent = _persistent_cache_enabled(key)
+
+    if use_cache:
+        coords = cache.get(key)
+        if coords is not MISSING:
+            return list(coords)
+        if persistent:
+            coords = await sync_to_async(_db_cache_get)(key)
+            if coords is not MISSING:
+                cache.set(key, tuple(coords))
+                return coords
+
+    coords = await _ageocode(query, token, timeout=timeout)
+    cache.set(key, tuple(coords))
+    if persistent:
+        await sync_to_async(_db_cache_set)(key, coords)
+    return coords
+
+
+def _suggestion_params(token: str, limit: int) -> dict:
+    return {
+        "access_token": token,
+        "limit": limit,
+        "autocomplete": "true",
+        "types": "place,address,postcode",
+        "country": "us",
+    }
+
+
+def _get_suggestion_cache() -> TTLCache:
+    global _suggestion_cache
+    if _suggestion_cache is None:
+        _suggestion_cache = TTLCache(
+            "places",
+            max_entries=getattr(settings, "PLACES_CACHE_MAX_ENTRIES", 20000),
+            ttl_seconds=getattr(settings, "PLACES_CACHE_TTL_SECONDS", 24 * 3600),
+        )
+    return _suggestion_cache
+
+
+def _matches_query(name: str, tokens: list[str]) -> bool:
+    words = re.findall(r"[a-z0-9]+", name.lower())
+    return all(any(word.startswith(token) for word in words) for token in tokens)
+
+
+def _cached_suggestions(key: str, limit: int):
+    """
+    Exact cache hit, else reuse a cached shorter prefix whose result list was
+    below the limit (so it held every match) filtered down to this query.
+    Returns None when neither applies.
+    """
+    cache = _get_suggestion_cache()
+    suggestions = cache.get((key, limit))
+    if suggestions is not MISSING:
+        return list(suggestions)
+
+    tokens = re.findall(r"[a-z0-9]+", key)
+    for end in range(len(key) - 1, 1, -1):
+        superset = cache.peek((key[:end], limit))
+        if superset is MISSING or len(superset) >= limit:
+            continue
+        suggestions = [s for s in superset if _matches_query(s["name"], tokens)]
+        if suggestions or not superset:
+            cache.set((key, limit), tuple(suggestions))
+            return suggestions
+        return None
+    return None
+
+
+def _merge_suggestions(local: list[dict], remote, limit: int) -> list[dict]:
+    """
+    Gazetteer suggestions first, then Mapbox ones up to limit. A Mapbox place
+    within SUGGESTION_SAME_PLACE_DEGREES of a gazetteer one is the same place
+    under its longer name ("Dallas, Texas, United States") and is dropped.
+    """
+    merged = list(local)
+    for suggestion in remote:
+        if len(merged) >= limit:
+            break
+        lng, lat = suggestion["coordinates"][:2]
+        if not any(
+            abs(lng - place["coordinates"][0]) <= SUGGESTION_SAME_PLACE_DEGREES
+            and abs(lat - place["coordinates"][1]) <= SUGGESTION_SAME_PLACE_DEGREES
+            for place in local
+        ):
+            merged.append(suggestion)
+    return merged
+
+
+def _fetch_suggestions(query: str, token: str, limit: int) -> tuple:
+    resp = _get_session().get(
+        _geocode_url(query),
+        params=_suggestion_params(token, limit),
+        timeout=_timeout("geocode"),
+    )
+    resp.raise_for_status()
+    suggestions = tuple(_parse_suggestions(resp.json()))
+    _get_suggestion_cache().set((_normalize_query(query), limit), suggestions)
+    return suggestions
+
+
+def search_places(query: str, token: str, limit: int = 5, use_cache: bool = True) -> list[dict]:
+    """
+    Return autocomplete place suggestions for location inputs. Gazetteer
+    matches come first; when there are fewer than limit of them, Mapbox
+    suggestions fill the rest (never without a token). Threads asking for
+    the same query at once share one upstream call.
+    """
     if not query.strip():
         return []
-    resp = requests.get(
-        f"{GEOCODE_URL}/{requests.utils.quote(query)}.json",
-        params={
-            "access_token": token,
-            "limit": max(1, min(int(limit), 10)),
-            "autocomplete": "true",
-            "types": "place,address,postcode",
-            "country": "us",
-        },
-        timeout=10,
+    limit = max(1, min(int(limit), 10))
+    key = _normalize_query(query)
+    local = gazetteer.complete(key, limit)
+    if len(local) >= limit or not token:
+        return local
+    if not use_cache:
+        suggestions = _fetch_suggestions(query, token, limit)
+    else:
+        suggestions = _cached_suggestions(key, limit)
+        if suggestions is None:
+            suggestions = _sync_suggestion_flight.do(
+                (key, limit),
+                lambda: _fetch_suggestions(query, token, limit),
+            )
+    return _merge_suggestions(local, suggestions, limit)
+
+
+async def _afetch_suggestions(query: str, token: str, limit: int) -> tuple:
+    data = await _aget_json(
+        _geocode_url(query),
+        _suggestion_params(token, limit),
+        _timeout("geocode"),
     )
-    resp.raise_for_status()
-    data = resp.json()
+    suggestions = tuple(_parse_suggestions(data))
+    _get_suggestion_cache().set((_normalize_query(query), limit), suggestions)
+    return suggestions
+
+
+async def asearch_places(
+    query: str,
+    token: str,
+    limit: int = 5,
+    use_cache: bool = True,
+) -> list[dict]:
+    """Async search_places; identical queries already in flight share one upstream call."""
+    if not query.strip():
+        return []
+    limit = max(1, min(int(limit), 10))
+    key = _normalize_query(query)
+    local = gazetteer.complete(key, limit)
+    if len(local) >= limit or not token:
+        return local
+    if not use_cache:
+        suggestions = await _afetch_suggestions(query, token, limit)
+    else:
+        suggestions = _cached_suggestions(key, limit)
+        if suggestions is None:
+            suggestions = await _suggestion_flight.do(
+                (key, limit),
+                lambda: _afetch_suggestions(query, token, limit),
+            )
+    return _merge_suggestions(local, suggestions, limit)
+
+
+def _parse_suggestions(data: dict) -> list[dict]:
     features = data.get("features", [])
     return [
         {
@@ -61,32 +449,76 @@ def _coords_to_str(coords: list) -> str:
     return ";".join(f"{c[0]},{c[1]}" for c in coords)
 
 
-def get_route(request: TripRequest, token: str = ""):
+def _get_route_cache() -> TTLCache:
+    global _route_cache
+    if _route_cache is None:
+        _route_cache = TTLCache(
+            "directions",
+            max_entries=getattr(settings, "ROUTE_CACHE_MAX_ENTRIES", 500),
+            ttl_seconds=getattr(settings, "ROUTE_CACHE_TTL_SECONDS", 6 * 3600),
+        )
+    return _route_cache
+
+
+def _route_cache_key(waypoints: list) -> tuple:
+    """Waypoints rounded to ROUTE_CACHE_PRECISION decimal places (4 is ~11 m)."""
+    precision = getattr(settings, "ROUTE_CACHE_PRECISION", 4)
+    return tuple((round(c[0], precision), round(c[1], precision)) for c in waypoints)
+
+
+def _waypoint_chunks(waypoints: list) -> list[list]:
     """
-    Geocode current, pickup, dropoff; get driving directions; return Route.
-    Returns None if geocoding or directions fail.
+    Consecutive slices of at most DIRECTIONS_MAX_WAYPOINTS (the upstream
+    limit per request), each starting at the waypoint the previous one ends on.
     """
-    token = (token or getattr(settings, "MAPBOX_ACCESS_TOKEN", "") or "").strip()
-    if not token:
-        return None
+    size = max(2, getattr(settings, "DIRECTIONS_MAX_WAYPOINTS", 25))
+    if len(waypoints) <= size:
+        return [waypoints]
+    return [waypoints[i : i + size] for i in range(0, len(waypoints) - 1, size - 1)]
+
+
+def _join_routes(routes: list[Route], waypoints: list) -> Route:
+    """One Route through all waypoints from the routes of consecutive chunks."""
+    geometry = []
+    for route in routes:
+        # Each chunk starts on the vertex the previous one ends on.
+        geometry.extend(route.geometry[1:] if geometry else route.geometry)
+    return Route(
+        geometry=geometry,
+        distance_miles=sum(route.distance_miles for route in routes),
+        duration_hours=sum(route.duration_hours for route in routes),
+        legs=[leg for route in routes for leg in route.legs],
+        waypoints=waypoints,
+    )
 
-    current = request.current_location_coords or _geocode(request.current_location, token)
-    pickup = request.pickup_location_coords or _geocode(request.pickup_location, token)
-    dropoff = request.dropoff_location_coords or _geocode(request.dropoff_location, token)
-    if not current or not pickup or not dropoff:
-        return None
 
-    coords = _coords_to_str([current, pickup, dropoff])
-    resp = requests.get(
-        f"{DIRECTIONS_URL}/{coords}",
+def _fetch_directions(waypoints: list, token: str):
+    """Call Mapbox Directions for the waypoints; return Route or None if no route."""
+    resp = _get_session().get(
+        f"{DIRECTIONS_URL}/{_coords_to_str(waypoints)}",
         params={
             "access_token": token,
             "geometries": "geojson",
         },
-        timeout=15,
+        timeout=_timeout("directions"),
     )
     resp.raise_for_status()
-    data = resp.json()
+    return _parse_directions(resp.json(), waypoints)
+
+
+async def _afetch_directions(waypoints: list, token: str):
+    data = await _aget_json(
+        f"{DIRECTIONS_URL}/{_coords_to_str(waypoints)}",
+        {
+            "access_token": token,
+            "geometries": "geojson",
+        },
+        _timeout("directions"),
+    )
+    return _parse_directions(data, waypoints)
+
+
+def _parse_directions(data: dict, waypoints: list):
     routes = data.get("routes", [])
     if not routes:
         return None
@@ -116,5 +548,198 @@ def get_route(request: TripRequest, token: str = ""):
         distance_miles=distance_miles,
         duration_hours=duration_hours,
         legs=legs,
-        waypoints=[current, pickup, dropoff],
+        waypoints=waypoints,
     )
+
+
+def _geocode_in_thread(query: str, token: str, use_cache: bool, timeout: float) -> list:
+    try:
+        return geocode(query, token, use_cache, timeout=timeout)
+    finally:
+        # Pool threads open their own DB connection for the shared cache tier.
+        connections.close_all()
+
+
+def geocode_locations(locations: list, token: str, use_cache: bool):
+    """
+    Resolve (query, coords) pairs to [lng, lat], geocoding the ones without
+    coords concurrently under one GEOCODE_DEADLINE_SECONDS deadline.
+    Returns None as soon as any lookup finds nothing or the deadline passes;
+    outstanding lookups are cancelled. Upstream errors propagate.
+    """
+    resolved = [coords or None for _, coords in locations]
+    pending: dict[str, list[int]] = {}
+    for i, (query, coords) in enumerate(locations):
+        if not coords:
+            pending.setdefault(_normalize_query(query), []).append(i)
+    if not pending:
+        return resolved
+
+    deadline_s = getattr(settings, "GEOCODE_DEADLINE_SECONDS", 10)
+    timeout = min(deadline_s, _timeout("geocode"))
+    if len(pending) == 1:
+        (indexes,) = pending.values()
+        coords = geocode(locations[indexes[0]][0], token, use_cache, timeout=timeout)
+        if not coords:
+            return None
+        for i in indexes:
+            resolved[i] = coords
+        return resolved
+
+    deadline = time.monotonic() + deadline_s
+    executor = ThreadPoolExecutor(max_workers=len(pending), thread_name_prefix="geocode")
+    try:
+        futures = {
+            executor.submit(
+                _geocode_in_thread,
+                locations[indexes[0]][0],
+                token,
+                use_cache,
+                timeout,
+            ): indexes
+            for indexes in pending.values()
+        }
+        not_done = set(futures)
+        while not_done:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return None
+            done, not_done = wait(not_done, timeout=remaining, return_when=FIRST_COMPLETED)
+            for future in done:
+                coords = future.result()
+                if not coords:
+                    return None
+                for i in futures[future]:
+                    resolved[i] = coords
+        return resolved
+    finally:
+        executor.shutdown(wait=False, cancel_futures=True)
+
+
+async def ageocode_many(
+    queries: list[str],
+    token: str,
+    use_cache: bool = True,
+    concurrency: int = 8,
+) -> dict[str, list]:
+    """
+    Geocode each distinct query once (by normalized text), at most
+    `concurrency` lookups at a time. Returns {query: [lng, lat]}, with []
+    for queries that were not found or whose lookup failed.
+    """
+    semaphore = asyncio.Semaphore(max(1, concurrency))
+    by_key: dict[str, str] = {}
+    for query in queries:
+        by_key.setdefault(_normalize_query(query), query)
+
+    async def lookup(query: str) -> list:
+        async with semaphore:
+            try:
+                return await ageocode(query, token, use_cache)
+            except (httpx.HTTPError, ValueError):
+                return []
+
+    keys = list(by_key)
+    results = await asyncio.gather(*(lookup(by_key[key]) for key in keys))
+    coords_by_key = dict(zip(keys, results))
+    return {query: coords_by_key[_normalize_query(query)] for query in queries}
+
+
+async def ageocode_locations(locations: list, token: str, use_cache: bool):
+    """Async geocode_locations: lookups run as tasks under the same deadline."""
+    resolved = [coords or None for _, coords in locations]
+    pending: dict[str, list[int]] = {}
+    for i, (query, coords) in enumerate(locations):
+        if not coords:
+            pending.setdefault(_normalize_query(query), []).append(i)
+    if not pending:
+        return resolved
+
+    deadline_s = getattr(settings, "GEOCODE_DEADLINE_SECONDS", 10)
+    timeout = min(deadline_s, _timeout("geocode"))
+    deadline = time.monotonic() + deadline_s
+    tasks = {
+        asyncio.ensure_future(
+            ageocode(locations[indexes[0]][0], token, use_cache, timeout=timeout)
+        ): indexes
+        for indexes in pending.values()
+    }
+    not_done = set(tasks)
+    try:
+        while not_done:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return None
+            done, not_done = await asyncio.wait(
+                not_done,
+                timeout=remaining,
+                return_when=asyncio.FIRST_COMPLETED,
+            )
+            for task in done:
+                coords = task.result()
+                if not coords:
+                    return None
+                for i in tasks[task]:
+                    resolved[i] = coords
+        return resolved
+    finally:
+        for task in not_done:
+            task.cancel()
+
+
+def route_waypoints(waypoints: list, token: str, use_cache: bool = True):
+    """
+    Driving directions through [lng, lat] waypoints as a Route, or None if
+    there is no route. More waypoints than one request takes are routed in
+    chunks (see _waypoint_chunks) and joined.
+    """
+    chunks = _waypoint_chunks(waypoints)
+    if len(chunks) > 1:
+        routes = [route_waypoints(chunk, token, use_cache) for chunk in chunks]
+        if any(route is None for route in routes):
+            return None
+        return _join_routes(routes, waypoints)
+
+    key = _route_cache_key(waypoints)
+    cache = _get_route_cache()
+    cached = cache.get(key) if use_cache else MISSING
+    if cached is not MISSING:
+        return route_from_compact(cached, waypoints)
+
+    route = _fetch_directions(waypoints, token)
+    if route is None:
+        return None
+    cache.set(key, route_to_compact(route))
+    return route
+
+
+async def aroute_waypoints(waypoints: list, token: str, use_cache: bool = True):
+    """Async route_waypoints; the chunks of a long stop list are fetched concurrently."""
+    chunks = _waypoint_chunks(waypoints)
+    if len(chunks) > 1:
+        routes = await asyncio.gather(
+            *(aroute_waypoints(chunk, token, use_cache) for chunk in chunks)
+        )
+        if any(route is None for route in routes):
+            return None
+        return _join_routes(routes, waypoints)
+
+    key = _route_cache_key(waypoints)
+    cache = _get_route_cache()
+    cached = cache.get(key) if use_cache else MISSING
+    if cached is not MISSING:
+        return route_from_compact(cached, waypoints)
+
+    async def fetch():
+        fetched = await _afetch_directions(waypoints, token)
+        if fetched is not None:
+            cache.set(key, route_to_compact(fetched))
+        return fetched
+
+    route = await _route_flight.do(key, fetch)
+    if route is None:
+        return None
+    if route.waypoints is not waypoints:
+        # Coalesced with a concurrent request for the same lane.
+        route = replace(route, waypoints=waypoints)
+    return route
@@ -1 +1,13 @@
 from django.db import models
+
+
+class GeocodeCacheEntry(models.Model):
+    """Shared geocode result keyed on normalized query text; null coords = not found."""
+
+    query = models.CharField(max_length=255, unique=True)
+    lng = models.FloatField(null=True, blank=True)
+    lat = models.FloatField(null=True, blank=True)
+    created_at = models.DateTimeField(db_index=True)
+
+    def __str__(self):
+        return self.query
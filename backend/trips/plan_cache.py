@@ -0,0 +1,104 @@
+"""
+Whole-plan response cache for /api/plan/. A plan body is stored under a
+hash of the canonical trip request (location text normalized, coordinates
+rounded, start time bucketed to PLAN_CACHE_START_BUCKET_MINUTES) in the
+"plans" Django cache, so a repeat submission skips geocoding, routing, the
+engine and the encoder. Within a bucket, repeats get the plan computed for
+the first request's start time. A cached body carries the plan_id its plan
+was stored under once in the plan store, and every hit shares it (a re-plan
+never changes the stored plan, it stores a new one). The ETag covers the
+body without plan_id, so it is weak: a recomputed plan under another
+plan_id still matches.
+"""
+
+import hashlib
+import json
+
+from django.conf import settings
+from django.core.cache import caches
+
+from .gazetteer import normalize_query
+from .schemas import GeometryOptions, TripRequest
+
+KEY_PREFIX = "trips:plan-body:"
+# Bump when the plan body format changes so old entries are not served.
+KEY_VERSION = 3
+
+
+def _ttl_seconds() -> int:
+    return getattr(settings, "PLAN_CACHE_TTL_SECONDS", 300)
+
+
+def enabled() -> bool:
+    return _ttl_seconds() > 0
+
+
+def _cache():
+    return caches[getattr(settings, "PLAN_CACHE_ALIAS", "default")]
+
+
+def _coords_key(coords):
+    if not coords:
+        return None
+    precision = getattr(settings, "ROUTE_CACHE_PRECISION", 4)
+    return [round(float(coords[0]), precision), round(float(coords[1]), precision)]
+
+
+def plan_key(trip: TripRequest, geometry_options: GeometryOptions | None = None) -> str:
+    """Cache key for the plan body of trip; equal for requests that plan alike."""
+    bucket_s = max(1, getattr(settings, "PLAN_CACHE_START_BUCKET_MINUTES", 15)) * 60
+    start = trip.start_time
+    offset = start.utcoffset()
+    canonical = {
+        "v": KEY_VERSION,
+        "start_bucket": int(start.timestamp() // bucket_s),
+        # Log sheet days follow the start time's zone when no home zone is set.
+        "utc_offset_s": int(offset.total_seconds()) if offset is not None else None,
+        "home_tz": trip.home_terminal_timezone,
+        "cycle_used_hrs": trip.current_cycle_used_hrs,
+        "cycle_history_hrs": trip.cycle_history_hrs,
+        "current": [normalize_query(trip.current_location), _coords_key(trip.current_location_coords)],
+        "stops": [
+            [normalize_query(stop.location), _coords_key(stop.coords), stop.kind, stop.dwell_minutes]
+            for stop in trip.trip_stops
+        ],
+        "geometry": (
+            [geometry_options.format, geometry_options.zoom, geometry_options.leg_geometry]
+            if geometry_options is not None
+            else None
+        ),
+        # Server modes that change the plan for the same request.
+        "routing": getattr(settings, "ROUTING_BACKEND", "mapbox"),
+        "pois": [getattr(settings, "POI_PATH", ""), getattr(settings, "POI_CORRIDOR_MILES", 3.0)],
+    }
+    digest = hashlib.sha256(
+        json.dumps(canonical, sort_keys=True, separators=(",", ":")).encode()
+    ).hexdigest()
+    return KEY_PREFIX + digest
+
+
+def etag_for(body: bytes) -> str:
+    return 'W/"%s"' % hashlib.blake2b(body, digest_size=16).hexdigest()
+
+
+def etag_matches(if_none_match: str | None, etag: str) -> bool:
+    """Whether an If-None-Match header value names etag (weak comparison, as for GET)."""
+    if not if_none_match:
+        return False
+    opaque = etag.removeprefix("W/")
+    tags = [tag.strip() for tag in if_none_match.split(",")]
+    return "*" in tags or any(tag.removeprefix("W/") == opaque for tag in tags)
+
+
+async def aget_plan(key: str) -> tuple[bytes, str] | None:
+    """(body, etag) stored under key, or None when absent or expired."""
+    return await _cache().aget(key)
+
+
+async def asave_plan(key: str, body: bytes, etag: str, max_ttl_seconds: int | None = None):
+    """
+    Store a plan body and its ETag under key. max_ttl_seconds caps the
+    lifetime, so a body does not outlive the stored plan its plan_id names.
+    """
+    ttl = _ttl_seconds() if max_ttl_seconds is None else min(_ttl_seconds(), max_ttl_seconds)
+    await _cache().aset(key, (body, etag), timeout=ttl)
@@ -0,0 +1,65 @@
+"""
+Keep recent plans in a cache every worker can read so /api/plan/replan/ can
+resume them whichever worker handles it. PLAN_STORE_CACHE names the Django
+cache alias; by default a database table (see settings), or redis. Routes
+are stored as flat coordinate arrays (see schemas.route_to_compact);
+the timeline is already columnar.
+"""
+
+import uuid
+from dataclasses import replace
+
+from django.conf import settings
+from django.core.cache import caches
+
+from .planner import PlanRecord
+from .schemas import route_from_compact, route_to_compact
+
+KEY_PREFIX = "trips:plan:"
+
+
+def ttl_seconds() -> int:
+    return getattr(settings, "PLAN_STORE_TTL_SECONDS", 24 * 3600)
+
+
+def _cache():
+    return caches[getattr(settings, "PLAN_STORE_CACHE", "default")]
+
+
+def enabled() -> bool:
+    return ttl_seconds() > 0
+
+
+def new_plan_id() -> str:
+    return uuid.uuid4().hex
+
+
+def pack_record(record: PlanRecord) -> PlanRecord:
+    """record with its route in compact form, as it is stored."""
+    compact_route = (route_to_compact(record.route), record.route.waypoints)
+    return replace(record, route=compact_route)
+
+
+def unpack_record(stored: PlanRecord) -> PlanRecord:
+    compact_route, waypoints = stored.route
+    return replace(stored, route=route_from_compact(compact_route, waypoints))
+
+
+def save_plan(plan_id: str, record: PlanRecord):
+    _cache().set(KEY_PREFIX + plan_id, pack_record(record), timeout=ttl_seconds())
+
+
+def load_plan(plan_id: str) -> PlanRecord | None:
+    """The stored plan, or None when the id is unknown or has expired."""
+    stored = _cache().get(KEY_PREFIX + plan_id)
+    return None if stored is None else unpack_record(stored)
+
+
+async def asave_plan(plan_id: str, record: PlanRecord):
+    """Async save_plan (database-backed caches run in a thread)."""
+    await _cache().aset(KEY_PREFIX + plan_id, pack_record(record), timeout=ttl_seconds())
+
+
+async def aload_plan(plan_id: str) -> PlanRecord | None:
+    stored = await _cache().aget(KEY_PREFIX + plan_id)
+    return None if stored is None else unpack_record(stored)
@@ -0,0 +1,554 @@
+"""
+Assemble a plan response (route, placed stops, daily logs) from a trip
+request and its route. Kept free of Django imports so the batch endpoint
+can run it in worker processes.
+"""
+
+import asyncio
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from dataclasses import dataclass, field, replace
+from datetime import datetime, timedelta
+from itertools import islice
+from typing import Iterator
+
+from .encoders import encode_plan, encode_plan_line
+from .geometry import GeometryIndex
+from .log_sheet_generator import LogSheetBuilder, build_log_sheets
+from .schemas import (
+    STATUS_BY_CODE,
+    CompactTimeline,
+    DutyStatus,
+    GeometryOptions,
+    Route,
+    RouteLeg,
+    TripRequest,
+    timeline_rows,
+)
+from .serializers import (
+    daily_log_to_dict,
+    route_to_dict,
+    timeline_row_to_dict,
+)
+from .timeline_engine import (
+    FUEL_STOP_DESCRIPTION,
+    HOSSnapshot,
+    TripLeg,
+    build_timeline,
+    initial_state,
+    iter_timeline,
+    remaining_legs,
+    replay_row,
+    request_legs,
+    resume_timeline,
+    trip_legs,
+)
+
+_process_pool = None
+_process_pool_pid = None
+
+
+class StopPlacer:
+    """
+    Serialize non-driving timeline rows fed in time order and work out where
+    each stop sits. The service stop ending each leg (pickup, dropoff or any
+    stop of a multi-stop trip) uses the waypoint the leg drives to; a stop
+    the engine moved to one of the leg's stop sites uses that truck stop or
+    rest area (named in item["poi"]); other stops sit at the miles driven so
+    far on the active leg, measured along the leg polyline with great-circle
+    lengths. With an epoch, rows carry start and end as microsecond offsets
+    from it (CompactTimeline.offset_rows) and only stop rows get datetimes.
+    """
+
+    def __init__(
+        self,
+        route: Route,
+        legs: list[TripLeg] | None = None,
+        epoch: datetime | None = None,
+    ):
+        self.route = route
+        self.epoch = epoch
+        self.legs = legs if legs is not None else trip_legs(route)
+        self.leg_miles = [leg.distance_miles or 0.0 for leg in (route.legs or [])]
+        self.driven_leg_miles = [0.0 for _ in self.leg_miles]
+        self.active_leg = 0
+        self.total_miles = sum(self.leg_miles) if self.leg_miles else (route.distance_miles or 0.0)
+        self.cumulative_miles = 0.0
+        self._indexes: dict[int, GeometryIndex] = {}
+
+    def locate(self, row):
+        """
+        (item, placement) for a stop row, or None for driving rows.
+        placement is (geometry, miles, road_miles) when the stop must be
+        interpolated along a polyline, else None and item["coordinates"] is set.
+        """
+        route = self.route
+        status, _, _, _, description, distance_miles = row
+        if status == DutyStatus.DRIVING:
+            self.cumulative_miles += distance_miles
+            if self.driven_leg_miles:
+                idx = min(self.active_leg, len(self.driven_leg_miles) - 1)
+                self.driven_leg_miles[idx] += distance_miles
+            return None
+
+        if self.epoch is None:
+            item = timeline_row_to_dict(*row[:5])
+        else:
+            start_us, end_us, duration_minutes = row[1:4]
+            item = timeline_row_to_dict(
+                status,
+                self.epoch + timedelta(microseconds=start_us),
+                self.epoch + timedelta(microseconds=end_us),
+                duration_minutes,
+                description,
+            )
+        item["coordinates"] = None
+        placement = None
+        service_stop = (
+            self.active_leg < len(self.legs)
+            and description == self.legs[self.active_leg].stop_description
+        )
+
+        site = None if service_stop else self._site_here()
+        if service_stop and self.active_leg + 1 < len(route.waypoints):
+            item["coordinates"] = route.waypoints[self.active_leg + 1]
+        elif site is not None:
+            sites, i = site
+            item["coordinates"] = sites.coords[i]
+            item["poi"] = {"name": sites.names[i], "kind": sites.kinds[i]}
+        elif route.legs and self.driven_leg_miles:
+            idx = min(self.active_leg, len(route.legs) - 1)
+            leg = route.legs[idx]
+            if self.leg_miles[idx] > 0:
+                if leg.geometry:
+                    placement = (leg.geometry, self.driven_leg_miles[idx], self.leg_miles[idx])
+                elif route.geometry:
+                    # Leg geometry missing from the directions payload: place by
+                    # miles from the route start along the full geometry instead.
+                    miles_before_leg = sum(self.leg_miles[:idx])
+                    placement = (
+                        route.geometry,
+                        miles_before_leg + self.driven_leg_miles[idx],
+                        self.total_miles,
+                    )
+            elif route.geometry:
+                placement = (route.geometry, self.cumulative_miles, self.total_miles)
+        elif route.geometry:
+            placement = (route.geometry, self.cumulative_miles, self.total_miles)
+
+        if service_stop:
+            self.active_leg += 1
+        return item, placement
+
+    def _site_here(self):
+        """(sites, index) of the active leg's stop site at the miles driven on it, or None."""
+        idx = self.active_leg
+        if idx >= len(self.legs) or idx >= len(self.driven_leg_miles):
+            return None
+        sites = self.legs[idx].sites
+        if not sites:
+            return None
+        i = sites.at(self.driven_leg_miles[idx])
+        return (sites, i) if i is not None else None
+
+    def index(self, geometry) -> GeometryIndex:
+        index = self._indexes.get(id(geometry))
+        if index is None:
+            index = self._indexes[id(geometry)] = GeometryIndex(geometry)
+        return index
+
+    @staticmethod
+    def scale(index: GeometryIndex, road_miles: float) -> float:
+        """
+        Polyline length per road mile. The two differ slightly; scaling makes
+        the end of the road distance land on the end of the line.
+        """
+        return index.total_length / road_miles if road_miles > 0 else 0.0
+
+    def place(self, geometry, miles: list, road_miles: float) -> list:
+        """Points at the given road miles along geometry, in one vectorized lookup."""
+        index = self.index(geometry)
+        scale = self.scale(index, road_miles)
+        return index.points_at_distance([m * scale for m in miles])
+
+    def feed(self, row):
+        """Stop item for a row with coordinates filled in now, or None for driving rows."""
+        located = self.locate(row)
+        if located is None:
+            return None
+        item, placement = located
+        if placement is not None:
+            geometry, miles, road_miles = placement
+            index = self.index(geometry)
+            item["coordinates"] = index.point_at_distance(miles * self.scale(index, road_miles))
+        return item
+
+
+def _place_stops(
+    rows,
+    route: Route,
+    legs: list[TripLeg] | None = None,
+    epoch: datetime | None = None,
+) -> list:
+    placer = StopPlacer(route, legs, epoch)
+    items = []
+    pending: dict[int, tuple[list, list, list, float]] = {}
+
+    for row in rows:
+        located = placer.locate(row)
+        if located is None:
+            continue
+        item, placement = located
+        items.append(item)
+        if placement is not None:
+            geometry, miles, road_miles = placement
+            _, queued_items, queued_miles, _ = pending.setdefault(
+                id(geometry), (geometry, [], [], road_miles)
+            )
+            queued_items.append(item)
+            queued_miles.append(miles)
+
+    for geometry, queued_items, queued_miles, road_miles in pending.values():
+        for item, point in zip(queued_items, placer.place(geometry, queued_miles, road_miles)):
+            item["coordinates"] = point
+
+    return items
+
+
+def build_stops_and_rests(timeline, route, legs: list[TripLeg] | None = None):
+    """
+    Serialize non-driving timeline segments and attach coordinates (see
+    StopPlacer). Interpolated stops are placed per polyline in one batch.
+    legs are the engine legs the timeline drove (default: pickup, dropoff).
+    """
+    if isinstance(timeline, CompactTimeline):
+        return _place_stops(timeline.offset_rows(), route, legs, timeline.epoch)
+    return _place_stops(timeline_rows(timeline), route, legs)
+
+
+@dataclass
+class PlanRecord:
+    """
+    What a re-plan needs from an earlier plan. route is the route the plan
+    drives from row route_start_row on (the whole trip for a fresh plan, the
+    remainder from the checkpoint for a re-plan), legs are its engine legs,
+    and prefix_stops are the stops already placed for the rows before it.
+    """
+
+    request: TripRequest
+    route: Route
+    legs: list[TripLeg]
+    timeline: CompactTimeline
+    route_start_row: int = 0
+    prefix_stops: list = field(default_factory=list)
+
+
+@dataclass
+class ReplanCheckpoint:
+    """
+    A plan cut at a moment: the rows kept verbatim (a drive in progress is
+    cut short; a stop or rest in progress runs to its planned end), a
+    snapshot of the HOS state at the end of them, and the legs still to drive.
+    """
+
+    prefix: CompactTimeline
+    snapshot: HOSSnapshot  # its position refers to the record's legs
+    legs: list[TripLeg]  # legs still to drive, the first shortened
+
+
+def _plan_parts(trip_request: TripRequest, route: Route):
+    timeline = build_timeline(trip_request, route)
+    log_sheets = build_log_sheets(timeline, trip_request)
+    stops_and_rests = build_stops_and_rests(timeline, route, request_legs(trip_request, route))
+    return timeline, stops_and_rests, log_sheets
+
+
+def plan_trip(
+    trip_request: TripRequest,
+    route: Route,
+    geometry_options: GeometryOptions | None = None,
+) -> dict:
+    """Run the HOS engine and log generator; return the /api/plan/ response body."""
+    _, stops_and_rests, log_sheets = _plan_parts(trip_request, route)
+    return {
+        "route": route_to_dict(route, geometry_options),
+        "stops_and_rests": stops_and_rests,
+        "log_sheets": [daily_log_to_dict(log) for log in log_sheets],
+    }
+
+
+def plan_trip_json(
+    trip_request: TripRequest,
+    route: Route,
+    geometry_options: GeometryOptions | None = None,
+) -> bytes:
+    """
+    plan_trip encoded straight to JSON bytes (log sheets skip the dict step).
+    Also runs in batch workers, so the parent only forwards bytes.
+    """
+    _, stops_and_rests, log_sheets = _plan_parts(trip_request, route)
+    return encode_plan(route_to_dict(route, geometry_options), stops_and_rests, log_sheets)
+
+
+def plan_trip_record(
+    trip_request: TripRequest,
+    route: Route,
+    geometry_options: GeometryOptions | None = None,
+    plan_id: str | None = None,
+) -> tuple[bytes, PlanRecord]:
+    """plan_trip_json with plan_id in the body, plus the record a re-plan resumes from."""
+    timeline, stops_and_rests, log_sheets = _plan_parts(trip_request, route)
+    body = encode_plan(
+        route_to_dict(route, geometry_options), stops_and_rests, log_sheets, plan_id
+    )
+    return body, PlanRecord(trip_request, route, request_legs(trip_request, route), timeline)
+
+
+def replan_checkpoint(record: PlanRecord, now: datetime) -> ReplanCheckpoint:
+    """
+    Cut record's timeline at now and rebuild the HOS state there by replaying
+    the kept rows from the trip start. Rows up to now are taken as driven as
+    planned. ValueError if now is before the record's route starts or the
+    plan has already finished by then.
+    """
+    timeline = record.timeline
+    count = len(timeline)
+    cut_us = (now - timeline.epoch) // timedelta(microseconds=1)
+    if not count or cut_us >= timeline.end_us[-1]:
+        raise ValueError("plan is already complete at now")
+    route_start_us = (
+        timeline.start_us[record.route_start_row]
+        if record.route_start_row < count
+        else timeline.end_us[-1]
+    )
+    if cut_us < route_start_us:
+        raise ValueError("now is before the start of the plan's current route")
+
+    legs = record.legs
+    state = initial_state(record.request)
+    active_leg = 0
+    leg_miles = 0.0
+    miles_since_fuel = legs[0].miles_since_fuel
+    keep = 0
+    cut_row = None
+    for i in range(count):
+        start_us = timeline.start_us[i]
+        if start_us >= cut_us:
+            break
+        status = STATUS_BY_CODE[timeline.status_codes[i]]
+        end_us = timeline.end_us[i]
+        duration_min = timeline.durations[i]
+        description = timeline.descriptions[timeline.description_ids[i]]
+        miles = timeline.miles[i]
+        if status == DutyStatus.DRIVING and end_us > cut_us:
+            part_min = (cut_us - start_us) / 60_000_000
+            miles = miles * part_min / duration_min if duration_min else 0.0
+            cut_row = (status, start_us, cut_us, part_min, description, miles)
+            replay_row(state, status, cut_us, part_min, description)
+            leg_miles += miles
+            miles_since_fuel += miles
+            break
+
+        replay_row(state, status, end_us, duration_min, description)
+        keep = i + 1
+        if i < record.route_start_row:
+            continue
+        if status == DutyStatus.DRIVING:
+            leg_miles += miles
+            miles_since_fuel += miles
+        elif description == FUEL_STOP_DESCRIPTION:
+            miles_since_fuel = 0.0
+        elif active_leg < len(legs) and description == legs[active_leg].stop_description:
+            active_leg += 1
+            leg_miles = 0.0
+            miles_since_fuel = legs[active_leg].miles_since_fuel if active_leg < len(legs) else 0.0
+
+    if active_leg >= len(legs):
+        raise ValueError("plan is already complete at now")
+
+    prefix = timeline.head(keep)
+    if cut_row is not None:
+        prefix.append(*cut_row)
+
+    snapshot = HOSSnapshot.of(
+        state,
+        leg_index=active_leg,
+        leg_miles=leg_miles,
+        miles_since_fuel=miles_since_fuel,
+        row=len(prefix),
+    )
+    return ReplanCheckpoint(
+        prefix=prefix,
+        snapshot=snapshot,
+        legs=remaining_legs(legs, active_leg, leg_miles, miles_since_fuel),
+    )
+
+
+def remaining_waypoints(record: PlanRecord, checkpoint: ReplanCheckpoint) -> list:
+    """Waypoints still ahead at the checkpoint: where each remaining leg drives to."""
+    return record.route.waypoints[-len(checkpoint.legs) :] if record.route.waypoints else []
+
+
+def remaining_route(record: PlanRecord, checkpoint: ReplanCheckpoint) -> Route:
+    """
+    The rest of record's route from the checkpoint's planned position, cut
+    out of the stored geometry without calling the directions API.
+    """
+    route = record.route
+    placer = StopPlacer(route, record.legs)
+    active = checkpoint.snapshot.leg_index
+    miles = checkpoint.snapshot.leg_miles
+    legs = []
+    geometry = []
+    if route.legs and route.legs[active].geometry:
+        leg = route.legs[active]
+        leg_index = placer.index(leg.geometry)
+        left = checkpoint.legs[0]
+        legs = [
+            RouteLeg(
+                distance_miles=left.distance_miles,
+                duration_hours=left.duration_hours,
+                geometry=leg_index.tail(miles * placer.scale(leg_index, leg.distance_miles)),
+            )
+        ] + route.legs[active + 1 :]
+        for leg in legs:
+            # Consecutive legs share their joining vertex.
+            geometry.extend(leg.geometry[1:] if geometry else leg.geometry)
+    elif route.geometry:
+        # No per-leg geometry: cut the whole line at the miles driven so far.
+        miles += sum(placer.leg_miles[:active])
+        route_index = placer.index(route.geometry)
+        geometry = route_index.tail(miles * placer.scale(route_index, placer.total_miles))
+        legs = [
+            replace(leg, distance_miles=left.distance_miles, duration_hours=left.duration_hours)
+            for leg, left in zip(route.legs[active:], checkpoint.legs)
+        ]
+
+    position = geometry[0] if geometry else None
+    distance_miles = sum(leg.distance_miles for leg in checkpoint.legs)
+    duration_hours = sum(leg.duration_hours for leg in checkpoint.legs)
+    return Route(
+        geometry=geometry,
+        distance_miles=distance_miles,
+        duration_hours=duration_hours,
+        legs=legs,
+        waypoints=([position] if position else []) + remaining_waypoints(record, checkpoint),
+    )
+
+
+def _legs_on_route(legs: list[TripLeg], route: Route) -> list[TripLeg]:
+    """Remaining engine legs with distances and times from the route they now drive."""
+    if route.legs and len(route.legs) == len(legs):
+        return [
+            replace(leg, distance_miles=route_leg.distance_miles, duration_hours=route_leg.duration_hours)
+            for leg, route_leg in zip(legs, route.legs)
+        ]
+    if len(legs) == 1:
+        return [replace(legs[0], distance_miles=route.distance_miles, duration_hours=route.duration_hours)]
+    raise ValueError("route does not match the remaining legs of the plan")
+
+
+def replan_trip_record(
+    record: PlanRecord,
+    checkpoint: ReplanCheckpoint,
+    route: Route,
+    geometry_options: GeometryOptions | None = None,
+    plan_id: str | None = None,
+) -> tuple[bytes, PlanRecord]:
+    """
+    Resume record from checkpoint along route (from the current position to
+    the remaining waypoints). Rows and stops before the checkpoint are kept
+    as they were; only the rest of the trip is simulated and placed. Returns
+    the response body and the record for the next re-plan.
+    """
+    legs = _legs_on_route(checkpoint.legs, route)
+    prefix = checkpoint.prefix
+    timeline = resume_timeline(prefix, checkpoint.snapshot.state(), legs)
+    kept = len(prefix)
+
+    prefix_stops = record.prefix_stops + _place_stops(
+        islice(timeline.offset_rows(record.route_start_row), kept - record.route_start_row),
+        record.route,
+        record.legs,
+        timeline.epoch,
+    )
+    stops_and_rests = prefix_stops + _place_stops(
+        timeline.offset_rows(kept), route, legs, timeline.epoch
+    )
+    log_sheets = build_log_sheets(timeline, record.request)
+    body = encode_plan(
+        route_to_dict(route, geometry_options), stops_and_rests, log_sheets, plan_id
+    )
+    return body, PlanRecord(record.request, route, legs, timeline, kept, prefix_stops)
+
+
+def iter_plan_ndjson(
+    trip_request: TripRequest,
+    route: Route,
+    geometry_options: GeometryOptions | None = None,
+) -> Iterator[bytes]:
+    """
+    The plan as NDJSON lines, produced while the timeline is simulated:
+    {"route": ...} first, then {"stop": ...} and {"log_sheet": ...} lines in
+    time order as each is finished, then {"done": {counts}}. Only the day
+    being assembled is held in memory.
+    """
+    yield encode_plan_line("route", route_to_dict(route, geometry_options))
+    epoch = trip_request.start_time
+    placer = StopPlacer(route, request_legs(trip_request, route), epoch)
+    logs = LogSheetBuilder(trip_request, epoch=epoch)
+    stop_count = 0
+    for row in iter_timeline(trip_request, route, offsets=True):
+        item = placer.feed(row)
+        if item is not None:
+            stop_count += 1
+            yield encode_plan_line("stop", item)
+        for log in logs.feed_offsets(row):
+            yield encode_plan_line("log_sheet", log)
+    for log in logs.finish():
+        yield encode_plan_line("log_sheet", log)
+    yield encode_plan_line(
+        "done",
+        {"stops_and_rests": stop_count, "log_sheets": logs.log_count},
+    )
+
+
+def get_process_pool(max_workers: int = 0) -> ProcessPoolExecutor:
+    """
+    Process pool for CPU-bound planning, created on first use in each worker
+    process. Spawned children import only this module and its helpers.
+    """
+    global _process_pool, _process_pool_pid
+    pid = os.getpid()
+    if _process_pool is None or _process_pool_pid != pid:
+        _process_pool = ProcessPoolExecutor(
+            max_workers=max_workers or os.cpu_count() or 1,
+            mp_context=multiprocessing.get_context("spawn"),
+        )
+        _process_pool_pid = pid
+    return _process_pool
+
+
+def discard_process_pool(pool: ProcessPoolExecutor):
+    """
+    Shut down a broken pool (a child died, e.g. killed for memory) so the
+    next get_process_pool starts a fresh one. A no-op for the pool already
+    replaced by another caller.
+    """
+    global _process_pool
+    if pool is _process_pool:
+        _process_pool = None
+    pool.shutdown(wait=False, cancel_futures=True)
+
+
+async def run_in_process_pool(max_workers: int, fn, *args):
+    """fn(*args) in the planning pool, retried once in a new pool if the pool is broken."""
+    loop = asyncio.get_running_loop()
+    pool = get_process_pool(max_workers)
+    try:
+        return await loop.run_in_executor(pool, fn, *args)
+    except BrokenProcessPool:
+        discard_process_pool(pool)
+        return await loop.run_in_executor(get_process_pool(max_workers), fn, *args)
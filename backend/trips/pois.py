@@ -0,0 +1,233 @@
+"""
+Truck stops and rest areas in a grid index, for moving fuel stops and rests
+to real places along a route. POIs are bucketed into lat/lng cells at least
+POI_CORRIDOR_MILES on a side; a corridor query samples the leg polyline,
+joins each sample to the POIs in its neighbouring cells, then measures the
+candidates against the polyline segments around their samples, all as
+array operations, so a 50k-POI dataset costs a few milliseconds per leg
+(scripts/bench_pois.py).
+
+POI_PATH points at a tab-separated file with a header row and the columns
+name, lng, lat and kind (truck_stop or rest_area; only truck stops sell
+fuel). trips/data/sample_pois.tsv is a small example.
+"""
+
+import csv
+import math
+import threading
+from pathlib import Path
+
+import numpy as np
+from django.conf import settings
+
+from .geometry import EARTH_RADIUS_MILES, GeometryIndex
+from .schemas import POI_KINDS, Route, StopSites
+
+MILES_PER_DEGREE_LAT = math.pi * EARTH_RADIUS_MILES / 180
+SAMPLE_POI_PATH = Path(__file__).resolve().parent / "data" / "sample_pois.tsv"
+
+_poi_index = None
+_poi_index_loaded = False
+_poi_index_lock = threading.Lock()
+
+
+def _miles_between(lng1, lat1, lng2, lat2) -> np.ndarray:
+    """Elementwise great-circle distance in miles between [lng, lat] arrays."""
+    lng1, lat1, lng2, lat2 = (np.radians(a) for a in (lng1, lat1, lng2, lat2))
+    a = (
+        np.sin((lat2 - lat1) / 2) ** 2
+        + np.cos(lat1) * np.cos(lat2) * np.sin((lng2 - lng1) / 2) ** 2
+    )
+    return 2 * EARTH_RADIUS_MILES * np.arcsin(np.sqrt(np.clip(a, 0.0, 1.0)))
+
+
+class POIIndex:
+    """Grid of POIs in cells of at least cell_miles on a side, held as sorted arrays."""
+
+    def __init__(self, names, kinds, lng, lat, cell_miles: float = 3.0):
+        self.names = list(names)
+        self.kinds = list(kinds)
+        self.lng = np.asarray(lng, dtype=float)
+        self.lat = np.asarray(lat, dtype=float)
+        self.cell_miles = float(cell_miles)
+        self.lat_step = self.cell_miles / MILES_PER_DEGREE_LAT
+        # Cells are narrowest in miles at the highest latitude in the set.
+        max_lat = min(float(np.abs(self.lat).max()) if len(self.lat) else 0.0, 85.0)
+        self.lng_step = self.lat_step / math.cos(math.radians(max_lat))
+        self.columns = int(360 / self.lng_step) + 3
+
+        keys = self._cell_keys(self.lng, self.lat)
+        self.order = np.argsort(keys, kind="stable")
+        self.cell_keys, starts = np.unique(keys[self.order], return_index=True)
+        self.cell_starts = np.append(starts, len(keys))
+
+    @classmethod
+    def load(cls, path, cell_miles: float = 3.0) -> "POIIndex":
+        names, kinds, lng, lat = [], [], [], []
+        with open(path, newline="", encoding="utf-8") as handle:
+            for row in csv.DictReader(handle, delimiter="\t"):
+                kind = (row.get("kind") or "").strip()
+                if kind not in POI_KINDS:
+                    continue
+                names.append(row["name"])
+                kinds.append(kind)
+                lng.append(float(row["lng"]))
+                lat.append(float(row["lat"]))
+        return cls(names, kinds, lng, lat, cell_miles)
+
+    def __len__(self) -> int:
+        return len(self.names)
+
+    def _cell_columns(self, lng, lat):
+        column = np.floor((np.asarray(lng) + 180) / self.lng_step).astype(np.int64) + 1
+        row = np.floor((np.asarray(lat) + 90) / self.lat_step).astype(np.int64) + 1
+        return column, row
+
+    def _cell_keys(self, lng, lat) -> np.ndarray:
+        column, row = self._cell_columns(lng, lat)
+        return row * self.columns + column
+
+    def near(self, lng, lat, radius_miles: float):
+        """
+        (point index, POI index, miles) for every POI within radius_miles of
+        each [lng, lat] point. A POI near several points appears once per point.
+        """
+        lng = np.asarray(lng, dtype=float)
+        lat = np.asarray(lat, dtype=float)
+        empty = (np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64), np.empty(0))
+        if not len(self.names) or not len(lng):
+            return empty
+
+        reach = max(1, math.ceil(radius_miles / self.cell_miles))
+        offsets = np.arange(-reach, reach + 1)
+        column, row = self._cell_columns(lng, lat)
+        keys = (
+            (row[:, None, None] + offsets[None, :, None]) * self.columns
+            + column[:, None, None]
+            + offsets[None, None, :]
+        ).reshape(len(lng), -1)
+        points = np.repeat(np.arange(len(lng)), keys.shape[1])
+        keys = keys.ravel()
+
+        slots = np.searchsorted(self.cell_keys, keys)
+        slots = np.minimum(slots, len(self.cell_keys) - 1)
+        hit = self.cell_keys[slots] == keys
+        slots = slots[hit]
+        points = points[hit]
+        starts = self.cell_starts[slots]
+        counts = self.cell_starts[slots + 1] - starts
+        if not counts.sum():
+            return empty
+
+        # Expand each (point, cell) pair to one row per POI in the cell.
+        points = np.repeat(points, counts)
+        within = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+        pois = self.order[np.repeat(starts, counts) + within]
+        miles = _miles_between(lng[points], lat[points], self.lng[pois], self.lat[pois])
+        close = miles <= radius_miles
+        return points[close], pois[close], miles[close]
+
+    def corridor(self, geometry, road_miles: float, radius_miles: float) -> StopSites:
+        """
+        POIs within radius_miles of the polyline, placed at the road miles of
+        their nearest point on it. Samples every radius_miles / 2 find the
+        candidates: the closest point of the line to a POI within
+        radius_miles is at most a quarter of radius_miles along the line
+        from a sample, so that sample is within 1.25 * radius_miles of the
+        POI however the line bends (hypot(radius_miles, radius_miles / 2)
+        only covers straight lines). Each candidate is then measured against
+        the polyline segments within half a step of the samples that found it.
+        """
+        index = GeometryIndex(geometry)
+        if index.total_length <= 0 or not len(self.names):
+            return StopSites([], [], [], [])
+
+        step = radius_miles / 2
+        sample_miles = np.append(np.arange(0.0, index.total_length, step), index.total_length)
+        samples = np.asarray(index.points_at_distance(sample_miles), dtype=float)
+        points, pois, _ = self.near(samples[:, 0], samples[:, 1], radius_miles + step / 2)
+        if not len(pois):
+            return StopSites([], [], [], [])
+
+        # Segments s (vertex s to s + 1) within half a step of each sample.
+        cumulative = index.cumulative
+        last = len(cumulative) - 2
+        first_seg = np.clip(
+            np.searchsorted(cumulative, sample_miles[points] - step / 2, side="right") - 1, 0, last
+        )
+        end_seg = np.clip(
+            np.searchsorted(cumulative, sample_miles[points] + step / 2, side="left"),
+            first_seg + 1,
+            last + 1,
+        )
+        counts = end_seg - first_seg
+        pair_starts = np.cumsum(counts) - counts
+        rows = np.repeat(pois, counts)
+        segs = np.repeat(first_seg, counts) + (np.arange(counts.sum()) - np.repeat(pair_starts, counts))
+
+        # Point-to-segment distance in miles on a local equirectangular plane around each POI.
+        coords = index.coords
+        x_scale = MILES_PER_DEGREE_LAT * np.cos(np.radians(self.lat[rows]))
+        ax = (coords[segs, 0] - self.lng[rows]) * x_scale
+        ay = (coords[segs, 1] - self.lat[rows]) * MILES_PER_DEGREE_LAT
+        dx = (coords[segs + 1, 0] - coords[segs, 0]) * x_scale
+        dy = (coords[segs + 1, 1] - coords[segs, 1]) * MILES_PER_DEGREE_LAT
+        length_sq = dx * dx + dy * dy
+        t = np.clip(-(ax * dx + ay * dy) / np.where(length_sq > 0, length_sq, 1.0), 0.0, 1.0)
+        miles = np.hypot(ax + t * dx, ay + t * dy)
+
+        # Nearest segment per sample, then nearest sample per POI.
+        nearest = np.minimum.reduceat(miles, pair_starts)
+        hits = np.flatnonzero(miles == np.repeat(nearest, counts))
+        _, first_hit = np.unique(np.repeat(np.arange(len(counts)), counts)[hits], return_index=True)
+        best = hits[first_hit]
+        order = np.lexsort((nearest, pois))
+        pois, best, nearest = pois[order], best[order], nearest[order]
+        first = np.ones(len(pois), dtype=bool)
+        first[1:] = pois[1:] != pois[:-1]
+        keep = first & (nearest <= radius_miles)
+        pois, segs, t = pois[keep], segs[best[keep]], t[best[keep]]
+        # Polyline miles at the nearest point, scaled to road miles.
+        along = cumulative[segs] + t * (cumulative[segs + 1] - cumulative[segs])
+        along = along * (road_miles / index.total_length)
+
+        order = np.argsort(along, kind="stable")
+        pois = pois[order]
+        return StopSites(
+            along[order].tolist(),
+            [self.names[i] for i in pois.tolist()],
+            [self.kinds[i] for i in pois.tolist()],
+            np.column_stack((self.lng[pois], self.lat[pois])).tolist(),
+        )
+
+
+def get_poi_index() -> POIIndex | None:
+    """The POI_PATH index, loaded once per process; None when not configured."""
+    global _poi_index, _poi_index_loaded
+    if not _poi_index_loaded:
+        with _poi_index_lock:
+            if not _poi_index_loaded:
+                path = getattr(settings, "POI_PATH", "")
+                _poi_index = (
+                    POIIndex.load(path, getattr(settings, "POI_CORRIDOR_MILES", 3.0))
+                    if path
+                    else None
+                )
+                _poi_index_loaded = True
+    return _poi_index
+
+
+def route_stop_sites(route: Route) -> list[StopSites | None] | None:
+    """
+    StopSites for each leg of route from the configured POI index, or None
+    when there is no index or the route has no legs. Legs without geometry
+    get None.
+    """
+    index = get_poi_index()
+    if index is None or not route.legs:
+        return None
+    radius = getattr(settings, "POI_CORRIDOR_MILES", 3.0)
+    return [
+        index.corridor(leg.geometry, leg.distance_miles, radius) if leg.geometry else None
+        for leg in route.legs
+    ]
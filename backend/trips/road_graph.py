@@ -0,0 +1,276 @@
+"""
+Local road graph for offline routing. Nodes are [lng, lat] points; directed
+edges carry a length in meters and a travel time in seconds, held in CSR
+arrays for both directions so a node's out- and in-edges are contiguous.
+A query snaps each waypoint to its nearest node and runs a bidirectional A*
+on travel time with a great-circle lower bound, returning the Route /
+RouteLeg shapes Mapbox Directions produce.
+
+Graphs are prepared offline (e.g. from an OSM extract) with
+RoadGraph.from_edges(...).save(path) and loaded with RoadGraph.load(path).
+A .json file {"nodes": [[lng, lat], ...], "edges": [[u, v, length_m,
+duration_s], ...], "bidirectional": true} loads too; other keys are
+ignored. The small sample graph in trips/data is shipped that way.
+"""
+
+import heapq
+import json
+import math
+from pathlib import Path
+
+import numpy as np
+
+from .geometry import EARTH_RADIUS_MILES, segment_lengths_miles
+from .schemas import Route, RouteLeg
+
+METERS_PER_MILE = 1609.344
+SAMPLE_GRAPH_PATH = Path(__file__).resolve().parent / "data" / "sample_road_graph.json"
+
+
+def _csr(count: int, tails: np.ndarray, *columns: np.ndarray):
+    """indptr over count nodes for edges grouped by tail, plus each column in that order."""
+    order = np.argsort(tails, kind="stable")
+    indptr = np.zeros(count + 1, dtype=np.int64)
+    np.cumsum(np.bincount(tails, minlength=count), out=indptr[1:])
+    return indptr, [column[order] for column in columns]
+
+
+def _miles_between(lng1: float, lat1: float, lng2: float, lat2: float) -> float:
+    """Great-circle distance in miles; the scalar form of segment_lengths_miles."""
+    phi1 = math.radians(lat1)
+    phi2 = math.radians(lat2)
+    a = (
+        math.sin((phi2 - phi1) / 2) ** 2
+        + math.cos(phi1) * math.cos(phi2) * math.sin(math.radians(lng2 - lng1) / 2) ** 2
+    )
+    return 2 * EARTH_RADIUS_MILES * math.asin(math.sqrt(min(1.0, a)))
+
+
+class RoadGraph:
+    """Directed road graph in CSR form; see the module docstring for the file formats."""
+
+    def __init__(self, lng, lat, indptr, indices, length_m, duration_s):
+        self.lng = np.asarray(lng, dtype=float)
+        self.lat = np.asarray(lat, dtype=float)
+        self.indptr = np.asarray(indptr, dtype=np.int64)
+        self.indices = np.asarray(indices, dtype=np.int64)
+        self.length_m = np.asarray(length_m, dtype=float)
+        self.duration_s = np.asarray(duration_s, dtype=float)
+        node_count = len(self.lng)
+        edge_count = len(self.indices)
+        self.tails = np.repeat(np.arange(node_count), np.diff(self.indptr))
+        # Reverse CSR: for each node, the edges that enter it (by forward edge id).
+        self.rev_indptr, (self.rev_edges,) = _csr(node_count, self.indices, np.arange(edge_count))
+
+        # Seconds per great-circle mile no edge beats, so the A* bound never
+        # overestimates; an edge with no travel time makes the bound zero.
+        coords = np.column_stack((self.lng, self.lat))
+        if edge_count:
+            straight = segment_lengths_miles(
+                np.stack((coords[self.tails], coords[self.indices]), axis=1).reshape(-1, 2)
+            )[::2]
+            moving = straight > 0
+            self.seconds_per_mile = (
+                float(np.min(self.duration_s[moving] / straight[moving])) if moving.any() else 0.0
+            )
+        else:
+            self.seconds_per_mile = 0.0
+        self._lists = None
+
+    @classmethod
+    def from_edges(cls, nodes, tails, heads, length_m, duration_s, bidirectional: bool = False):
+        """Graph from [[lng, lat], ...] nodes and parallel edge columns; bidirectional adds each reverse edge."""
+        nodes = np.asarray(nodes, dtype=float).reshape(-1, 2)
+        tails = np.asarray(tails, dtype=np.int64)
+        heads = np.asarray(heads, dtype=np.int64)
+        length_m = np.asarray(length_m, dtype=float)
+        duration_s = np.asarray(duration_s, dtype=float)
+        if bidirectional:
+            tails, heads = np.concatenate((tails, heads)), np.concatenate((heads, tails))
+            length_m = np.concatenate((length_m, length_m))
+            duration_s = np.concatenate((duration_s, duration_s))
+        indptr, (indices, length_m, duration_s) = _csr(len(nodes), tails, heads, length_m, duration_s)
+        return cls(nodes[:, 0], nodes[:, 1], indptr, indices, length_m, duration_s)
+
+    @classmethod
+    def load(cls, path) -> "RoadGraph":
+        path = Path(path)
+        if path.suffix == ".json":
+            data = json.loads(path.read_text())
+            edges = np.asarray(data["edges"], dtype=float).reshape(-1, 4)
+            return cls.from_edges(
+                data["nodes"],
+                edges[:, 0].astype(np.int64),
+                edges[:, 1].astype(np.int64),
+                edges[:, 2],
+                edges[:, 3],
+                bidirectional=bool(data.get("bidirectional", False)),
+            )
+        with np.load(path) as arrays:
+            return cls(
+                arrays["lng"],
+                arrays["lat"],
+                arrays["indptr"],
+                arrays["indices"],
+                arrays["length_m"],
+                arrays["duration_s"],
+            )
+
+    def save(self, path):
+        """Write the CSR arrays as an uncompressed .npz that load() reads back."""
+        np.savez(
+            path,
+            lng=self.lng,
+            lat=self.lat,
+            indptr=self.indptr,
+            indices=self.indices,
+            length_m=self.length_m,
+            duration_s=self.duration_s,
+        )
+
+    def nearest_node(self, point, max_miles: float = math.inf):
+        """Index of the node closest to [lng, lat], or None when none is within max_miles."""
+        if not len(self.lng):
+            return None
+        lng, lat = float(point[0]), float(point[1])
+        # Equirectangular distances rank nodes; the winner is measured exactly.
+        dx = (self.lng - lng) * math.cos(math.radians(lat))
+        dy = self.lat - lat
+        node = int(np.argmin(dx * dx + dy * dy))
+        if _miles_between(lng, lat, self.lng[node], self.lat[node]) > max_miles:
+            return None
+        return node
+
+    def _search_lists(self):
+        # The search walks single elements; Python lists index far faster than arrays.
+        if self._lists is None:
+            self._lists = (
+                self.indptr.tolist(),
+                self.indices.tolist(),
+                self.duration_s.tolist(),
+                self.rev_indptr.tolist(),
+                self.rev_edges.tolist(),
+                self.tails.tolist(),
+                self.lng.tolist(),
+                self.lat.tolist(),
+            )
+        return self._lists
+
+    def shortest_path(self, source: int, target: int):
+        """
+        Forward edge ids of the fastest path from source to target, or None
+        when target is unreachable. Bidirectional A* with the average of the
+        two great-circle potentials, which keeps both searches consistent;
+        it stops once the two frontiers cannot improve the best meeting.
+        """
+        if source == target:
+            return []
+        indptr, heads, duration, rev_indptr, rev_edges, tails, lng, lat = self._search_lists()
+        pace = self.seconds_per_mile / 2
+        s_lng, s_lat, t_lng, t_lat = lng[source], lat[source], lng[target], lat[target]
+        potentials = {}
+
+        def potential(node):
+            value = potentials.get(node)
+            if value is None:
+                value = potentials[node] = pace * (
+                    _miles_between(lng[node], lat[node], t_lng, t_lat)
+                    - _miles_between(lng[node], lat[node], s_lng, s_lat)
+                )
+            return value
+
+        dist_f = {source: 0.0}
+        dist_b = {target: 0.0}
+        via_f = {source: -1}  # edge entering the node on the forward tree
+        via_b = {target: -1}  # edge leaving the node on the backward tree
+        heap_f = [(potential(source), source)]
+        heap_b = [(-potential(target), target)]
+        best = math.inf
+        meet = -1
+        while heap_f and heap_b:
+            if heap_f[0][0] + heap_b[0][0] >= best:
+                break
+            if heap_f[0][0] <= heap_b[0][0]:
+                key, node = heapq.heappop(heap_f)
+                base = dist_f[node]
+                if key > base + potential(node):
+                    continue  # stale entry
+                for edge in range(indptr[node], indptr[node + 1]):
+                    head = heads[edge]
+                    d = base + duration[edge]
+                    if d < dist_f.get(head, math.inf):
+                        dist_f[head] = d
+                        via_f[head] = edge
+                        heapq.heappush(heap_f, (d + potential(head), head))
+                        other = dist_b.get(head)
+                        if other is not None and d + other < best:
+                            best = d + other
+                            meet = head
+            else:
+                key, node = heapq.heappop(heap_b)
+                base = dist_b[node]
+                if key > base - potential(node):
+                    continue
+                for slot in range(rev_indptr[node], rev_indptr[node + 1]):
+                    edge = rev_edges[slot]
+                    tail = tails[edge]
+                    d = base + duration[edge]
+                    if d < dist_b.get(tail, math.inf):
+                        dist_b[tail] = d
+                        via_b[tail] = edge
+                        heapq.heappush(heap_b, (d - potential(tail), tail))
+                        other = dist_f.get(tail)
+                        if other is not None and d + other < best:
+                            best = d + other
+                            meet = tail
+        if meet < 0:
+            return None
+
+        path = []
+        node = meet
+        while via_f[node] >= 0:
+            path.append(via_f[node])
+            node = tails[via_f[node]]
+        path.reverse()
+        node = meet
+        while via_b[node] >= 0:
+            path.append(via_b[node])
+            node = heads[via_b[node]]
+        return path
+
+    def route(self, waypoints: list, max_snap_miles: float = math.inf):
+        """
+        Route through [lng, lat] waypoints with one leg per consecutive pair,
+        or None when a waypoint is farther than max_snap_miles from the graph
+        or a leg has no path. Geometry runs along graph nodes.
+        """
+        if len(waypoints) < 2:
+            return None
+        nodes = [self.nearest_node(point, max_snap_miles) for point in waypoints]
+        if any(node is None for node in nodes):
+            return None
+        legs = []
+        geometry = []
+        for source, target in zip(nodes, nodes[1:]):
+            path = self.shortest_path(source, target)
+            if path is None:
+                return None
+            path = np.asarray(path, dtype=np.int64)
+            vertices = np.concatenate(([source], self.indices[path])) if len(path) else np.array([source, source])
+            leg_geometry = np.column_stack((self.lng[vertices], self.lat[vertices])).tolist()
+            legs.append(
+                RouteLeg(
+                    distance_miles=float(self.length_m[path].sum()) / METERS_PER_MILE,
+                    duration_hours=float(self.duration_s[path].sum()) / 3600,
+                    geometry=leg_geometry,
+                )
+            )
+            # Consecutive legs share their joining vertex.
+            geometry.extend(leg_geometry[1:] if geometry else leg_geometry)
+        return Route(
+            geometry=geometry,
+            distance_miles=sum(leg.distance_miles for leg in legs),
+            duration_hours=sum(leg.duration_hours for leg in legs),
+            legs=legs,
+            waypoints=waypoints,
+        )
@@ -0,0 +1,134 @@
+"""
+Routing backends: where a trip's Route comes from once its waypoints are
+known. ROUTING_BACKEND picks "mapbox" (Directions API, see mapbox_client)
+or "local" (a RoadGraph loaded from ROUTING_GRAPH_PATH; no network and no
+token). Locations sent without coordinates are looked up in the local
+gazetteer, then geocoded by Mapbox.
+"""
+
+import asyncio
+import math
+import threading
+from abc import ABC, abstractmethod
+
+from django.conf import settings
+
+from .mapbox_client import (
+    ageocode_locations,
+    aroute_waypoints as mapbox_aroute_waypoints,
+    geocode_locations,
+    route_waypoints as mapbox_route_waypoints,
+)
+from .road_graph import SAMPLE_GRAPH_PATH, RoadGraph
+from .schemas import Route, TripRequest
+
+_backend = None
+_backend_lock = threading.Lock()
+
+
+class RoutingBackend(ABC):
+    """Turns [lng, lat] waypoints into a Route with one leg per pair, or None."""
+
+    requires_token = False
+
+    @abstractmethod
+    def route(self, waypoints: list, token: str = "", use_cache: bool = True) -> Route | None:
+        ...
+
+    @abstractmethod
+    async def aroute(self, waypoints: list, token: str = "", use_cache: bool = True) -> Route | None:
+        ...
+
+
+class MapboxBackend(RoutingBackend):
+    """Mapbox Directions with the directions cache; no route without a token."""
+
+    requires_token = True
+
+    def route(self, waypoints, token="", use_cache=True):
+        return mapbox_route_waypoints(waypoints, token, use_cache) if token else None
+
+    async def aroute(self, waypoints, token="", use_cache=True):
+        return await mapbox_aroute_waypoints(waypoints, token, use_cache) if token else None
+
+
+class LocalGraphBackend(RoutingBackend):
+    """Shortest paths on an in-memory RoadGraph; waypoints snap to nodes within max_snap_miles."""
+
+    def __init__(self, graph: RoadGraph, max_snap_miles: float = math.inf):
+        self.graph = graph
+        self.max_snap_miles = max_snap_miles
+
+    def route(self, waypoints, token="", use_cache=True):
+        return self.graph.route(waypoints, self.max_snap_miles)
+
+    async def aroute(self, waypoints, token="", use_cache=True):
+        # A search on a large graph is CPU work; keep it off the event loop.
+        return await asyncio.to_thread(self.route, waypoints)
+
+
+def _build_backend() -> RoutingBackend:
+    name = (getattr(settings, "ROUTING_BACKEND", "mapbox") or "mapbox").strip().lower()
+    if name == "mapbox":
+        return MapboxBackend()
+    if name == "local":
+        path = getattr(settings, "ROUTING_GRAPH_PATH", "") or SAMPLE_GRAPH_PATH
+        return LocalGraphBackend(
+            RoadGraph.load(path),
+            getattr(settings, "ROUTING_MAX_SNAP_MILES", 25.0),
+        )
+    raise ValueError(f"unknown ROUTING_BACKEND {name!r}")
+
+
+def get_backend() -> RoutingBackend:
+    """The configured backend, built once per process (a local graph loads on first use)."""
+    global _backend
+    if _backend is None:
+        with _backend_lock:
+            if _backend is None:
+                _backend = _build_backend()
+    return _backend
+
+
+def trip_locations(request: TripRequest) -> list[tuple]:
+    """(query, coords) for the trip start and each of its stops, in order."""
+    return [(request.current_location, request.current_location_coords)] + [
+        (stop.location, stop.coords) for stop in request.trip_stops
+    ]
+
+
+def _resolve_token(token: str) -> str:
+    return (token or getattr(settings, "MAPBOX_ACCESS_TOKEN", "") or "").strip()
+
+
+def get_route(request: TripRequest, token: str = "", use_cache: bool = True):
+    """
+    Geocode the trip start and stops (current, pickup, dropoff by default)
+    and route them with the configured backend; return Route.
+    Returns None if geocoding or routing fail; without a token only
+    locations with coords or a gazetteer entry resolve. use_cache=False
+    bypasses cached geocode and directions results for this request.
+    """
+    token = _resolve_token(token)
+    waypoints = geocode_locations(trip_locations(request), token, use_cache)
+    if waypoints is None:
+        return None
+    return route_waypoints(waypoints, token, use_cache)
+
+
+async def aget_route(request: TripRequest, token: str = "", use_cache: bool = True):
+    """Async get_route: same caches and semantics, without blocking the event loop."""
+    token = _resolve_token(token)
+    waypoints = await ageocode_locations(trip_locations(request), token, use_cache)
+    if waypoints is None:
+        return None
+    return await aroute_waypoints(waypoints, token, use_cache)
+
+
+def route_waypoints(waypoints: list, token: str = "", use_cache: bool = True):
+    """Route through [lng, lat] waypoints with the configured backend, or None."""
+    return get_backend().route(waypoints, _resolve_token(token), use_cache)
+
+
+async def aroute_waypoints(waypoints: list, token: str = "", use_cache: bool = True):
+    return await get_backend().aroute(waypoints, _resolve_token(token), use_cache)
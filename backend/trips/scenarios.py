@@ -0,0 +1,149 @@
+"""
+What-if sweeps over one route: the trip re-simulated for every combination
+of departure time and cycle hours used, each reduced to its arrival, rest
+count and duty totals. Kept free of Django imports so the sweep can run in
+the planning process pool.
+
+The engine works in offsets from the start time and reads the start only
+through the initial HOS state, so scenarios whose initial states differ
+only in their epoch produce the same rows shifted in time. Each distinct
+state is simulated once: with current_cycle_used_hrs that is once per cycle
+value however many departure times are swept. With cycle_history_hrs the
+cycle days follow local midnights, DST changes included, so each departure
+time is its own state.
+"""
+
+from dataclasses import dataclass, replace
+from datetime import datetime, timedelta
+
+from .schemas import CODE_BY_STATUS, CompactTimeline, DutyStatus, TripRequest
+from .timeline_engine import (
+    ON_DUTY_STATUSES,
+    REST_DESCRIPTIONS,
+    RESTART_DESCRIPTION,
+    HOSState,
+    TripLeg,
+    initial_state,
+    resume_timeline,
+)
+
+_ON_DUTY_CODES = frozenset(CODE_BY_STATUS[status] for status in ON_DUTY_STATUSES)
+_DRIVING_CODE = CODE_BY_STATUS[DutyStatus.DRIVING]
+
+
+@dataclass(frozen=True)
+class ScenarioSummary:
+    """One simulated timeline reduced to what a sweep compares."""
+
+    duration_us: int  # trip start to the end of the last row
+    rest_count: int
+    restart_count: int
+    on_duty_min: float
+    driving_min: float
+
+
+def summarize_timeline(timeline: CompactTimeline) -> ScenarioSummary:
+    rest_ids = {i for i, text in enumerate(timeline.descriptions) if text in REST_DESCRIPTIONS}
+    restart_ids = {i for i, text in enumerate(timeline.descriptions) if text == RESTART_DESCRIPTION}
+    rest_count = restart_count = 0
+    on_duty_min = driving_min = 0.0
+    for code, desc_id, duration in zip(
+        timeline.status_codes, timeline.description_ids, timeline.durations
+    ):
+        if code in _ON_DUTY_CODES:
+            on_duty_min += duration
+            if code == _DRIVING_CODE:
+                driving_min += duration
+        elif desc_id in rest_ids:
+            rest_count += 1
+            restart_count += desc_id in restart_ids
+    return ScenarioSummary(
+        duration_us=timeline.end_us[-1] if len(timeline) else 0,
+        rest_count=rest_count,
+        restart_count=restart_count,
+        on_duty_min=on_duty_min,
+        driving_min=driving_min,
+    )
+
+
+def simulate_states(states: list[HOSState], legs: list[TripLeg]) -> list[ScenarioSummary]:
+    """A summary per initial state over the same legs; runs in planning workers."""
+    return [
+        summarize_timeline(resume_timeline(CompactTimeline(state.epoch), state, legs))
+        for state in states
+    ]
+
+
+def scenario_grid(
+    request: TripRequest,
+    start_times: list[datetime],
+    cycle_used_hrs: list[float],
+) -> list[TripRequest]:
+    """request at every (start_time, cycle hours used) pair, start times outermost."""
+    return [
+        replace(request, start_time=start_time, current_cycle_used_hrs=cycle_used)
+        for start_time in start_times
+        for cycle_used in cycle_used_hrs
+    ]
+
+
+def _state_key(state: HOSState) -> tuple:
+    # Everything but the epoch, which only exact cycle tracking reads (for its midnights).
+    return tuple(
+        tuple(value) if isinstance(value, list) else value
+        for name, value in vars(state).items()
+        if name != "epoch" or state.cycle_day_min is not None
+    )
+
+
+def distinct_states(requests: list[TripRequest]) -> tuple[list[HOSState], list[int]]:
+    """The initial states worth simulating, and for each request the index of its own."""
+    states: list[HOSState] = []
+    index_by_key: dict[tuple, int] = {}
+    state_index = []
+    for request in requests:
+        state = initial_state(request)
+        key = _state_key(state)
+        index = index_by_key.get(key)
+        if index is None:
+            index = index_by_key[key] = len(states)
+            states.append(state)
+        state_index.append(index)
+    return states, state_index
+
+
+def scenario_to_dict(request: TripRequest, summary: ScenarioSummary) -> dict:
+    arrival = request.start_time + timedelta(microseconds=summary.duration_us)
+    return {
+        "start_time": request.start_time.isoformat(),
+        "current_cycle_used_hrs": request.current_cycle_used_hrs,
+        "arrival_time": arrival.isoformat(),
+        "duration_hours": round(summary.duration_us / 3.6e9, 2),
+        "rest_count": summary.rest_count,
+        "restart_count": summary.restart_count,
+        "on_duty_hours": round(summary.on_duty_min / 60, 2),
+        "driving_hours": round(summary.driving_min / 60, 2),
+    }
+
+
+def scenarios_to_dict(
+    requests: list[TripRequest],
+    state_index: list[int],
+    summaries: list[ScenarioSummary],
+) -> dict:
+    """
+    The /api/plan/scenarios/ body: one entry per request in grid order, and
+    the index of the one that arrives first (the shortest trip on ties).
+    """
+    durations = [summaries[index].duration_us for index in state_index]
+    ranks = [
+        (request.start_time + timedelta(microseconds=duration_us), duration_us)
+        for request, duration_us in zip(requests, durations)
+    ]
+    return {
+        "scenarios": [
+            scenario_to_dict(request, summaries[index])
+            for request, index in zip(requests, state_index)
+        ],
+        "earliest_arrival_index": min(range(len(ranks)), key=ranks.__getitem__) if ranks else None,
+    }
@@ -3,10 +3,14 @@ Data shapes for trip planning and ELD logs.
 Used in-memory and for API request/response; not stored in the database.
 """
 
+from array import array
+from bisect import bisect_left
 from dataclasses import dataclass, field
-from datetime import date, datetime
+from datetime import date, datetime, timedelta
 from enum import Enum
-from typing import List, Optional
+from functools import lru_cache
+from typing import Iterator, List, Optional
+from zoneinfo import ZoneInfo
 
 # Duty status – matches FMCSA log grid rows
 class DutyStatus(str, Enum):
@@ -16,6 +20,35 @@ class DutyStatus(str, Enum):
     ON_DUTY_NOT_DRIVING = "on_duty_not_driving"
 
 
+STOP_KINDS = ("pickup", "dropoff", "stop")
+
+
+@lru_cache(maxsize=64)
+def home_terminal_zone(name: str) -> ZoneInfo:
+    """ZoneInfo for a home_terminal_timezone name, shared across requests."""
+    return ZoneInfo(name)
+
+# POI kinds from the truck stop / rest area dataset; only truck stops sell fuel.
+POI_KINDS = ("truck_stop", "rest_area")
+FUEL_POI_KINDS = ("truck_stop",)
+
+
+# One stop of a multi-stop trip – where the driver is on duty for dwell_minutes
+@dataclass
+class TripStop:
+    location: str
+    coords: Optional[List[float]] = None
+    kind: str = "stop"  # one of STOP_KINDS
+    dwell_minutes: float = 60.0
+
+    @property
+    def description(self) -> str:
+        """Timeline description of the time spent at the stop, e.g. "Pickup (1 hr)"."""
+        minutes = self.dwell_minutes
+        dwell = f"{minutes / 60:g} hr" if minutes % 60 == 0 else f"{minutes:g} min"
+        return f"{self.kind.capitalize()} ({dwell})"
+
+
 # Trip request – user input
 @dataclass
 class TripRequest:
@@ -27,6 +60,17 @@ class TripRequest:
     current_location_coords: Optional[List[float]] = None
     pickup_location_coords: Optional[List[float]] = None
     dropoff_location_coords: Optional[List[float]] = None
+    # IANA zone name; log sheet days run midnight to midnight in this zone.
+    home_terminal_timezone: Optional[str] = None
+    # On-duty hours for each of the 7 days before the start day, oldest first.
+    # When set, the 70hr/8-day cycle is tracked exactly from it.
+    cycle_history_hrs: Optional[List[float]] = None
+    # Multi-stop trips: every stop after current_location, in order. When set,
+    # pickup_location / dropoff_location name the first and last stops.
+    stops: Optional[List[TripStop]] = None
+    # Truck stops / rest areas along each route leg, from the POI index (not
+    # the request body). When set, fuel stops and rests are moved to them.
+    stop_sites: Optional[List[Optional["StopSites"]]] = None
 
     def __post_init__(self):
         if isinstance(self.start_time, str):
@@ -34,6 +78,16 @@ class TripRequest:
                 self.start_time.replace("Z", "+00:00")
             )
 
+    @property
+    def trip_stops(self) -> List[TripStop]:
+        """stops, or the pickup and dropoff of a classic three-point trip."""
+        if self.stops:
+            return self.stops
+        return [
+            TripStop(self.pickup_location, self.pickup_location_coords, "pickup"),
+            TripStop(self.dropoff_location, self.dropoff_location_coords, "dropoff"),
+        ]
+
 
 # Route – from Mapbox Directions
 @dataclass
@@ -53,6 +107,96 @@ class Route:
     waypoints: List[List[float]] = field(default_factory=list)
 
 
+def _flatten_coords(coords: list) -> array:
+    return array("d", (value for point in coords for value in point[:2]))
+
+
+def _unflatten_coords(flat: array) -> list:
+    return [[flat[i], flat[i + 1]] for i in range(0, len(flat), 2)]
+
+
+def route_to_compact(route: Route) -> tuple:
+    """
+    Route as flat float arrays and tuples, a fraction of the size of nested
+    lists, for the directions cache and the plan store. Waypoints are kept
+    by the caller.
+    """
+    return (
+        _flatten_coords(route.geometry),
+        route.distance_miles,
+        route.duration_hours,
+        tuple(
+            (leg.distance_miles, leg.duration_hours, _flatten_coords(leg.geometry))
+            for leg in route.legs
+        ),
+    )
+
+
+def route_from_compact(compact: tuple, waypoints: list) -> Route:
+    geometry, distance_miles, duration_hours, legs = compact
+    return Route(
+        geometry=_unflatten_coords(geometry),
+        distance_miles=distance_miles,
+        duration_hours=duration_hours,
+        legs=[
+            RouteLeg(
+                distance_miles=leg_miles,
+                duration_hours=leg_hours,
+                geometry=_unflatten_coords(leg_geometry),
+            )
+            for leg_miles, leg_hours, leg_geometry in legs
+        ],
+        waypoints=waypoints,
+    )
+
+
+# Truck stops / rest areas within reach of one route leg, by road miles from its start
+@dataclass
+class StopSites:
+    miles: List[float]  # ascending
+    names: List[str]
+    kinds: List[str]  # one of POI_KINDS
+    coords: List[List[float]]
+    fuel_miles: List[float] = field(init=False, repr=False)
+
+    def __post_init__(self):
+        self.fuel_miles = [
+            miles for miles, kind in zip(self.miles, self.kinds) if kind in FUEL_POI_KINDS
+        ]
+
+    def __len__(self) -> int:
+        return len(self.miles)
+
+    def after(self, miles: float) -> "StopSites":
+        """Sites past miles, measured from there (for a leg resumed part-way)."""
+        start = bisect_left(self.miles, miles)
+        return StopSites(
+            [m - miles for m in self.miles[start:]],
+            self.names[start:],
+            self.kinds[start:],
+            self.coords[start:],
+        )
+
+    def at(self, miles: float, tolerance: float = 1e-3) -> Optional[int]:
+        """Index of a site at miles (within tolerance), or None."""
+        i = bisect_left(self.miles, miles - tolerance)
+        if i < len(self.miles) and self.miles[i] <= miles + tolerance:
+            return i
+        return None
+
+
+# Geometry options – how the plan response encodes route geometry
+@dataclass
+class GeometryOptions:
+    format: str = "geojson"  # geojson | polyline | polyline6
+    zoom: Optional[float] = None  # simplify for display at this zoom; None keeps every vertex
+    leg_geometry: bool = True  # False: legs carry geometry_end_index into route geometry
+
+    @property
+    def is_default(self) -> bool:
+        return self.format == "geojson" and self.zoom is None and self.leg_geometry
+
+
 # Timeline – one chunk of the driver’s day (full trip)
 @dataclass
 class TimelineSegment:
@@ -61,6 +205,7 @@ class TimelineSegment:
     end_time: datetime
     duration_minutes: float
     description: str = ""
+    distance_miles: float = 0.0  # miles covered (driving segments only)
 
     def __post_init__(self):
         if isinstance(self.start_time, str):
@@ -73,6 +218,147 @@ class TimelineSegment:
             )
 
 
+# Duty status <-> small int code for columnar storage
+STATUS_BY_CODE = tuple(DutyStatus)
+CODE_BY_STATUS = {status: code for code, status in enumerate(STATUS_BY_CODE)}
+
+
+class CompactTimeline:
+    """
+    Columnar timeline written directly by the engine: status codes, start/end
+    offsets in microseconds from one epoch (exact, so datetimes round-trip),
+    durations in minutes, miles driven, and interned description ids in
+    array buffers.
+    Iterating yields TimelineSegment views for code that wants dataclasses;
+    rows() yields plain tuples without building segment objects, and
+    offset_rows() the same tuples with the raw offsets in place of datetimes.
+    """
+
+    __slots__ = (
+        "epoch",
+        "status_codes",
+        "start_us",
+        "end_us",
+        "durations",
+        "miles",
+        "description_ids",
+        "descriptions",
+        "_description_index",
+    )
+
+    def __init__(self, epoch: datetime):
+        self.epoch = epoch
+        self.status_codes = array("B")
+        self.start_us = array("q")
+        self.end_us = array("q")
+        self.durations = array("d")
+        self.miles = array("d")
+        self.description_ids = array("H")
+        self.descriptions: list[str] = []
+        self._description_index: dict[str, int] = {}
+
+    def description_id(self, description: str) -> int:
+        desc_id = self._description_index.get(description)
+        if desc_id is None:
+            desc_id = len(self.descriptions)
+            self.descriptions.append(description)
+            self._description_index[description] = desc_id
+        return desc_id
+
+    def head(self, count: int) -> "CompactTimeline":
+        """Copy of the first count rows, ready to be appended to."""
+        out = CompactTimeline(self.epoch)
+        out.status_codes = self.status_codes[:count]
+        out.start_us = self.start_us[:count]
+        out.end_us = self.end_us[:count]
+        out.durations = self.durations[:count]
+        out.miles = self.miles[:count]
+        out.description_ids = self.description_ids[:count]
+        out.descriptions = list(self.descriptions)
+        out._description_index = dict(self._description_index)
+        return out
+
+    def append(
+        self,
+        status: DutyStatus,
+        start_us: int,
+        end_us: int,
+        duration_minutes: float,
+        description: str = "",
+        distance_miles: float = 0.0,
+    ):
+        self.status_codes.append(CODE_BY_STATUS[status])
+        self.start_us.append(start_us)
+        self.end_us.append(end_us)
+        self.durations.append(duration_minutes)
+        self.miles.append(distance_miles)
+        self.description_ids.append(self.description_id(description))
+
+    def time_at(self, offset_us: int) -> datetime:
+        return self.epoch + timedelta(microseconds=offset_us)
+
+    def rows(self, start: int = 0) -> Iterator[tuple]:
+        """(status, start_time, end_time, duration_minutes, description, distance_miles) per segment."""
+        epoch = self.epoch
+        descriptions = self.descriptions
+        for i in range(start, len(self.status_codes)):
+            yield (
+                STATUS_BY_CODE[self.status_codes[i]],
+                epoch + timedelta(microseconds=self.start_us[i]),
+                epoch + timedelta(microseconds=self.end_us[i]),
+                self.durations[i],
+                descriptions[self.description_ids[i]],
+                self.miles[i],
+            )
+
+    def offset_rows(self, start: int = 0) -> Iterator[tuple]:
+        """
+        rows() with start and end as microsecond offsets from epoch (see
+        time_at), for consumers that need datetimes for only some rows.
+        """
+        descriptions = self.descriptions
+        for i in range(start, len(self.status_codes)):
+            yield (
+                STATUS_BY_CODE[self.status_codes[i]],
+                self.start_us[i],
+                self.end_us[i],
+                self.durations[i],
+                descriptions[self.description_ids[i]],
+                self.miles[i],
+            )
+
+    def __len__(self) -> int:
+        return len(self.status_codes)
+
+    def __getitem__(self, index: int) -> "TimelineSegment":
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError("timeline index out of range")
+        return TimelineSegment(*next(self.rows(index)))
+
+    def __iter__(self) -> Iterator["TimelineSegment"]:
+        for row in self.rows():
+            yield TimelineSegment(*row)
+
+
+def timeline_rows(timeline) -> Iterator[tuple]:
+    """Row tuples from a CompactTimeline or any iterable of TimelineSegment."""
+    if isinstance(timeline, CompactTimeline):
+        return timeline.rows()
+    return (
+        (
+            seg.status,
+            seg.start_time,
+            seg.end_time,
+            seg.duration_minutes,
+            seg.description,
+            seg.distance_miles,
+        )
+        for seg in timeline
+    )
+
+
 # One block on the 24h log grid (per day)
 @dataclass
 class LogGridSegment:
@@ -4,9 +4,19 @@ Turn schemas into JSON-serializable dicts for API response.
 
 from datetime import date, datetime
 
+import numpy as np
+
+from .geometry import (
+    POLYLINE_PRECISION,
+    as_coords,
+    encode_polyline,
+    simplify,
+    tolerance_for_zoom,
+)
 from .schemas import (
     DailyLog,
     DutyStatus,
+    GeometryOptions,
     LogGridSegment,
     Route,
     RouteLeg,
@@ -22,7 +32,9 @@ def _serialize_date(d: date):
     return d.isoformat() if d else None
 
 
-def route_to_dict(route: Route) -> dict:
+def route_to_dict(route: Route, geometry_options: GeometryOptions | None = None) -> dict:
+    if geometry_options is not None and not geometry_options.is_default:
+        return _compact_route_to_dict(route, geometry_options)
     return {
         "geometry": route.geometry,
         "distance_miles": route.distance_miles,
@@ -39,13 +51,84 @@ def route_to_dict(route: Route) -> dict:
     }
 
 
+def _leg_end_indices(geometry: np.ndarray, waypoints: list, leg_count: int) -> list:
+    """Route vertex nearest each intermediate waypoint; the last leg ends at the last vertex."""
+    ends = []
+    start = 0
+    for waypoint in waypoints[1:leg_count]:
+        offsets = geometry[start:] - np.asarray(waypoint, dtype=float)
+        start += int(np.argmin(np.einsum("ij,ij->i", offsets, offsets)))
+        ends.append(start)
+    while len(ends) < leg_count:
+        ends.append(len(geometry) - 1)
+    return ends
+
+
+def _compact_route_to_dict(route: Route, options: GeometryOptions) -> dict:
+    """
+    route_to_dict with simplified and/or encoded geometry. Without per-leg
+    geometry, each leg reports the route vertex where it ends instead.
+    """
+    geometry = as_coords(route.geometry)
+    waypoints = getattr(route, "waypoints", []) or []
+    leg_ends = _leg_end_indices(geometry, waypoints, len(route.legs)) if len(geometry) else []
+
+    def compact(coords: np.ndarray, keep=()):
+        kept = np.arange(len(coords))
+        if options.zoom is not None:
+            kept = simplify(coords, tolerance_for_zoom(options.zoom), keep=keep)
+            coords = coords[kept]
+        if options.format in POLYLINE_PRECISION:
+            return encode_polyline(coords, POLYLINE_PRECISION[options.format]), kept
+        return coords.tolist(), kept
+
+    encoded, kept = compact(geometry, keep=leg_ends)
+    legs = []
+    for leg, end in zip(route.legs, leg_ends or [None] * len(route.legs)):
+        item = {
+            "distance_miles": leg.distance_miles,
+            "duration_hours": leg.duration_hours,
+        }
+        if options.leg_geometry:
+            item["geometry"] = compact(as_coords(getattr(leg, "geometry", None)))[0]
+        elif end is not None:
+            item["geometry_end_index"] = int(np.searchsorted(kept, end))
+        legs.append(item)
+
+    return {
+        "geometry": encoded,
+        "geometry_format": options.format,
+        "distance_miles": route.distance_miles,
+        "duration_hours": route.duration_hours,
+        "waypoints": waypoints,
+        "legs": legs,
+    }
+
+
 def timeline_segment_to_dict(seg: TimelineSegment) -> dict:
+    return timeline_row_to_dict(
+        seg.status,
+        seg.start_time,
+        seg.end_time,
+        seg.duration_minutes,
+        seg.description,
+    )
+
+
+def timeline_row_to_dict(
+    status: DutyStatus,
+    start_time: datetime,
+    end_time: datetime,
+    duration_minutes: float,
+    description: str,
+) -> dict:
+    """Same shape as timeline_segment_to_dict, from a CompactTimeline row tuple."""
     return {
-        "status": seg.status.value,
-        "start_time": _serialize_datetime(seg.start_time),
-        "end_time": _serialize_datetime(seg.end_time),
-        "duration_minutes": seg.duration_minutes,
-        "description": seg.description,
+        "status": status.value,
+        "start_time": _serialize_datetime(start_time),
+        "end_time": _serialize_datetime(end_time),
+        "duration_minutes": duration_minutes,
+        "description": description,
     }
 
 
@@ -1 +1,2181 @@
-from django.test import TestCase
+import asyncio
+import io
+import json
+import math
+import os
+import random
+import threading
+import time as time_module
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from dataclasses import replace
+from datetime import date, datetime, time, timedelta, timezone
+from unittest import mock
+from zoneinfo import ZoneInfo
+
+import httpx
+from django.core.cache import caches
+from django.test import AsyncClient, TestCase, override_settings
+from django.utils import timezone as django_timezone
+from urllib3.connectionpool import HTTPConnectionPool
+from urllib3.response import HTTPResponse
+
+from . import (
+    encoders,
+    gazetteer,
+    mapbox_client,
+    plan_cache,
+    plan_store,
+    planner,
+    routing,
+    scenarios,
+    timeline_engine,
+    views,
+)
+from .geometry import (
+    EARTH_RADIUS_MILES,
+    GeometryIndex,
+    encode_polyline,
+    simplify,
+    tolerance_for_zoom,
+)
+from .cache import MISSING, AsyncSingleFlight, SingleFlight, TTLCache, cache_stats
+from .gazetteer import SAMPLE_GAZETTEER_PATH, Gazetteer, normalize_query
+from .log_sheet_generator import build_log_sheets
+from .models import GeocodeCacheEntry
+from .pois import MILES_PER_DEGREE_LAT, POIIndex
+from .road_graph import SAMPLE_GRAPH_PATH, RoadGraph
+from .routing import LocalGraphBackend, RoutingBackend
+from .schemas import (
+    CompactTimeline,
+    DailyLog,
+    DutyStatus,
+    GeometryOptions,
+    LogGridSegment,
+    Route,
+    RouteLeg,
+    StopSites,
+    TimelineSegment,
+    TripRequest,
+    TripStop,
+    timeline_rows,
+)
+from .serializers import daily_log_to_dict, route_to_dict
+from .timeline_engine import build_timeline
+
+
+def _route(leg_miles: list[float], mph: float = 55.0) -> Route:
+    legs = [RouteLeg(miles, miles / mph) for miles in leg_miles]
+    return Route([], sum(leg_miles), sum(leg.duration_hours for leg in legs), legs)
+
+
+def _trip(cycle_used_hrs: float, start_time: datetime | None = None, **kwargs) -> TripRequest:
+    return TripRequest(
+        current_location="A",
+        pickup_location="B",
+        dropoff_location="C",
+        current_cycle_used_hrs=cycle_used_hrs,
+        start_time=start_time or datetime(2024, 3, 4, 6, 30, tzinfo=timezone.utc),
+        **kwargs,
+    )
+
+
+class ProcessPoolTests(TestCase):
+    def tearDown(self):
+        if planner._process_pool is not None:
+            planner.discard_process_pool(planner._process_pool)
+
+    def test_broken_pool_is_replaced_and_call_retried(self):
+        broken = planner.get_process_pool(1)
+        with self.assertRaises(BrokenProcessPool):
+            broken.submit(os._exit, 1).result()
+
+        self.assertEqual(asyncio.run(planner.run_in_process_pool(1, abs, -3)), 3)
+        self.assertIsNot(planner.get_process_pool(1), broken)
+
+
+class ClosedFormTimelineTests(TestCase):
+    """build_timeline's whole-day fast path against the step-by-step simulation."""
+
+    def assertSameTimeline(self, trip, route):
+        fast = build_timeline(trip, route, closed_form=True)
+        slow = build_timeline(trip, route, closed_form=False)
+        self.assertEqual(list(fast.rows()), list(slow.rows()))
+
+    def test_random_distances_and_cycle_hours(self):
+        rng = random.Random(20240304)
+        for _ in range(300):
+            legs = [rng.choice([0.0, rng.uniform(0, 50), rng.uniform(0, 4000)]) for _ in range(2)]
+            cycle_used = rng.choice([0.0, 70.0, round(rng.uniform(0, 70), 2)])
+            history = None
+            if rng.random() < 0.3:
+                history = [round(rng.uniform(0, 14), 1) for _ in range(7)]
+                cycle_used = round(rng.uniform(0, 14), 1)
+            with self.subTest(legs=legs, cycle_used=cycle_used, history=history):
+                self.assertSameTimeline(_trip(cycle_used, cycle_history_hrs=history), _route(legs))
+
+    def test_random_multi_stop_trips(self):
+        rng = random.Random(7)
+        for _ in range(100):
+            count = rng.randint(1, 5)
+            stops = [
+                TripStop(f"S{i}", kind="stop", dwell_minutes=rng.choice([0, 15, 60, 600]))
+                for i in range(count)
+            ]
+            legs = [rng.uniform(0, 1500) for _ in range(count)]
+            cycle_used = round(rng.uniform(0, 70), 2)
+            with self.subTest(legs=legs, cycle_used=cycle_used):
+                self.assertSameTimeline(_trip(cycle_used, stops=stops), _route(legs))
+
+
+class CompactTimelineTests(TestCase):
+    def setUp(self):
+        self.epoch = datetime(2024, 3, 9, 22, 0, tzinfo=ZoneInfo("America/Chicago"))
+        self.timeline = CompactTimeline(self.epoch)
+        hour = 3_600_000_000
+        for i, (status, description) in enumerate(
+            (
+                (DutyStatus.ON_DUTY_NOT_DRIVING, "Pre-trip"),
+                (DutyStatus.DRIVING, "Driving"),
+                (DutyStatus.OFF_DUTY, "Break"),
+                (DutyStatus.DRIVING, "Driving"),
+            )
+        ):
+            self.timeline.append(status, i * hour, (i + 1) * hour, 60.0, description, 55.0 * (i % 2))
+
+    def test_rows_round_trip_appended_values(self):
+        rows = list(self.timeline.rows())
+        self.assertEqual(len(rows), 4)
+        self.assertEqual(rows[0][:2], (DutyStatus.ON_DUTY_NOT_DRIVING, self.epoch))
+        # Offsets are wall-clock: the last row ends at 02:00 even though the clocks skip it.
+        tz = self.epoch.tzinfo
+        self.assertEqual(
+            rows[3][1:3],
+            (datetime(2024, 3, 10, 1, 0, tzinfo=tz), datetime(2024, 3, 10, 2, 0, tzinfo=tz)),
+        )
+        self.assertEqual(rows[3][4:], ("Driving", 55.0))
+        self.assertEqual(self.timeline.descriptions, ["Pre-trip", "Driving", "Break"])
+        self.assertEqual([TimelineSegment(*row) for row in rows], list(self.timeline))
+
+    def test_offset_rows_match_rows(self):
+        time_at = self.timeline.time_at
+        for offsets, row in zip(self.timeline.offset_rows(1), self.timeline.rows(1)):
+            status, start_us, end_us, *rest = offsets
+            self.assertEqual((status, time_at(start_us), time_at(end_us), *rest), row)
+        self.assertEqual(len(list(self.timeline.offset_rows(1))), 3)
+
+    def test_head_copies_and_appends_independently(self):
+        head = self.timeline.head(2)
+        head.append(DutyStatus.SLEEPER_BERTH, 7_200_000_000, 10_800_000_000, 60.0, "Sleeper")
+        self.assertEqual(len(head), 3)
+        self.assertEqual(len(self.timeline), 4)
+        self.assertEqual(list(head.rows())[:2], list(self.timeline.rows())[:2])
+        self.assertEqual(head[2].description, "Sleeper")
+        self.assertNotIn("Sleeper", self.timeline.descriptions)
+
+    def test_getitem_bounds(self):
+        self.assertEqual(self.timeline[-1], self.timeline[3])
+        self.assertEqual(self.timeline[-4].description, "Pre-trip")
+        for index in (4, -5):
+            with self.subTest(index=index), self.assertRaises(IndexError):
+                self.timeline[index]
+        with self.assertRaises(IndexError):
+            CompactTimeline(self.epoch)[0]
+
+
+def _offset(point, east_miles: float = 0.0, north_miles: float = 0.0) -> list:
+    lng, lat = point
+    return [
+        lng + east_miles / (MILES_PER_DEGREE_LAT * math.cos(math.radians(lat))),
+        lat + north_miles / MILES_PER_DEGREE_LAT,
+    ]
+
+
+class POIIndexTests(TestCase):
+    """Grid lookups and corridor queries around a straight east-west line."""
+
+    START = [-100.0, 40.0]
+
+    def index(self, points, kinds=None) -> POIIndex:
+        return POIIndex(
+            [f"P{i}" for i in range(len(points))],
+            kinds or ["truck_stop"] * len(points),
+            [p[0] for p in points],
+            [p[1] for p in points],
+            cell_miles=3.0,
+        )
+
+    def test_near(self):
+        index = self.index([_offset(self.START, 1), _offset(self.START, 0, 5), _offset(self.START, 20)])
+        other = _offset(self.START, 21)
+        points, pois, miles = index.near(
+            [self.START[0], other[0]], [self.START[1], other[1]], 5.5
+        )
+        found = sorted(zip(points.tolist(), pois.tolist()))
+        self.assertEqual(found, [(0, 0), (0, 1), (1, 2)])
+        for point, poi, distance in zip(points, pois, miles):
+            self.assertAlmostEqual(distance, [1.0, 5.0, 1.0][poi], delta=0.01)
+        self.assertEqual(len(index.near([], [], 3.0)[0]), 0)
+
+    def test_corridor_finds_pois_between_samples(self):
+        end = _offset(self.START, 30)
+        geometry = [self.START, _offset(self.START, 10), end]
+        # Samples fall every 1.5 miles; 2.25 is halfway between two of them.
+        points = [
+            _offset(self.START, 2.25, 2.95),
+            _offset(self.START, 2.25, -3.05),
+            _offset(self.START, 12.0, -1.0),
+            _offset(end, 2.0),
+            _offset(end, 3.5),
+        ]
+        index = self.index(points, ["truck_stop", "truck_stop", "rest_area", "truck_stop", "truck_stop"])
+        # Road miles are twice the polyline's length here.
+        sites = index.corridor(geometry, 60.0, 3.0)
+        self.assertEqual(sites.names, ["P0", "P2", "P3"])
+        self.assertEqual(sites.kinds, ["truck_stop", "rest_area", "truck_stop"])
+        for miles, expected in zip(sites.miles, [4.5, 24.0, 60.0]):
+            self.assertAlmostEqual(miles, expected, delta=0.02)
+        self.assertEqual(sites.fuel_miles, [sites.miles[0], sites.miles[2]])
+        self.assertEqual(len(index.corridor([self.START], 0.0, 3.0)), 0)
+
+    def test_corridor_matches_brute_force(self):
+        rng = random.Random(11)
+        # A winding road heading south-west, ~0.5 mile per segment.
+        geometry = [self.START]
+        for _ in range(300):
+            lng, lat = geometry[-1]
+            geometry.append([lng - rng.uniform(-0.004, 0.012), lat - rng.uniform(-0.004, 0.008)])
+        points = [
+            _offset(rng.choice(geometry), rng.uniform(-3, 3), rng.uniform(-3, 3)) for _ in range(1000)
+        ]
+        sites = self.index(points).corridor(geometry, 100.0, 2.0)
+
+        def miles_to_line(point):
+            scale = MILES_PER_DEGREE_LAT * math.cos(math.radians(point[1]))
+            projected = [
+                ((lng - point[0]) * scale, (lat - point[1]) * MILES_PER_DEGREE_LAT)
+                for lng, lat in geometry
+            ]
+            return min(_segment_distance((0, 0), a, b) for a, b in zip(projected[:-1], projected[1:]))
+
+        expected = {f"P{i}" for i, point in enumerate(points) if miles_to_line(point) <= 2.0}
+        self.assertGreater(len(expected), 100)
+        self.assertEqual(set(sites.names), expected)
+        self.assertEqual(sites.miles, sorted(sites.miles))
+
+
+class StopSiteSnappingTests(TestCase):
+    """Fuel stops and rests moved to the truck stops and rest areas along a leg."""
+
+    def drives_and_stops(self, sites) -> list[tuple[str, float]]:
+        """(description, leg miles where it starts) for each stop on the first leg."""
+        timeline = build_timeline(_trip(0, stop_sites=[sites, None]), _route([1200.0, 10.0]))
+        stops, miles = [], 0.0
+        for status, _, _, _, description, distance in timeline.rows():
+            if description == "Pickup (1 hr)":
+                break
+            if status == DutyStatus.DRIVING:
+                miles += distance
+            else:
+                stops.append((description, round(miles, 6)))
+        return stops
+
+    def test_without_sites(self):
+        self.assertEqual(
+            self.drives_and_stops(None),
+            [
+                ("30-minute break", 440.0),
+                ("10-hour rest (11hr drive limit)", 605.0),
+                ("Fuel stop", 1000.0),
+            ],
+        )
+
+    def test_break_rest_and_fuel_move_to_sites(self):
+        sites = StopSites(
+            [420.0, 590.0, 900.0],
+            ["Rest Area", "Truck Stop A", "Truck Stop B"],
+            ["rest_area", "truck_stop", "truck_stop"],
+            [[0, 0], [0, 0], [0, 0]],
+        )
+        self.assertEqual(
+            self.drives_and_stops(sites),
+            [
+                ("30-minute break", 420.0),
+                ("10-hour rest (11hr drive limit)", 590.0),
+                # Only truck stops sell fuel: the last one before 1000 miles.
+                ("Fuel stop", 900.0),
+                # The next 11 hours of driving count from the earlier rest.
+                ("10-hour rest (11hr drive limit)", 1195.0),
+            ],
+        )
+
+    def test_sites_too_far_back_are_skipped(self):
+        # More than SITE_SNAP_MAX_EARLY_MIN of driving before the break falls due.
+        sites = StopSites([300.0], ["Rest Area"], ["rest_area"], [[0, 0]])
+        self.assertEqual(self.drives_and_stops(sites), self.drives_and_stops(None))
+
+
+class CycleHistoryTests(TestCase):
+    """Exact 70hr/8-day tracking from cycle_history_hrs, checked against the log sheet days."""
+
+    def assertWithinCycle(self, trip, timeline):
+        """
+        Every 8 consecutive log days, history included, hold at most 70
+        on-duty hours; a 34-hour restart clears the days before it.
+        """
+        days = [float(hours) for hours in trip.cycle_history_hrs]
+        for log in build_log_sheets(timeline, trip):
+            days.append(0.0)
+            for seg in log.segments:
+                if seg.description == timeline_engine.RESTART_DESCRIPTION:
+                    days = [0.0] * len(days)
+                elif seg.status in (DutyStatus.DRIVING, DutyStatus.ON_DUTY_NOT_DRIVING):
+                    days[-1] += seg.duration_minutes / 60
+        for i in range(len(days) - 7):
+            self.assertLessEqual(sum(days[i : i + 8]), 70 + 1e-6, f"days {i - 7}..{i}")
+
+    def cycle_waits(self, timeline) -> list[TimelineSegment]:
+        waits = (timeline_engine.CYCLE_WAIT_DESCRIPTION, timeline_engine.CYCLE_WAIT_REST_DESCRIPTION)
+        return [TimelineSegment(*row[:5]) for row in timeline.rows() if row[4] in waits]
+
+    def test_no_restart_when_history_allows_driving(self):
+        # 57 hours, mostly early in the window: room comes back each midnight.
+        history = [12, 12, 12, 11, 10, 0, 0]
+        trip = _trip(sum(history), cycle_history_hrs=history)
+        timeline = build_timeline(trip, _route([1200.0, 1800.0]))
+        descriptions = {row[4] for row in timeline.rows()}
+        self.assertNotIn(timeline_engine.RESTART_DESCRIPTION, descriptions)
+        self.assertWithinCycle(trip, timeline)
+
+        # The same hours without the per-day history are assumed to roll off evenly.
+        timeline = build_timeline(_trip(sum(history)), _route([1200.0, 1800.0]))
+        self.assertIn(timeline_engine.RESTART_DESCRIPTION, {row[4] for row in timeline.rows()})
+
+    def test_full_cycle_waits_until_oldest_day_drops_out(self):
+        chicago = ZoneInfo("America/Chicago")
+        history = [14, 10, 10, 10, 10, 10, 6]
+        trip = _trip(70, datetime(2024, 3, 4, 6, 0, tzinfo=chicago), cycle_history_hrs=history)
+        timeline = build_timeline(trip, _route([300.0, 300.0]))
+        first = timeline[0]
+        self.assertEqual(first.status, DutyStatus.OFF_DUTY)
+        self.assertEqual(first.description, timeline_engine.CYCLE_WAIT_REST_DESCRIPTION)
+        self.assertEqual(first.start_time, trip.start_time)
+        self.assertEqual(first.end_time, datetime(2024, 3, 5, 0, 0, tzinfo=chicago))
+        # The oldest day's 14 hours came free: a full duty window follows.
+        self.assertEqual(timeline[1].status, DutyStatus.DRIVING)
+        self.assertNotIn(timeline_engine.RESTART_DESCRIPTION, {row[4] for row in timeline.rows()})
+        self.assertWithinCycle(trip, timeline)
+
+    def test_dst_week(self):
+        new_york = ZoneInfo("America/New_York")
+        rng = random.Random(19)
+        # Saturday before the spring-forward change; the trip runs well past it.
+        start = datetime(2024, 3, 9, 20, 0, tzinfo=new_york)
+        waits_after_change = 0
+        for start_time, home in (
+            (start, None),
+            (start.astimezone(timezone.utc), "America/New_York"),
+            (start.astimezone(ZoneInfo("America/Los_Angeles")), "America/New_York"),
+        ):
+            for _ in range(20):
+                history = [71]
+                while sum(history) > 70:
+                    history = [rng.choice([0, 8, 11, 14]) for _ in range(7)]
+                trip = _trip(
+                    sum(history),
+                    start_time,
+                    cycle_history_hrs=history,
+                    home_terminal_timezone=home,
+                )
+                route = _route([rng.uniform(500, 3000), rng.uniform(500, 3000)])
+                with self.subTest(start=start_time, history=history, miles=route.distance_miles):
+                    timeline = build_timeline(trip, route)
+                    self.assertWithinCycle(trip, timeline)
+                    for wait in self.cycle_waits(timeline):
+                        local_end = wait.end_time.astimezone(new_york)
+                        self.assertEqual((local_end.hour, local_end.minute), (0, 0), wait)
+                        waits_after_change += local_end.date() > date(2024, 3, 10)
+        self.assertGreater(waits_after_change, 10)
+
+
+
+
+class MultiStopTests(TestCase):
+    def setUp(self):
+        self.stops = [
+            TripStop("B", kind="pickup", dwell_minutes=30),
+            TripStop("S", dwell_minutes=90),
+            TripStop("C", kind="dropoff", dwell_minutes=600),
+        ]
+        self.trip = _trip(60, stops=self.stops)
+        self.route = _route([300.0, 1200.0, 600.0])
+
+    def test_stop_descriptions(self):
+        self.assertEqual(
+            [stop.description for stop in self.stops],
+            ["Pickup (30 min)", "Stop (90 min)", "Dropoff (10 hr)"],
+        )
+        self.assertEqual(TripStop("X", dwell_minutes=22.5).description, "Stop (22.5 min)")
+
+    def test_request_legs_follow_the_stops(self):
+        legs = timeline_engine.request_legs(self.trip, self.route)
+        self.assertEqual(
+            [
+                (leg.distance_miles, leg.drive_description, leg.stop_description, leg.stop_minutes)
+                for leg in legs
+            ],
+            [
+                (300.0, "Driving to pickup", "Pickup (30 min)", 30),
+                (1200.0, "Driving to stop", "Stop (90 min)", 90),
+                (600.0, "Driving to dropoff", "Dropoff (10 hr)", 600),
+            ],
+        )
+        # Without stops: the classic pickup and dropoff, an hour each.
+        legs = timeline_engine.request_legs(_trip(60), _route([300.0, 600.0]))
+        self.assertEqual([leg.stop_description for leg in legs], ["Pickup (1 hr)", "Dropoff (1 hr)"])
+
+    def test_each_stop_dwells_once_in_order(self):
+        timeline = build_timeline(self.trip, self.route)
+        descriptions = [stop.description for stop in self.stops]
+        dwells = [
+            (status, minutes, description)
+            for status, _, _, minutes, description, _ in timeline.rows()
+            if description in descriptions
+        ]
+        self.assertEqual(
+            dwells,
+            [(DutyStatus.ON_DUTY_NOT_DRIVING, stop.dwell_minutes, stop.description) for stop in self.stops],
+        )
+        self.assertEqual(timeline[-1].description, "Dropoff (10 hr)")
+        self.assertAlmostEqual(sum(row[5] for row in timeline.rows()), 2100.0)
+
+    def test_log_sheets_run_from_stop_to_stop(self):
+        logs = build_log_sheets(build_timeline(self.trip, self.route), self.trip)
+        places = ["A", "B", "S", "C"]
+        self.assertEqual(logs[0].from_place, "A")
+        self.assertEqual(logs[-1].to_place, "C")
+        for earlier, later in zip(logs, logs[1:]):
+            # A day starts at the last stop reached and heads for the next one.
+            self.assertLessEqual(places.index(earlier.from_place), places.index(later.from_place))
+            self.assertLess(places.index(later.from_place), places.index(later.to_place))
+
+class SnapshotTests(TestCase):
+    """HOSSnapshot serialization, and resuming a timeline from one."""
+
+    def random_trips(self, rng: random.Random, count: int):
+        chicago = ZoneInfo("America/Chicago")
+        for _ in range(count):
+            # Starts before the 2024 DST changes, so resumed trips cross them.
+            start = rng.choice([datetime(2024, 3, 8, 20, 0), datetime(2024, 10, 31, 6, 0)])
+            kwargs = {}
+            if rng.random() < 0.5:
+                kwargs["cycle_history_hrs"] = [rng.choice([0, 8, 11]) for _ in range(7)]
+                kwargs["home_terminal_timezone"] = rng.choice([None, "America/New_York"])
+            if rng.random() < 0.3:
+                kwargs["stops"] = [TripStop(f"S{i}", dwell_minutes=45) for i in range(3)]
+                route = _route([rng.uniform(0, 1500) for _ in range(3)])
+            else:
+                route = _route([rng.uniform(0, 2500), rng.uniform(0, 2500)])
+            zone = rng.choice([chicago, timezone.utc])
+            yield _trip(round(rng.uniform(0, 60), 1), start.replace(tzinfo=zone), **kwargs), route
+
+    def assertSameRows(self, actual: list, expected: list):
+        """Times, statuses and descriptions exactly; minutes and miles up to float rounding."""
+        self.assertEqual([row[:3] + row[4:5] for row in actual], [row[:3] + row[4:5] for row in expected])
+        for row, other in zip(actual, expected):
+            self.assertAlmostEqual(row[3], other[3], places=9)
+            self.assertAlmostEqual(row[5], other[5], places=9)
+
+    def test_to_dict_round_trip(self):
+        for trip, route in self.random_trips(random.Random(18), 30):
+            _, snapshots = timeline_engine.build_timeline_checkpoints(
+                trip, route, checkpoint_at=timeline_engine.CHECKPOINT_KINDS
+            )
+            self.assertTrue(snapshots)
+            for snapshot in snapshots:
+                data = json.loads(json.dumps(snapshot.to_dict()))
+                self.assertEqual(data["current_time"], snapshot.current.isoformat())
+                restored = timeline_engine.HOSSnapshot.from_dict(data)
+                self.assertEqual(restored, snapshot)
+                self.assertEqual(restored.epoch.utcoffset(), snapshot.epoch.utcoffset())
+                self.assertEqual(restored.current, snapshot.current)
+                self.assertEqual(restored.state(), snapshot.state())
+
+    def test_resume_from_snapshot_reproduces_timeline(self):
+        for trip, route in self.random_trips(random.Random(180), 40):
+            legs = timeline_engine.request_legs(trip, route)
+            timeline, snapshots = timeline_engine.build_timeline_checkpoints(
+                trip, route, checkpoint_at=timeline_engine.CHECKPOINT_KINDS
+            )
+            rows = list(timeline.rows())
+            for snapshot in snapshots[:: max(1, len(snapshots) // 5)]:
+                restored = timeline_engine.HOSSnapshot.from_dict(
+                    json.loads(json.dumps(snapshot.to_dict()))
+                )
+                with self.subTest(start=trip.start_time, row=snapshot.row, kind=snapshot.kind):
+                    resumed = timeline_engine.resume_from_snapshot(restored, legs, timeline)
+                    self.assertSameRows(list(resumed.rows()), rows)
+                    # Without a prefix the timeline holds just the rows after the snapshot.
+                    tail = timeline_engine.resume_from_snapshot(restored, legs)
+                    self.assertSameRows(list(tail.rows()), rows[snapshot.row :])
+
+
+CHICAGO = [-87.63, 41.88]
+DALLAS = [-96.8, 32.78]
+DENVER = [-104.99, 39.74]
+
+
+class LocalGraphBackendTests(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.graph = RoadGraph.load(SAMPLE_GRAPH_PATH)
+
+    def test_routing_backend_is_abstract(self):
+        with self.assertRaises(TypeError):
+            RoutingBackend()
+
+    def test_routes_over_bundled_graph(self):
+        backend = LocalGraphBackend(self.graph, max_snap_miles=25)
+        route = backend.route([CHICAGO, DALLAS, DENVER])
+
+        self.assertIsNotNone(route)
+        self.assertEqual(len(route.legs), 2)
+        self.assertEqual(route.waypoints, [CHICAGO, DALLAS, DENVER])
+        self.assertAlmostEqual(route.distance_miles, sum(leg.distance_miles for leg in route.legs))
+        # Roads are longer than the great circle (Chicago-Dallas is ~800 mi) but not wildly so.
+        self.assertTrue(800 < route.legs[0].distance_miles < 1200, route.legs[0].distance_miles)
+        self.assertGreater(route.duration_hours, 0)
+        for point, leg in ((CHICAGO, route.legs[0]), (DALLAS, route.legs[1])):
+            self.assertAlmostEqual(leg.geometry[0][0], point[0], delta=0.5)
+            self.assertAlmostEqual(leg.geometry[0][1], point[1], delta=0.5)
+        self.assertEqual(route.legs[0].geometry[-1], route.legs[1].geometry[0])
+        self.assertEqual(len(route.geometry), sum(len(leg.geometry) for leg in route.legs) - 1)
+
+        async_route = asyncio.run(backend.aroute([CHICAGO, DALLAS, DENVER]))
+        self.assertEqual(async_route, route)
+
+    def test_unreachable_target_gives_no_route(self):
+        # Two components: 0-1 and 2-3, both bidirectional.
+        graph = RoadGraph.from_edges(
+            [[0.0, 0.0], [0.1, 0.0], [5.0, 5.0], [5.1, 5.0]],
+            tails=[0, 2],
+            heads=[1, 3],
+            length_m=[11000, 11000],
+            duration_s=[600, 600],
+            bidirectional=True,
+        )
+        backend = LocalGraphBackend(graph)
+
+        self.assertIsNotNone(backend.route([[0.0, 0.0], [0.1, 0.0]]))
+        self.assertIsNone(graph.shortest_path(0, 2))
+        self.assertIsNone(backend.route([[0.0, 0.0], [5.1, 5.0]]))
+
+    def test_waypoint_beyond_snap_distance_gives_no_route(self):
+        mid_atlantic = [-40.0, 35.0]
+        self.assertIsNone(LocalGraphBackend(self.graph, max_snap_miles=25).route([CHICAGO, mid_atlantic]))
+        # Within the limit a nearby point snaps to its city node.
+        near_chicago = [CHICAGO[0] + 0.1, CHICAGO[1]]
+        self.assertIsNotNone(LocalGraphBackend(self.graph, max_snap_miles=25).route([near_chicago, DALLAS]))
+        # Without a limit even a far point snaps to the closest node.
+        self.assertIsNotNone(LocalGraphBackend(self.graph).route([CHICAGO, mid_atlantic]))
+
+
+class TTLCacheTests(TestCase):
+    def setUp(self):
+        self.clock = self.enterContext(mock.patch("trips.cache.time")).monotonic
+        self.clock.return_value = 1000.0
+
+    def test_entries_expire(self):
+        cache = TTLCache("test-expiry", max_entries=10, ttl_seconds=60)
+        cache.set("a", 1)
+        cache.set("b", 2, ttl_seconds=120)
+        self.clock.return_value = 1059.9
+        self.assertEqual(cache.get("a"), 1)
+        self.clock.return_value = 1060.0
+        self.assertIs(cache.get("a"), MISSING)
+        self.assertIs(cache.peek("a"), MISSING)
+        self.assertEqual(cache.get("b"), 2)
+        self.assertEqual(cache.get("a", None), None)
+        self.assertEqual(cache.stats()["entries"], 1)
+
+    def test_least_recently_used_entry_is_evicted(self):
+        cache = TTLCache("test-lru", max_entries=2, ttl_seconds=60)
+        cache.set("a", 1)
+        cache.set("b", 2)
+        cache.get("a")
+        cache.peek("b")  # does not count as a use
+        cache.set("c", 3)
+        self.assertIs(cache.peek("b"), MISSING)
+        self.assertEqual((cache.peek("a"), cache.peek("c")), (1, 3))
+        cache.set("a", 4)  # overwriting is a use, not an eviction
+        cache.set("d", 5)
+        self.assertIs(cache.peek("c"), MISSING)
+        self.assertEqual(cache.stats()["evictions"], 2)
+
+    def test_stats_count_hits_and_misses(self):
+        cache = TTLCache("test-stats", max_entries=1, ttl_seconds=60)
+        cache.get("a")
+        cache.set("a", 1)
+        cache.get("a")
+        cache.get("a")
+        cache.peek("a")
+        cache.set("b", 2)
+        expected = {
+            "entries": 1,
+            "max_entries": 1,
+            "ttl_seconds": 60.0,
+            "hits": 2,
+            "misses": 1,
+            "evictions": 1,
+            "hit_ratio": 0.6667,
+        }
+        self.assertEqual(cache.stats(), expected)
+        self.assertEqual(cache_stats()["test-stats"], expected)
+        cache.clear()
+        self.assertEqual(cache.stats()["entries"], 0)
+        self.assertEqual(TTLCache("test-empty").stats()["hit_ratio"], 0.0)
+
+
+@override_settings(GEOCODE_CACHE_PERSISTENT=True, GEOCODE_CACHE_TTL_SECONDS=3600)
+class GeocodeCacheTests(TestCase):
+    """The in-process and database tiers in front of a mocked Mapbox geocoder."""
+
+    def setUp(self):
+        self.enterContext(mock.patch.object(gazetteer, "get_gazetteer", return_value=None))
+        self.enterContext(mock.patch.object(mapbox_client, "_geocode_cache", None))
+        self.upstream = self.enterContext(
+            mock.patch.object(mapbox_client, "_geocode", return_value=[-97.1, 33.2])
+        )
+
+    def forget_in_process(self):
+        mapbox_client._get_geocode_cache().clear()
+
+    def test_tiers_answer_in_turn(self):
+        self.assertEqual(mapbox_client.geocode("Denton ,TX", "token"), [-97.1, 33.2])
+        self.assertEqual(self.upstream.call_count, 1)
+        entry = GeocodeCacheEntry.objects.get()
+        self.assertEqual((entry.query, entry.lng, entry.lat), ("denton, tx", -97.1, 33.2))
+
+        self.assertEqual(mapbox_client.geocode("denton, tx", "token"), [-97.1, 33.2])
+        self.forget_in_process()
+        self.assertEqual(mapbox_client.geocode("Denton, TX", "token"), [-97.1, 33.2])
+        self.assertEqual(self.upstream.call_count, 1)
+        # The database hit refilled the in-process tier.
+        self.assertEqual(mapbox_client._get_geocode_cache().peek("denton, tx"), (-97.1, 33.2))
+
+    def test_not_found_is_cached_too(self):
+        self.upstream.return_value = []
+        self.assertEqual(mapbox_client.geocode("Nowhere", "token"), [])
+        entry = GeocodeCacheEntry.objects.get()
+        self.assertEqual((entry.lng, entry.lat), (None, None))
+        self.forget_in_process()
+        self.assertEqual(mapbox_client.geocode("Nowhere", "token"), [])
+        self.assertEqual(self.upstream.call_count, 1)
+
+    def test_expired_rows_are_ignored(self):
+        GeocodeCacheEntry.objects.create(
+            query="denton, tx", lng=0.0, lat=0.0, created_at=django_timezone.now() - timedelta(hours=2)
+        )
+        self.assertEqual(mapbox_client.geocode("Denton, TX", "token"), [-97.1, 33.2])
+        self.assertEqual(self.upstream.call_count, 1)
+        self.assertEqual(GeocodeCacheEntry.objects.get().lng, -97.1)
+
+    def test_use_cache_false_skips_both_tiers_and_refreshes_them(self):
+        mapbox_client.geocode("Denton, TX", "token")
+        self.upstream.return_value = [-97.2, 33.3]
+        self.assertEqual(mapbox_client.geocode("Denton, TX", "token", use_cache=False), [-97.2, 33.3])
+        self.assertEqual(self.upstream.call_count, 2)
+        self.assertEqual(GeocodeCacheEntry.objects.get().lng, -97.2)
+        self.assertEqual(mapbox_client.geocode("Denton, TX", "token"), [-97.2, 33.3])
+        self.assertEqual(self.upstream.call_count, 2)
+
+    @override_settings(GEOCODE_CACHE_PERSISTENT=False)
+    def test_database_tier_can_be_off(self):
+        mapbox_client.geocode("Denton, TX", "token")
+        self.assertFalse(GeocodeCacheEntry.objects.exists())
+        self.forget_in_process()
+        mapbox_client.geocode("Denton, TX", "token")
+        self.assertEqual(self.upstream.call_count, 2)
+
+    async def test_async_tiers(self):
+        aupstream = self.enterContext(
+            mock.patch.object(mapbox_client, "_ageocode", mock.AsyncMock(return_value=[-97.1, 33.2]))
+        )
+        self.assertEqual(await mapbox_client.ageocode("Denton, TX", "token"), [-97.1, 33.2])
+        self.assertEqual(await GeocodeCacheEntry.objects.acount(), 1)
+        self.forget_in_process()
+        self.assertEqual(await mapbox_client.ageocode("Denton, TX", "token"), [-97.1, 33.2])
+        self.assertEqual(aupstream.await_count, 1)
+        aupstream.return_value = [-97.2, 33.3]
+        self.assertEqual(
+            await mapbox_client.ageocode("Denton, TX", "token", use_cache=False), [-97.2, 33.3]
+        )
+        self.assertEqual(aupstream.await_count, 2)
+
+
+class GeocodeLocationsTests(TestCase):
+    """Concurrent endpoint geocoding under one deadline, against a mocked geocoder."""
+
+    COORDS = {"a": [-1.0, 1.0], "b": [-2.0, 2.0], "c": [-3.0, 3.0], "missing": []}
+    # Later locations answer first.
+    DELAYS = {"a": 0.06, "b": 0.03, "c": 0.0, "missing": 0.0}
+
+    def setUp(self):
+        self.release = threading.Event()
+        self.addCleanup(self.release.set)
+
+    def fake_geocode(self, query, token, use_cache=True, timeout=None):
+        key = normalize_query(query)
+        if key == "slow":
+            self.release.wait(5)
+            return [-9.0, 9.0]
+        time_module.sleep(self.DELAYS[key])
+        return self.COORDS[key]
+
+    async def fake_ageocode(self, query, token, use_cache=True, timeout=None):
+        key = normalize_query(query)
+        if key == "slow":
+            try:
+                await asyncio.sleep(5)
+            except asyncio.CancelledError:
+                self.cancelled.append(query)
+                raise
+            return [-9.0, 9.0]
+        await asyncio.sleep(self.DELAYS[key])
+        return self.COORDS[key]
+
+    def locate(self, locations):
+        with mock.patch.object(mapbox_client, "geocode", side_effect=self.fake_geocode) as geocode:
+            started = time_module.monotonic()
+            resolved = mapbox_client.geocode_locations(locations, "token", True)
+            return resolved, geocode, time_module.monotonic() - started
+
+    async def alocate(self, locations):
+        self.cancelled = []
+        with mock.patch.object(mapbox_client, "ageocode", side_effect=self.fake_ageocode) as ageocode:
+            started = time_module.monotonic()
+            resolved = await mapbox_client.ageocode_locations(locations, "token", True)
+            # Let cancelled tasks run their handlers.
+            await asyncio.sleep(0)
+            return resolved, ageocode, time_module.monotonic() - started
+
+    LOCATIONS = [("A", None), ("Given", [5.0, 5.0]), ("B", None), (" a ", None), ("C", [])]
+    EXPECTED = [[-1.0, 1.0], [5.0, 5.0], [-2.0, 2.0], [-1.0, 1.0], [-3.0, 3.0]]
+
+    def test_results_keep_input_order(self):
+        resolved, geocode, _ = self.locate(self.LOCATIONS)
+        self.assertEqual(resolved, self.EXPECTED)
+        # One lookup per distinct query; given coords are not looked up.
+        self.assertEqual(sorted(call.args[0] for call in geocode.call_args_list), ["A", "B", "C"])
+        self.assertEqual(self.locate([("x", [1.0, 2.0])])[0], [[1.0, 2.0]])
+
+    async def test_async_results_keep_input_order(self):
+        resolved, ageocode, _ = await self.alocate(self.LOCATIONS)
+        self.assertEqual(resolved, self.EXPECTED)
+        self.assertEqual(sorted(call.args[0] for call in ageocode.call_args_list), ["A", "B", "C"])
+
+    @override_settings(GEOCODE_DEADLINE_SECONDS=0.2)
+    def test_deadline(self):
+        resolved, _, elapsed = self.locate([("A", None), ("Slow", None)])
+        self.assertIsNone(resolved)
+        self.assertLess(elapsed, 2)
+
+    @override_settings(GEOCODE_DEADLINE_SECONDS=0.2)
+    async def test_async_deadline_cancels_lookups(self):
+        resolved, _, elapsed = await self.alocate([("A", None), ("Slow", None)])
+        self.assertIsNone(resolved)
+        self.assertLess(elapsed, 2)
+        self.assertEqual(self.cancelled, ["Slow"])
+
+    def test_not_found_returns_without_waiting(self):
+        resolved, _, elapsed = self.locate([("Slow", None), ("Missing", None)])
+        self.assertIsNone(resolved)
+        self.assertLess(elapsed, 2)
+        self.assertIsNone(self.locate([("Missing", None)])[0])
+
+    async def test_async_not_found_cancels_lookups(self):
+        resolved, _, elapsed = await self.alocate([("Slow", None), ("Missing", None)])
+        self.assertIsNone(resolved)
+        self.assertLess(elapsed, 2)
+        self.assertEqual(self.cancelled, ["Slow"])
+
+    def test_errors_propagate(self):
+        with mock.patch.object(mapbox_client, "geocode", side_effect=ValueError("bad response")):
+            with self.assertRaises(ValueError):
+                mapbox_client.geocode_locations([("A", None), ("B", None)], "token", True)
+
+
+@override_settings(MAPBOX_MAX_RETRIES=2, MAPBOX_RETRY_BACKOFF_SECONDS=0.3, MAPBOX_POOL_SIZE=7)
+class SessionTests(TestCase):
+    """The pooled Mapbox session, over a connection pool that answers from a script."""
+
+    def setUp(self):
+        self.enterContext(mock.patch.object(mapbox_client, "_session", None))
+        self.enterContext(mock.patch.object(mapbox_client, "_session_pid", None))
+        self.sleep = self.enterContext(mock.patch("urllib3.util.retry.time.sleep"))
+
+    def get(self, *responses):
+        """GET through the session; responses are (status, headers) answered in turn."""
+        script = iter(responses)
+        self.statuses = []
+
+        def make_request(pool, conn, method, url, **kwargs):
+            status, headers = next(script)
+            self.statuses.append(status)
+            return HTTPResponse(
+                body=io.BytesIO(b"{}"),
+                status=status,
+                headers=headers,
+                preload_content=False,
+                request_method=method,
+                request_url=url,
+            )
+
+        with mock.patch.object(HTTPConnectionPool, "_make_request", make_request):
+            return mapbox_client._get_session().get("https://api.mapbox.com/x.json", timeout=1)
+
+    def test_retries_with_backoff_on_retry_statuses(self):
+        response = self.get((503, {}), (429, {}), (200, {}))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.statuses, [503, 429, 200])
+        # urllib3 retries the first error at once, then backs off exponentially.
+        self.assertEqual([call.args[0] for call in self.sleep.call_args_list], [0.6])
+
+    def test_gives_up_after_the_retry_limit(self):
+        response = self.get((500, {}), (502, {}), (504, {}), (200, {}))
+        self.assertEqual(response.status_code, 504)
+        self.assertEqual(self.statuses, [500, 502, 504])
+
+    def test_client_errors_are_not_retried(self):
+        for status in (400, 401, 404, 422):
+            with self.subTest(status=status):
+                self.assertEqual(self.get((status, {}), (200, {})).status_code, status)
+                self.assertEqual(self.statuses, [status])
+
+    def test_retry_after_is_respected(self):
+        self.assertEqual(self.get((429, {"Retry-After": "3"}), (200, {})).status_code, 200)
+        self.assertEqual([call.args[0] for call in self.sleep.call_args_list], [3.0])
+
+    def test_session_is_shared_and_rebuilt_after_fork(self):
+        session = mapbox_client._get_session()
+        self.assertIs(mapbox_client._get_session(), session)
+        adapter = session.get_adapter("https://api.mapbox.com")
+        self.assertEqual(adapter._pool_maxsize, 7)
+        retry = adapter.max_retries
+        self.assertEqual((retry.total, retry.backoff_factor), (2, 0.3))
+        self.assertEqual(set(retry.status_forcelist), set(mapbox_client.RETRY_STATUSES))
+        self.assertEqual(retry.allowed_methods, frozenset(["GET"]))
+
+        with mock.patch.object(mapbox_client.os, "getpid", return_value=os.getpid() + 1):
+            child = mapbox_client._get_session()
+            self.assertIsNot(child, session)
+            self.assertIs(mapbox_client._get_session(), child)
+
+
+@override_settings(MAPBOX_MAX_RETRIES=2, MAPBOX_RETRY_BACKOFF_SECONDS=0.3)
+class AsyncGetJsonTests(TestCase):
+    """_aget_json's retry loop over an httpx MockTransport."""
+
+    async def get(self, *responses):
+        """_aget_json against responses, (status, headers) answered in turn."""
+        script = iter(responses)
+        self.statuses = []
+
+        def handler(request):
+            status, headers = next(script)
+            self.statuses.append(status)
+            return httpx.Response(status, headers=headers, json={"status": status})
+
+        self.sleep = mock.AsyncMock()
+        async with httpx.AsyncClient(transport=httpx.MockTransport(handler)) as client:
+            with (
+                mock.patch.object(mapbox_client, "_get_async_client", return_value=client),
+                mock.patch.object(mapbox_client.asyncio, "sleep", self.sleep),
+            ):
+                return await mapbox_client._aget_json("https://api.mapbox.com/x.json", {}, 1)
+
+    def delays(self) -> list[float]:
+        return [call.args[0] for call in self.sleep.await_args_list]
+
+    async def test_retries_with_backoff_on_retry_statuses(self):
+        self.assertEqual(await self.get((503, {}), (429, {}), (200, {})), {"status": 200})
+        self.assertEqual(self.statuses, [503, 429, 200])
+        self.assertEqual(self.delays(), [0.3, 0.6])
+
+    async def test_gives_up_after_the_retry_limit(self):
+        with self.assertRaises(httpx.HTTPStatusError) as caught:
+            await self.get((500, {}), (502, {}), (504, {}), (200, {}))
+        self.assertEqual(caught.exception.response.status_code, 504)
+        self.assertEqual(self.statuses, [500, 502, 504])
+
+    async def test_client_errors_are_not_retried(self):
+        for status in (400, 401, 404, 422):
+            with self.subTest(status=status):
+                with self.assertRaises(httpx.HTTPStatusError):
+                    await self.get((status, {}), (200, {}))
+                self.assertEqual(self.statuses, [status])
+                self.assertEqual(self.delays(), [])
+
+    async def test_retry_after_is_respected(self):
+        self.assertEqual(await self.get((429, {"Retry-After": "3"}), (200, {})), {"status": 200})
+        self.assertEqual(self.delays(), [3.0])
+
+
+class GazetteerTests(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.gazetteer = Gazetteer.load(SAMPLE_GAZETTEER_PATH)
+
+    def test_normalize_query(self):
+        self.assertEqual(normalize_query("  Dallas ,TX  "), "dallas, tx")
+        self.assertEqual(normalize_query("Salt   Lake\tCity,UT"), "salt lake city, ut")
+        self.assertEqual(normalize_query(", Denver, "), "denver")
+        self.assertEqual(normalize_query(""), "")
+        self.assertEqual(normalize_query(None), "")
+
+    def test_lookup(self):
+        self.assertEqual(self.gazetteer.lookup("dallas, tx"), [-96.8, 32.78])
+        self.assertEqual(self.gazetteer.lookup(normalize_query("Chicago Terminal")), [-87.71, 41.82])
+        self.assertEqual(self.gazetteer.lookup("75201"), [-96.8, 32.79])
+        self.assertEqual(self.gazetteer.lookup("dallas"), [])
+        self.assertEqual(self.gazetteer.lookup("zzz"), [])
+
+    def test_complete(self):
+        names = [place["name"] for place in self.gazetteer.complete("dallas")]
+        self.assertEqual(names, ["Dallas, TX", "Spotter Dallas Yard"])
+        self.assertEqual(self.gazetteer.complete("dallas", limit=1)[0]["coordinates"], [-96.8, 32.78])
+        # Suggestions rank in file order, not key order.
+        names = [place["name"] for place in self.gazetteer.complete("s", limit=3)]
+        self.assertEqual(names, ["Seattle, WA", "Spokane, WA", "San Francisco, CA"])
+        self.assertEqual(self.gazetteer.complete(""), [])
+        self.assertEqual(self.gazetteer.complete("zzz"), [])
+
+
+MAPBOX_DALLAS = {
+    "features": [
+        {"place_name": "Dallas, Texas, United States", "center": [-96.7969, 32.7763]},
+        {"place_name": "Dallas Center, Iowa, United States", "center": [-93.961, 41.684]},
+    ]
+}
+
+
+class SearchPlacesTests(TestCase):
+    """Gazetteer suggestions, topped up from a mocked Mapbox."""
+
+    def setUp(self):
+        self.enterContext(
+            mock.patch.object(
+                gazetteer, "get_gazetteer", return_value=Gazetteer.load(SAMPLE_GAZETTEER_PATH)
+            )
+        )
+        self.enterContext(mock.patch.object(mapbox_client, "_suggestion_cache", None))
+        session = mock.Mock()
+        session.get.return_value.json.return_value = MAPBOX_DALLAS
+        self.session = session
+        self.enterContext(mock.patch.object(mapbox_client, "_get_session", return_value=session))
+        self.aget_json = self.enterContext(
+            mock.patch.object(mapbox_client, "_aget_json", mock.AsyncMock(return_value=MAPBOX_DALLAS))
+        )
+
+    def test_short_gazetteer_results_are_topped_up_from_mapbox(self):
+        names = [place["name"] for place in mapbox_client.search_places("Dall", "token")]
+        # Mapbox's Dallas, Texas is the gazetteer's Dallas, TX and is not repeated.
+        self.assertEqual(names, ["Dallas, TX", "Spotter Dallas Yard", "Dallas Center, Iowa, United States"])
+        self.assertEqual(self.session.get.call_count, 1)
+
+    def test_full_gazetteer_results_skip_mapbox(self):
+        self.assertEqual(len(mapbox_client.search_places("Dall", "token", limit=2)), 2)
+        self.assertEqual(len(mapbox_client.search_places("Dall", "", limit=5)), 2)
+        self.session.get.assert_not_called()
+
+    async def test_async_path_merges_alike(self):
+        places = await mapbox_client.asearch_places("Dall", "token")
+        self.assertEqual(places, mapbox_client.search_places("Dall", "token"))
+        self.assertEqual(self.aget_json.await_count, 1)
+        self.assertEqual(len(await mapbox_client.asearch_places("Dall", "token", limit=1)), 1)
+        self.assertEqual(self.aget_json.await_count, 1)
+
+
+
+def _mapbox_places(*names) -> dict:
+    return {"features": [{"place_name": name, "center": [-90.0 - i, 35.0]} for i, name in enumerate(names)]}
+
+
+class SuggestionFlightTests(TestCase):
+    """Mapbox suggestion fetches shared by concurrent callers and by longer queries."""
+
+    def setUp(self):
+        self.enterContext(mock.patch.object(gazetteer, "get_gazetteer", return_value=None))
+        self.enterContext(mock.patch.object(mapbox_client, "_suggestion_cache", None))
+
+    def test_threads_share_one_fetch(self):
+        release = threading.Event()
+        session = mock.Mock()
+
+        def get(*args, **kwargs):
+            release.wait(5)
+            return mock.Mock(json=mock.Mock(return_value=_mapbox_places("Dallas, Texas")))
+
+        session.get.side_effect = get
+        flight = SingleFlight()
+        self.enterContext(mock.patch.object(mapbox_client, "_get_session", return_value=session))
+        self.enterContext(mock.patch.object(mapbox_client, "_sync_suggestion_flight", flight))
+
+        with ThreadPoolExecutor(max_workers=4) as pool:
+            futures = [pool.submit(mapbox_client.search_places, "Dallas", "token") for _ in range(4)]
+            deadline = time_module.monotonic() + 5
+            while flight.coalesced < 3 and time_module.monotonic() < deadline:
+                time_module.sleep(0.001)
+            release.set()
+            results = [future.result() for future in futures]
+        self.assertEqual(flight.coalesced, 3)
+        self.assertEqual(session.get.call_count, 1)
+        self.assertEqual(results, [[{"name": "Dallas, Texas", "coordinates": [-90.0, 35.0]}]] * 4)
+
+    def test_thread_flight_shares_errors_and_forgets_the_key(self):
+        flight = SingleFlight()
+        with self.assertRaises(ValueError):
+            flight.do("key", mock.Mock(side_effect=ValueError))
+        self.assertEqual(flight.do("key", lambda: 5), 5)
+        self.assertEqual(flight.coalesced, 0)
+
+    async def test_tasks_share_one_fetch(self):
+        async def fetch(*args):
+            await asyncio.sleep(0.01)
+            return _mapbox_places("Dallas, Texas")
+
+        aget_json = mock.AsyncMock(side_effect=fetch)
+        self.enterContext(mock.patch.object(mapbox_client, "_aget_json", aget_json))
+        self.enterContext(mock.patch.object(mapbox_client, "_suggestion_flight", AsyncSingleFlight()))
+        results = await asyncio.gather(
+            *(mapbox_client.asearch_places("Dallas", "token") for _ in range(4))
+        )
+        self.assertEqual(aget_json.await_count, 1)
+        self.assertEqual(mapbox_client._suggestion_flight.coalesced, 3)
+        self.assertEqual(results, [[{"name": "Dallas, Texas", "coordinates": [-90.0, 35.0]}]] * 4)
+
+    def test_short_prefix_results_are_filtered_for_longer_queries(self):
+        session = mock.Mock()
+        session.get.return_value.json.return_value = _mapbox_places(
+            "Dallas, Texas", "Dalhart, Texas", "Dale City, Virginia"
+        )
+        self.enterContext(mock.patch.object(mapbox_client, "_get_session", return_value=session))
+
+        self.assertEqual(len(mapbox_client.search_places("Dal", "token")), 3)
+        # Three results under the limit of 5 were every match for "dal".
+        names = [place["name"] for place in mapbox_client.search_places("Dall", "token")]
+        self.assertEqual(names, ["Dallas, Texas"])
+        names = [place["name"] for place in mapbox_client.search_places("dal  city", "token")]
+        self.assertEqual(names, ["Dale City, Virginia"])
+        self.assertEqual(session.get.call_count, 1)
+
+    def test_full_prefix_results_are_not_reused(self):
+        session = mock.Mock()
+        session.get.return_value.json.return_value = _mapbox_places("Dallas, Texas", "Dalhart, Texas")
+        self.enterContext(mock.patch.object(mapbox_client, "_get_session", return_value=session))
+
+        mapbox_client.search_places("Dal", "token", limit=2)
+        # Two results at a limit of 2 may have cut off other "dall" matches.
+        mapbox_client.search_places("Dall", "token", limit=2)
+        self.assertEqual(session.get.call_count, 2)
+        # Nor are results cached for another limit.
+        mapbox_client.search_places("Dalla", "token", limit=3)
+        self.assertEqual(session.get.call_count, 3)
+
+
+def _haversine_miles(p0, p1) -> float:
+    lng0, lat0, lng1, lat1 = map(math.radians, (*p0, *p1))
+    a = (
+        math.sin((lat1 - lat0) / 2) ** 2
+        + math.cos(lat0) * math.cos(lat1) * math.sin((lng1 - lng0) / 2) ** 2
+    )
+    return 2 * EARTH_RADIUS_MILES * math.asin(math.sqrt(min(1.0, a)))
+
+
+def _walk_point_along(geometry, progress: float):
+    """
+    The per-stop walk GeometryIndex replaced (planner._point_along_geometry),
+    with great-circle segment lengths as stops have been placed since.
+    """
+    if not geometry:
+        return None
+    if len(geometry) == 1:
+        return geometry[0]
+
+    progress = max(0.0, min(1.0, float(progress)))
+    segment_lengths = [_haversine_miles(geometry[i - 1], geometry[i]) for i in range(1, len(geometry))]
+    total_length = sum(segment_lengths)
+    if total_length <= 0:
+        return geometry[-1]
+
+    target = total_length * progress
+    walked = 0.0
+    for i, seg_len in enumerate(segment_lengths, start=1):
+        next_walked = walked + seg_len
+        if next_walked >= target:
+            if seg_len <= 0:
+                return geometry[i]
+            t = (target - walked) / seg_len
+            x0, y0 = geometry[i - 1]
+            x1, y1 = geometry[i]
+            return [x0 + (x1 - x0) * t, y0 + (y1 - y0) * t]
+        walked = next_walked
+    return geometry[-1]
+
+
+def _random_polyline(rng: random.Random, count: int) -> list:
+    lng, lat = rng.uniform(-120, -75), rng.uniform(28, 47)
+    points = [[lng, lat]]
+    for _ in range(count - 1):
+        if rng.random() < 0.1:
+            points.append(list(points[-1]))  # zero-length segment
+            continue
+        lng += rng.uniform(-0.05, 0.05)
+        lat += rng.uniform(-0.05, 0.05)
+        points.append([lng, lat])
+    return points
+
+
+class GeometryIndexTests(TestCase):
+    def assertSamePoint(self, actual, expected):
+        if expected is None:
+            self.assertIsNone(actual)
+            return
+        self.assertAlmostEqual(actual[0], expected[0], places=9)
+        self.assertAlmostEqual(actual[1], expected[1], places=9)
+
+    def test_matches_per_segment_walk(self):
+        rng = random.Random(10)
+        for _ in range(100):
+            geometry = _random_polyline(rng, rng.choice([2, 3, 10, 500]))
+            index = GeometryIndex(geometry)
+            progresses = [0.0, 1.0, -0.5, 1.5] + [rng.random() for _ in range(20)]
+            for progress, point in zip(progresses, index.points_at(progresses)):
+                expected = _walk_point_along(geometry, progress)
+                self.assertSamePoint(point, expected)
+                self.assertSamePoint(index.point_at(progress), expected)
+                self.assertSamePoint(
+                    index.point_at_distance(min(max(progress, 0.0), 1.0) * index.total_length),
+                    expected,
+                )
+
+    def test_degenerate_polylines(self):
+        for geometry in ([], [[-90.0, 40.0]], [[-90.0, 40.0]] * 4):
+            index = GeometryIndex(geometry)
+            for progress in (0.0, 0.5, 1.0):
+                self.assertEqual(index.points_at([progress]), [_walk_point_along(geometry, progress)])
+
+
+def _segment_distance(p, a, b) -> float:
+    chord_x, chord_y = b[0] - a[0], b[1] - a[1]
+    chord_sq = chord_x * chord_x + chord_y * chord_y
+    t = 0.0
+    if chord_sq > 0:
+        t = min(1.0, max(0.0, ((p[0] - a[0]) * chord_x + (p[1] - a[1]) * chord_y) / chord_sq))
+    return math.hypot(p[0] - a[0] - t * chord_x, p[1] - a[1] - t * chord_y)
+
+
+class SimplifyTests(TestCase):
+    def max_deviation(self, coords, kept) -> float:
+        """Largest distance from an input vertex to its kept segment, in simplify's Mercator units."""
+        stretch = math.cos(math.radians(sum(lat for _, lat in coords) / len(coords)))
+        points = [(lng, lat / stretch) for lng, lat in coords]
+        return max(
+            (
+                _segment_distance(points[i], points[a], points[b])
+                for a, b in zip(kept, kept[1:])
+                for i in range(a + 1, b)
+            ),
+            default=0.0,
+        )
+
+    def test_every_vertex_within_tolerance(self):
+        rng = random.Random(12)
+        for _ in range(200):
+            coords = []
+            lng, lat = rng.uniform(-120, -75), rng.uniform(28, 47)
+            step = rng.choice([1e-4, 1e-3, 1e-2])
+            for _ in range(rng.choice([3, 50, 800])):
+                # Gaussian steps double back often, which a chord's line distance misses.
+                lng += rng.gauss(0, step)
+                lat += rng.gauss(0, step)
+                coords.append([lng, lat])
+            tolerance = tolerance_for_zoom(rng.uniform(2, 16))
+            keep = sorted(rng.sample(range(len(coords)), 2))
+            kept = simplify(coords, tolerance, keep=keep).tolist()
+            with self.subTest(count=len(coords), tolerance=tolerance):
+                self.assertEqual(kept, sorted(set(kept)))
+                self.assertEqual((kept[0], kept[-1]), (0, len(coords) - 1))
+                self.assertTrue(set(keep) <= set(kept))
+                self.assertLessEqual(self.max_deviation(coords, kept), tolerance * (1 + 1e-9))
+
+    def test_drops_collinear_vertices(self):
+        coords = [[-90.0 + i * 0.001, 40.0] for i in range(1000)]
+        self.assertEqual(simplify(coords, 1e-6).tolist(), [0, 999])
+
+
+def _scalar_encode_polyline(coords, precision: int = 5) -> str:
+    """The reference encoded-polyline algorithm, one value at a time."""
+    factor = 10 ** precision
+    chars = []
+    previous = [0, 0]
+    for lng, lat in coords:
+        for axis, coordinate in enumerate((lat, lng)):
+            scaled = coordinate * factor
+            rounded = int(math.copysign(math.floor(abs(scaled) + 0.5), scaled))
+            value = rounded - previous[axis]
+            previous[axis] = rounded
+            value = ~(value << 1) if value < 0 else value << 1
+            while value >= 0x20:
+                chars.append(chr((0x20 | (value & 0x1F)) + 63))
+                value >>= 5
+            chars.append(chr(value + 63))
+    return "".join(chars)
+
+
+class EncodePolylineTests(TestCase):
+    def test_reference_example(self):
+        coords = [[-120.2, 38.5], [-120.95, 40.7], [-126.453, 43.252]]
+        self.assertEqual(encode_polyline(coords), "_p~iF~ps|U_ulLnnqC_mqNvxq`@")
+
+    def test_matches_scalar_encoder(self):
+        rng = random.Random(13)
+        cases = [
+            [],
+            [[0.0, 0.0]],
+            [[-179.99999, -89.99999], [179.99999, 89.99999], [0.0, 0.0]],
+            # Halves round away from zero: 0.5, 2.5, -2.5, 38.5 units.
+            [[0.5e-5, 2.5e-5], [-2.5e-5, -0.5e-5], [38.5e-5, -38.5e-5]],
+            [[0.5e-6, 2.5e-6], [-2.5e-6, -0.5e-6]],
+            # Just either side of a rounding boundary.
+            [[1.4999999e-5, -1.5000001e-5], [-1.4999999e-5, 1.5000001e-5]],
+        ]
+        for _ in range(200):
+            lng, lat = rng.uniform(-180, 180), rng.uniform(-90, 90)
+            points = []
+            for _ in range(rng.randint(1, 60)):
+                lng = max(-180.0, min(180.0, lng + rng.choice([rng.gauss(0, 1e-4), rng.gauss(0, 10)])))
+                lat = max(-90.0, min(90.0, lat + rng.choice([rng.gauss(0, 1e-4), rng.gauss(0, 10)])))
+                points.append([lng, lat])
+            cases.append(points)
+        for coords in cases:
+            for precision in (5, 6):
+                with self.subTest(coords=coords[:3], precision=precision):
+                    self.assertEqual(
+                        encode_polyline(coords, precision).encode("ascii"),
+                        _scalar_encode_polyline(coords, precision).encode("ascii"),
+                    )
+
+
+class EncodePlanTests(TestCase):
+    """encode_plan, with and without orjson, against json.dumps(plan_trip(...))."""
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.route = LocalGraphBackend(RoadGraph.load(SAMPLE_GRAPH_PATH)).route([CHICAGO, DALLAS, DENVER])
+
+    def assertSameBody(self, trip, route, geometry_options=None):
+        expected = json.dumps(planner.plan_trip(trip, route, geometry_options), separators=(",", ":"))
+        with mock.patch.object(encoders, "orjson", None):
+            # The stdlib path writes the same bytes, not just the same document.
+            self.assertEqual(planner.plan_trip_json(trip, route, geometry_options), expected.encode())
+            body, _ = planner.plan_trip_record(trip, route, geometry_options, "p1")
+            self.assertEqual(json.loads(body), {"plan_id": "p1", **json.loads(expected)})
+        if encoders.orjson is not None:
+            body = planner.plan_trip_json(trip, route, geometry_options)
+            self.assertEqual(json.loads(body), json.loads(expected))
+
+    def test_short_and_thirty_day_plans(self):
+        chicago = ZoneInfo("America/Chicago")
+        for trip, route in (
+            (_trip(10), self.route),
+            (_trip(69.5, datetime(2024, 3, 8, 20, 0, tzinfo=chicago)), self.route),
+            (_trip(35, datetime(2024, 10, 20, 8, 0, tzinfo=chicago)), _route([9000.0, 9000.0])),
+        ):
+            with self.subTest(start=trip.start_time, miles=route.distance_miles):
+                self.assertSameBody(trip, route)
+        self.assertSameBody(_trip(10), self.route, GeometryOptions("polyline", zoom=6, leg_geometry=False))
+
+    def test_plan_id_and_stream_lines(self):
+        logs = build_log_sheets(build_timeline(_trip(10), self.route), _trip(10))
+        for orjson in {encoders.orjson, None}:
+            with self.subTest(orjson=orjson), mock.patch.object(encoders, "orjson", orjson):
+                body = encoders.encode_plan({"distance_miles": 1.5}, [], logs)
+                self.assertEqual(
+                    encoders.with_plan_id(body, "p1"),
+                    encoders.encode_plan({"distance_miles": 1.5}, [], logs, "p1"),
+                )
+                line = encoders.encode_plan_line("log_sheet", logs[0])
+                self.assertTrue(line.endswith(b"\n"))
+                self.assertEqual(json.loads(line), {"log_sheet": daily_log_to_dict(logs[0])})
+
+
+def _legacy_build_log_sheets(timeline, request: TripRequest) -> list[DailyLog]:
+    """build_log_sheets as it was before LogSheetBuilder: bucket by date, then sort and total."""
+    by_day = defaultdict(list)
+    for status, start, end, remaining_min, description, *_ in timeline_rows(timeline):
+        tz = start.tzinfo
+        current_start = start
+        while remaining_min > 0 and current_start < end:
+            day_start = datetime.combine(current_start.date(), time(0, 0), tzinfo=tz)
+            segment_end = min(end, day_start + timedelta(days=1))
+            chunk_min = (segment_end - current_start).total_seconds() / 60
+            if chunk_min <= 0:
+                break
+            by_day[current_start.date()].append(
+                LogGridSegment(status, current_start, segment_end, chunk_min, description)
+            )
+            remaining_min -= chunk_min
+            current_start = segment_end
+
+    logs = []
+    for i, log_date in enumerate(sorted(by_day)):
+        segments = sorted(by_day[log_date], key=lambda s: s.start_time)
+        hours = defaultdict(float)
+        for segment in segments:
+            hours[segment.status] += segment.duration_minutes / 60
+        driving = hours[DutyStatus.DRIVING]
+        logs.append(
+            DailyLog(
+                log_date=log_date,
+                from_place=request.current_location if i == 0 else request.pickup_location,
+                to_place=request.pickup_location if i == 0 else request.dropoff_location,
+                segments=segments,
+                total_driving_hours=round(driving, 2),
+                total_on_duty_hours=round(driving + hours[DutyStatus.ON_DUTY_NOT_DRIVING], 2),
+                total_off_duty_hours=round(hours[DutyStatus.OFF_DUTY], 2),
+                total_sleeper_hours=round(hours[DutyStatus.SLEEPER_BERTH], 2),
+            )
+        )
+    return logs
+
+
+def _log_fields(logs: list[DailyLog]) -> list[tuple]:
+    """Logs as plain tuples; times as ISO strings so their offsets are compared too."""
+    return [
+        (
+            log.log_date,
+            log.from_place,
+            log.to_place,
+            log.total_driving_hours,
+            log.total_on_duty_hours,
+            log.total_off_duty_hours,
+            log.total_sleeper_hours,
+            [
+                (
+                    seg.status,
+                    seg.start_time.isoformat(),
+                    seg.end_time.isoformat(),
+                    seg.duration_minutes,
+                    seg.description,
+                )
+                for seg in log.segments
+            ],
+        )
+        for log in logs
+    ]
+
+
+class LogSheetTests(TestCase):
+    """LogSheetBuilder (via build_log_sheets) against the generator it replaced."""
+
+    def assertSameLogs(self, timeline, trip):
+        self.assertEqual(
+            _log_fields(build_log_sheets(timeline, trip)),
+            _log_fields(_legacy_build_log_sheets(timeline, trip)),
+        )
+
+    def test_engine_timelines_across_dst(self):
+        chicago = ZoneInfo("America/Chicago")
+        rng = random.Random(15)
+        # Days before the spring-forward and fall-back changes of 2024.
+        starts = [datetime(2024, 3, 8), datetime(2024, 11, 1), datetime(2024, 12, 30)]
+        for _ in range(60):
+            start = rng.choice(starts) + timedelta(minutes=rng.randrange(0, 3 * 24 * 60, 15))
+            for zone in (chicago, timezone(timedelta(hours=-5)), timezone.utc, None):
+                trip = _trip(round(rng.uniform(0, 70), 1), start.replace(tzinfo=zone))
+                route = _route([rng.uniform(0, 2500), rng.uniform(0, 2500)])
+                with self.subTest(start=trip.start_time, legs=route.distance_miles):
+                    self.assertSameLogs(build_timeline(trip, route), trip)
+
+    def test_rows_spanning_midnights_and_dst_changes(self):
+        chicago = ZoneInfo("America/Chicago")
+        for zone in (chicago, timezone.utc, None):
+            start = datetime(2024, 3, 9, 22, 0, tzinfo=zone)
+            rows = []
+            for status, minutes in (
+                (DutyStatus.ON_DUTY_NOT_DRIVING, 90),  # crosses midnight into the DST day
+                (DutyStatus.DRIVING, 0),  # zero-length
+                (DutyStatus.OFF_DUTY, 50 * 60),  # spans two midnights and the change
+                (DutyStatus.DRIVING, 11 * 60),
+                (DutyStatus.SLEEPER_BERTH, 10 * 60),
+                (DutyStatus.DRIVING, 120),  # ends exactly at a midnight
+            ):
+                end = start + timedelta(minutes=minutes)
+                rows.append(TimelineSegment(status, start, end, minutes, status.value))
+                start = end
+            with self.subTest(zone=zone):
+                self.assertSameLogs(rows, _trip(0, rows[0].start_time))
+
+    def test_ninety_day_timeline(self):
+        trip = _trip(35, datetime(2024, 10, 20, 8, 0, tzinfo=ZoneInfo("America/Chicago")))
+        timeline = build_timeline(trip, _route([27000.0, 27000.0]))
+        logs = build_log_sheets(timeline, trip)
+        self.assertGreaterEqual(len(logs), 90)
+        self.assertSameLogs(timeline, trip)
+
+
+
+class HomeZoneLogSheetTests(TestCase):
+    """Log sheet days in the home terminal zone, whatever zone the timeline runs in."""
+
+    def logs(self, start: datetime, home: str | None = "America/Chicago"):
+        trip = _trip(0, start, home_terminal_timezone=home)
+        return build_log_sheets(build_timeline(trip, _route([2500.0, 2500.0])), trip)
+
+    def assertWholeDays(self, logs, zone):
+        segments = [segment for log in logs for segment in log.segments]
+        for earlier, later in zip(segments, segments[1:]):
+            self.assertEqual(later.start_time, earlier.end_time)
+        for log in logs:
+            midnight = datetime.combine(log.log_date, time(0, 0), tzinfo=zone)
+            next_midnight = datetime.combine(log.log_date + timedelta(days=1), time(0, 0), tzinfo=zone)
+            with self.subTest(log_date=log.log_date):
+                for segment in log.segments:
+                    self.assertIs(segment.start_time.tzinfo, zone)
+                    self.assertGreaterEqual(segment.start_time, midnight)
+                    self.assertLessEqual(segment.end_time, next_midnight)
+                if log is not logs[0] and log is not logs[-1]:
+                    self.assertEqual(log.segments[0].start_time, midnight)
+                    self.assertEqual(log.segments[-1].end_time, next_midnight)
+
+    def test_days_split_at_home_midnights(self):
+        los_angeles = ZoneInfo("America/Los_Angeles")
+        logs = self.logs(datetime(2024, 6, 3, 6, 30, tzinfo=timezone.utc), "America/Los_Angeles")
+        # 06:30 UTC is still the evening before in Los Angeles.
+        self.assertEqual(logs[0].log_date, date(2024, 6, 2))
+        self.assertEqual(logs[0].segments[0].start_time, datetime(2024, 6, 2, 23, 30, tzinfo=los_angeles))
+        self.assertWholeDays(logs, los_angeles)
+
+    def test_dst_days_are_23_and_25_hours(self):
+        chicago = ZoneInfo("America/Chicago")
+        for start, change, hours in (
+            (datetime(2024, 3, 8, 6, 30, tzinfo=timezone.utc), date(2024, 3, 10), 23),
+            (datetime(2024, 11, 1, 6, 30, tzinfo=timezone.utc), date(2024, 11, 3), 25),
+        ):
+            with self.subTest(change=change):
+                logs = self.logs(start)
+                self.assertWholeDays(logs, chicago)
+                log = next(log for log in logs if log.log_date == change)
+                total = log.total_on_duty_hours + log.total_off_duty_hours + log.total_sleeper_hours
+                self.assertAlmostEqual(total, hours, places=1)
+
+    def test_home_zone_argument_overrides_the_request(self):
+        start = datetime(2024, 3, 8, 6, 30, tzinfo=timezone.utc)
+        trip = _trip(0, start, home_terminal_timezone="America/Chicago")
+        timeline = build_timeline(trip, _route([2500.0, 2500.0]))
+        new_york = ZoneInfo("America/New_York")
+        self.assertEqual(
+            build_log_sheets(timeline, trip, new_york),
+            build_log_sheets(timeline, replace(trip, home_terminal_timezone="America/New_York")),
+        )
+        self.assertWholeDays(build_log_sheets(timeline, trip, new_york), new_york)
+
+    def test_naive_timeline_keeps_its_own_dates(self):
+        start = datetime(2024, 3, 8, 6, 30)
+        self.assertEqual(self.logs(start), self.logs(start, home=None))
+
+def _plan_payload(**kwargs) -> dict:
+    """A Chicago - Dallas - Denver plan request with coords, so nothing is geocoded."""
+    return {
+        "current_location": "Chicago, IL",
+        "current_location_coords": CHICAGO,
+        "pickup_location": "Dallas, TX",
+        "pickup_location_coords": DALLAS,
+        "dropoff_location": "Denver, CO",
+        "dropoff_location_coords": DENVER,
+        "current_cycle_used_hrs": 10,
+        "start_time": "2024-03-04T06:30:00+00:00",
+        **kwargs,
+    }
+
+
+@override_settings(
+    ROUTING_BACKEND="local", MAPBOX_ACCESS_TOKEN="", POI_PATH="", PLAN_PROCESS_POOL_WORKERS=1
+)
+class ViewTestCase(TestCase):
+    """Views over the bundled road graph, so no Mapbox token or network is needed."""
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        backend = LocalGraphBackend(RoadGraph.load(SAMPLE_GRAPH_PATH), max_snap_miles=25)
+        cls.enterClassContext(mock.patch.object(routing, "_backend", backend))
+
+    @classmethod
+    def tearDownClass(cls):
+        if planner._process_pool is not None:
+            planner.discard_process_pool(planner._process_pool)
+        super().tearDownClass()
+
+    def setUp(self):
+        self.client = AsyncClient()
+        caches["plans"].clear()
+
+    async def post_json(self, path: str, body, **headers):
+        return await self.client.post(
+            path, json.dumps(body), content_type="application/json", headers=headers
+        )
+
+    async def stream_lines(self, response) -> list[dict]:
+        content = b"".join([chunk async for chunk in response.streaming_content])
+        return [json.loads(line) for line in content.splitlines()]
+
+
+class PlanTripViewTests(ViewTestCase):
+    async def test_json_plan(self):
+        response = await self.post_json("/api/plan/", _plan_payload())
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response["Content-Type"], "application/json")
+        body = json.loads(response.content)
+        self.assertEqual(sorted(body), ["log_sheets", "plan_id", "route", "stops_and_rests"])
+
+        trip = TripRequest(**_plan_payload())
+        route = routing.get_backend().route([CHICAGO, DALLAS, DENVER])
+        del body["plan_id"]
+        self.assertEqual(body, json.loads(planner.plan_trip_json(trip, route)))
+
+    async def test_ndjson_plan(self):
+        expected = json.loads((await self.post_json("/api/plan/", _plan_payload())).content)
+        for path, headers in (
+            ("/api/plan/?stream=1", {}),
+            ("/api/plan/", {"Accept": "application/x-ndjson"}),
+        ):
+            with self.subTest(path=path, headers=headers):
+                response = await self.post_json(path, _plan_payload(), **headers)
+                self.assertEqual(response.status_code, 200)
+                self.assertTrue(response.streaming)
+                self.assertEqual(response["Content-Type"], "application/x-ndjson")
+                lines = await self.stream_lines(response)
+                self.assertEqual(lines[0], {"route": expected["route"]})
+                self.assertEqual(
+                    lines[-1],
+                    {
+                        "done": {
+                            "stops_and_rests": len(expected["stops_and_rests"]),
+                            "log_sheets": len(expected["log_sheets"]),
+                        }
+                    },
+                )
+
+    async def test_home_terminal_timezone(self):
+        response = await self.post_json(
+            "/api/plan/", _plan_payload(home_terminal_timezone="America/Los_Angeles")
+        )
+        self.assertEqual(response.status_code, 200)
+        log_sheets = json.loads(response.content)["log_sheets"]
+        # 2024-03-04T06:30Z is 22:30 the day before in Los Angeles.
+        self.assertEqual(log_sheets[0]["log_date"], "2024-03-03")
+        self.assertEqual(log_sheets[0]["segments"][0]["start_time"], "2024-03-03T22:30:00-08:00")
+
+        response = await self.post_json("/api/plan/", _plan_payload(home_terminal_timezone="Mars/Olympus"))
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(
+            json.loads(response.content),
+            {"error": "home_terminal_timezone must be an IANA time zone name"},
+        )
+
+    async def test_bad_requests(self):
+        response = await self.client.post("/api/plan/", "{", content_type="application/json")
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(json.loads(response.content), {"error": "Invalid JSON"})
+        for payload, error in (
+            ([], "Request body must be a JSON object"),
+            (
+                _plan_payload(pickup_location=""),
+                "current_location, pickup_location, and dropoff_location are required",
+            ),
+            (_plan_payload(current_cycle_used_hrs=71), "current_cycle_used_hrs must be between 0 and 70"),
+            (_plan_payload(start_time="monday"), "start_time must be an ISO datetime string"),
+        ):
+            with self.subTest(error=error):
+                response = await self.post_json("/api/plan/", payload)
+                self.assertEqual(response.status_code, 400)
+                self.assertEqual(json.loads(response.content), {"error": error})
+        response = await self.post_json("/api/plan/?geometry=wkt", _plan_payload())
+        self.assertEqual(response.status_code, 400)
+
+    async def test_wrong_methods_get_405(self):
+        for path in ("/api/plan/", "/api/plan/replan/", "/api/plan/scenarios/", "/api/plan/batch/"):
+            with self.subTest(path=path):
+                response = await self.client.get(path)
+                self.assertEqual(response.status_code, 405)
+                self.assertEqual(response["Allow"], "POST, OPTIONS")
+        response = await self.post_json("/api/places/", {})
+        self.assertEqual(response.status_code, 405)
+
+    async def test_unroutable_trip(self):
+        # No coords, no gazetteer entry and no Mapbox token: nothing can be geocoded.
+        payload = _plan_payload(current_location="Nowhere", current_location_coords=None)
+        with mock.patch.object(gazetteer, "get_gazetteer", return_value=None):
+            response = await self.post_json("/api/plan/", payload)
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(
+            json.loads(response.content),
+            {"error": "Could not find route. Check addresses and try again."},
+        )
+
+
+
+class PlanStreamTests(ViewTestCase):
+    """iter_plan_ndjson against the JSON body, and the view's streaming wrapper."""
+
+    def trips(self):
+        trip = TripRequest(**_plan_payload(current_cycle_used_hrs=60))
+        yield trip
+        yield replace(trip, home_terminal_timezone="America/Los_Angeles")
+        yield replace(
+            trip,
+            stops=[
+                TripStop("Dallas, TX", DALLAS, "pickup", 45),
+                TripStop("Denver, CO", DENVER, "dropoff", 90),
+            ],
+        )
+
+    def test_lines_reassemble_the_json_body(self):
+        route = routing.get_backend().route([CHICAGO, DALLAS, DENVER])
+        for trip in self.trips():
+            with self.subTest(home_zone=trip.home_terminal_timezone, stops=bool(trip.stops)):
+                expected = json.loads(planner.plan_trip_json(trip, route))
+                lines = [json.loads(line) for line in planner.iter_plan_ndjson(trip, route)]
+                self.assertEqual(lines[0], {"route": expected["route"]})
+                stops = [line["stop"] for line in lines if "stop" in line]
+                log_sheets = [line["log_sheet"] for line in lines if "log_sheet" in line]
+                self.assertEqual(stops, expected["stops_and_rests"])
+                self.assertEqual(log_sheets, expected["log_sheets"])
+                self.assertGreater(len(expected["log_sheets"]), 2)
+                self.assertEqual(
+                    lines[-1],
+                    {
+                        "done": {
+                            "stops_and_rests": len(expected["stops_and_rests"]),
+                            "log_sheets": len(expected["log_sheets"]),
+                        }
+                    },
+                )
+
+    def test_each_day_follows_the_stops_before_its_end(self):
+        route = routing.get_backend().route([CHICAGO, DALLAS, DENVER])
+        lines = [json.loads(line) for line in planner.iter_plan_ndjson(next(self.trips()), route)]
+        for position, line in enumerate(lines):
+            if "log_sheet" not in line:
+                continue
+            day_end = datetime.fromisoformat(line["log_sheet"]["segments"][-1]["end_time"])
+            for later in lines[position + 1 :]:
+                if "stop" in later:
+                    self.assertGreaterEqual(datetime.fromisoformat(later["stop"]["start_time"]), day_end)
+
+    async def test_failure_mid_stream_is_the_last_line(self):
+        def failing(trip_request, route, geometry_options=None):
+            yield encoders.encode_plan_line("route", {})
+            raise error
+
+        self.enterContext(mock.patch.object(views, "iter_plan_ndjson", failing))
+        for error, message in ((ValueError("route is gone"), "route is gone"), (KeyError(), "KeyError")):
+            with self.subTest(message=message):
+                response = await self.post_json("/api/plan/?stream=1", _plan_payload())
+                self.assertEqual(response.status_code, 200)
+                self.assertEqual(await self.stream_lines(response), [{"route": {}}, {"error": message}])
+
+class BatchPlanViewTests(ViewTestCase):
+    async def test_malformed_items_get_their_own_error_lines(self):
+        trips = [
+            _plan_payload(),
+            5,
+            _plan_payload(current_location=5),
+            _plan_payload(pickup_location=["Dallas"]),
+            _plan_payload(home_terminal_timezone={}),
+            _plan_payload(current_location_coords="Chicago"),
+            _plan_payload(current_cycle_used_hrs=40),
+        ]
+        response = await self.post_json("/api/plan/batch/", {"trips": trips})
+        self.assertEqual(response.status_code, 200)
+
+        lines = {line["index"]: line for line in await self.stream_lines(response)}
+        self.assertEqual(sorted(lines), list(range(len(trips))))
+        self.assertEqual(lines[1]["error"], "Request body must be a JSON object")
+        self.assertEqual(lines[2]["error"], "current_location must be a string")
+        self.assertEqual(lines[3]["error"], "pickup_location must be a string")
+        self.assertEqual(lines[4]["error"], "home_terminal_timezone must be a string")
+        self.assertEqual(lines[5]["error"], "location coordinates must be [lng, lat]")
+        for index in (0, 6):
+            self.assertNotIn("error", lines[index])
+            self.assertGreater(lines[index]["result"]["route"]["distance_miles"], 0)
+
+
+
+class ScenarioTests(TestCase):
+    """The what-if sweep against planning each scenario on its own."""
+
+    def setUp(self):
+        self.trip = _trip(10, datetime(2024, 3, 8, 6, 0, tzinfo=ZoneInfo("America/Chicago")))
+        self.route = _route([900.0, 1400.0])
+        self.start_times = [self.trip.start_time + timedelta(hours=h) for h in (0, 7, 50)]
+
+    def assertSameSummaries(self, requests):
+        states, state_index = scenarios.distinct_states(requests)
+        summaries = scenarios.simulate_states(states, timeline_engine.request_legs(self.trip, self.route))
+        for request, index in zip(requests, state_index):
+            with self.subTest(start=request.start_time, cycle=request.current_cycle_used_hrs):
+                expected = scenarios.summarize_timeline(build_timeline(request, self.route))
+                self.assertEqual(summaries[index], expected)
+        return states
+
+    def test_grid_puts_start_times_outermost(self):
+        grid = scenarios.scenario_grid(self.trip, self.start_times, [0.0, 69.0])
+        self.assertEqual(
+            [(request.start_time, request.current_cycle_used_hrs) for request in grid],
+            [(start, cycle) for start in self.start_times for cycle in (0.0, 69.0)],
+        )
+        self.assertEqual({request.pickup_location for request in grid}, {"B"})
+
+    def test_start_times_share_a_state_per_cycle_value(self):
+        grid = scenarios.scenario_grid(self.trip, self.start_times, [0.0, 35.5, 69.0])
+        states = self.assertSameSummaries(grid)
+        self.assertEqual(len(states), 3)
+
+    def test_cycle_history_gives_each_start_time_its_own_state(self):
+        # Cycle days follow local midnights, and 2024-03-10 is 23 hours long in Chicago.
+        trip = replace(self.trip, cycle_history_hrs=[8, 9, 10, 11, 0, 6, 7])
+        grid = scenarios.scenario_grid(trip, self.start_times, [0.0, 69.0])
+        states = self.assertSameSummaries(grid)
+        self.assertEqual(len(states), len(self.start_times))
+
+    def test_earliest_arrival_prefers_the_shorter_trip_on_ties(self):
+        requests = scenarios.scenario_grid(self.trip, self.start_times[:1], [0.0, 5.0])
+        summary = scenarios.ScenarioSummary(3_600_000_000, 0, 0, 60.0, 60.0)
+        shorter = replace(summary, duration_us=summary.duration_us - 60_000_000)
+        later_start = replace(requests[1], start_time=requests[1].start_time + timedelta(minutes=1))
+        body = scenarios.scenarios_to_dict([requests[0], later_start], [0, 1], [summary, shorter])
+        self.assertEqual(body["scenarios"][0]["arrival_time"], body["scenarios"][1]["arrival_time"])
+        self.assertEqual(body["earliest_arrival_index"], 1)
+        self.assertIsNone(scenarios.scenarios_to_dict([], [], [])["earliest_arrival_index"])
+
+
+class ScenarioPlanViewTests(ViewTestCase):
+    async def test_sweep_matches_single_plans_and_splits_states_across_workers(self):
+        chunks = []
+
+        async def run_inline(workers, fn, *args):
+            chunks.append(len(args[0]))
+            return fn(*args)
+
+        self.enterContext(mock.patch.object(views, "run_in_process_pool", run_inline))
+        start_times = ["2024-03-04T06:30:00+00:00", "2024-03-05T18:00:00+00:00"]
+        with override_settings(PLAN_PROCESS_POOL_WORKERS=2):
+            response = await self.post_json(
+                "/api/plan/scenarios/",
+                _plan_payload(start_times=start_times, cycle_used_hrs=[0, 10, 69]),
+            )
+        self.assertEqual(response.status_code, 200)
+        body = json.loads(response.content)
+        # Three distinct states (one per cycle value) over two workers.
+        self.assertEqual(chunks, [2, 1])
+        self.assertEqual(len(body["scenarios"]), 6)
+        self.assertGreater(body["route"]["distance_miles"], 0)
+
+        plan = json.loads((await self.post_json("/api/plan/", _plan_payload())).content)
+        scenario = body["scenarios"][1]
+        self.assertEqual((scenario["start_time"], scenario["current_cycle_used_hrs"]), (start_times[0], 10.0))
+        self.assertEqual(scenario["arrival_time"], plan["log_sheets"][-1]["segments"][-1]["end_time"])
+        arrivals = [datetime.fromisoformat(item["arrival_time"]) for item in body["scenarios"]]
+        self.assertEqual(arrivals[body["earliest_arrival_index"]], min(arrivals))
+
+    async def test_bad_axes(self):
+        for payload, error in (
+            (_plan_payload(start_times=[]), "start_times must be a non-empty list"),
+            (_plan_payload(start_times=["soon"]), "start_times entries must be an ISO datetime string"),
+            (_plan_payload(cycle_used_hrs="10"), "cycle_used_hrs must be a non-empty list"),
+            (_plan_payload(cycle_used_hrs=["ten"]), "cycle_used_hrs must contain numbers"),
+            (_plan_payload(cycle_used_hrs=[10, 71]), "cycle_used_hrs entries must be between 0 and 70"),
+        ):
+            with self.subTest(error=error):
+                response = await self.post_json("/api/plan/scenarios/", payload)
+                self.assertEqual(response.status_code, 400)
+                self.assertEqual(json.loads(response.content), {"error": error})
+
+    @override_settings(PLAN_SCENARIO_MAX_ITEMS=5)
+    async def test_grid_size_is_capped(self):
+        payload = _plan_payload(
+            start_times=["2024-03-04T06:30:00+00:00", "2024-03-05T06:30:00+00:00"],
+            cycle_used_hrs=[0, 10, 20],
+        )
+        response = await self.post_json("/api/plan/scenarios/", payload)
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(
+            json.loads(response.content),
+            {"error": "start_times x cycle_used_hrs may contain at most 5 scenarios"},
+        )
+
+
+class MultiStopViewTests(ViewTestCase):
+    async def test_service_stops_sit_at_their_waypoints(self):
+        stops = [
+            {"location": "Dallas, TX", "coords": DALLAS, "kind": "pickup", "dwell_minutes": 45},
+            {"location": "Denver, CO", "coords": DENVER},
+            {"location": "Chicago, IL", "coords": CHICAGO, "kind": "dropoff", "dwell_minutes": 120},
+        ]
+        response = await self.post_json("/api/plan/", _plan_payload(stops=stops))
+        self.assertEqual(response.status_code, 200)
+        body = json.loads(response.content)
+        waypoints = body["route"]["waypoints"]
+        self.assertEqual(len(waypoints), 4)
+        self.assertEqual(len(body["route"]["legs"]), 3)
+        service = [
+            item
+            for item in body["stops_and_rests"]
+            if item["description"] in ("Pickup (45 min)", "Stop (1 hr)", "Dropoff (2 hr)")
+        ]
+        self.assertEqual(
+            [(item["description"], item["duration_minutes"], item["coordinates"]) for item in service],
+            [
+                ("Pickup (45 min)", 45, waypoints[1]),
+                ("Stop (1 hr)", 60, waypoints[2]),
+                ("Dropoff (2 hr)", 120, waypoints[3]),
+            ],
+        )
+        self.assertEqual(body["log_sheets"][0]["from_place"], "Chicago, IL")
+        self.assertEqual(body["log_sheets"][-1]["to_place"], "Chicago, IL")
+
+    async def test_bad_stops(self):
+        for stops, error in (
+            ([], "stops must be a list of 1 to 100 stops"),
+            ({"location": "Dallas, TX"}, "stops must be a list of 1 to 100 stops"),
+            (["Dallas, TX"], "each stop must be an object"),
+            ([{"location": " "}], "each stop needs a location"),
+            (
+                [{"location": "Dallas, TX", "kind": "fuel"}],
+                "stop kind must be one of pickup, dropoff, stop",
+            ),
+            ([{"location": "Dallas, TX", "dwell_minutes": "long"}], "stop dwell_minutes must be a number"),
+            (
+                [{"location": "Dallas, TX", "dwell_minutes": 0}],
+                "stop dwell_minutes must be more than 0 and at most 1440",
+            ),
+        ):
+            with self.subTest(error=error, stops=stops):
+                response = await self.post_json("/api/plan/", _plan_payload(stops=stops))
+                self.assertEqual(response.status_code, 400)
+                self.assertEqual(json.loads(response.content), {"error": error})
+
+class PlanCacheTests(TestCase):
+    def test_plan_key_canonicalises_the_request(self):
+        trip = _trip(10, current_location_coords=[-87.62980, 41.87811])
+        key = plan_cache.plan_key(trip)
+        for variant in (
+            replace(trip, current_location="  a ", current_location_coords=[-87.629801, 41.878114]),
+            replace(trip, pickup_location="b"),
+            replace(trip, start_time=trip.start_time + timedelta(minutes=1)),
+        ):
+            with self.subTest(variant=variant):
+                self.assertEqual(plan_cache.plan_key(variant), key)
+        for variant in (
+            replace(trip, current_cycle_used_hrs=11),
+            replace(trip, current_location_coords=[-87.6, 41.87811]),
+            replace(trip, dropoff_location="D"),
+            replace(trip, home_terminal_timezone="America/Chicago"),
+            replace(trip, cycle_history_hrs=[1, 2, 3, 4, 5, 6, 7]),
+        ):
+            with self.subTest(variant=variant):
+                self.assertNotEqual(plan_cache.plan_key(variant), key)
+        self.assertNotEqual(plan_cache.plan_key(trip, GeometryOptions(zoom=6)), key)
+
+    @override_settings(PLAN_CACHE_START_BUCKET_MINUTES=15)
+    def test_start_times_share_a_key_within_a_bucket(self):
+        start = datetime(2024, 3, 4, 6, 30, tzinfo=timezone.utc)
+        key = plan_cache.plan_key(_trip(10, start))
+        self.assertEqual(plan_cache.plan_key(_trip(10, start + timedelta(minutes=14, seconds=59))), key)
+        self.assertNotEqual(plan_cache.plan_key(_trip(10, start + timedelta(minutes=15))), key)
+        self.assertNotEqual(plan_cache.plan_key(_trip(10, start - timedelta(seconds=1))), key)
+        # Same instant, other offset: log sheet days differ.
+        eastern = start.astimezone(ZoneInfo("America/New_York"))
+        self.assertNotEqual(plan_cache.plan_key(_trip(10, eastern)), key)
+
+    def test_etag_is_weak_and_compared_weakly(self):
+        etag = plan_cache.etag_for(b'{"route": {}}')
+        self.assertRegex(etag, r'^W/"[0-9a-f]{32}"$')
+        self.assertNotEqual(plan_cache.etag_for(b'{"route": []}'), etag)
+        strong = etag.removeprefix("W/")
+        for header in (etag, strong, "*", f'"other", {etag}', f' "other" ,{strong}'):
+            with self.subTest(header=header):
+                self.assertTrue(plan_cache.etag_matches(header, etag))
+        for header in (None, "", '"other"', 'W/"other"'):
+            with self.subTest(header=header):
+                self.assertFalse(plan_cache.etag_matches(header, etag))
+
+
+@override_settings(PLAN_CACHE_TTL_SECONDS=300)
+class PlanCacheViewTests(ViewTestCase):
+    async def test_repeat_shares_the_stored_plan(self):
+        with mock.patch.object(plan_store, "asave_plan", wraps=plan_store.asave_plan) as save:
+            first = await self.post_json("/api/plan/", _plan_payload())
+            second = await self.post_json(
+                "/api/plan/", _plan_payload(start_time="2024-03-04T06:40:00+00:00")
+            )
+        self.assertEqual(first.status_code, 200)
+        self.assertEqual(second.status_code, 200)
+        self.assertEqual(save.await_count, 1)
+        self.assertEqual(second.content, first.content)
+        self.assertEqual(second["ETag"], first["ETag"])
+        plan_id = json.loads(first.content)["plan_id"]
+        self.assertIsNotNone(await plan_store.aload_plan(plan_id))
+
+    async def test_if_none_match_gets_304(self):
+        first = await self.post_json("/api/plan/", _plan_payload())
+        etag = first["ETag"]
+        self.assertTrue(etag.startswith('W/"'))
+        for header in (etag, etag.removeprefix("W/"), "*"):
+            with self.subTest(header=header):
+                response = await self.post_json("/api/plan/", _plan_payload(), **{"If-None-Match": header})
+                self.assertEqual(response.status_code, 304)
+                self.assertEqual(response["ETag"], etag)
+                self.assertEqual(response.content, b"")
+        response = await self.post_json("/api/plan/", _plan_payload(), **{"If-None-Match": '"other"'})
+        self.assertEqual(response.status_code, 200)
+
+    @override_settings(PLAN_CACHE_TTL_SECONDS=0)
+    async def test_disabled_cache_stores_each_plan(self):
+        first = await self.post_json("/api/plan/", _plan_payload())
+        second = await self.post_json("/api/plan/", _plan_payload())
+        self.assertNotEqual(json.loads(first.content)["plan_id"], json.loads(second.content)["plan_id"])
+        self.assertEqual(second["ETag"], first["ETag"])
+
+
+def _decode_polyline(text: str, precision: int = 5) -> list:
+    coords, values, value, shift = [], [], 0, 0
+    for char in text:
+        byte = ord(char) - 63
+        value |= (byte & 0x1F) << shift
+        shift += 5
+        if byte < 0x20:
+            values.append(~(value >> 1) if value & 1 else value >> 1)
+            value, shift = 0, 0
+    lat = lng = 0
+    for dlat, dlng in zip(values[::2], values[1::2]):
+        lat += dlat
+        lng += dlng
+        coords.append([lng / 10**precision, lat / 10**precision])
+    return coords
+
+
+class GeometryOptionsTests(ViewTestCase):
+    """route_to_dict and /api/plan/ under ?geometry=, ?zoom= and ?leg_geometry=0."""
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.route = routing.get_backend().route([CHICAGO, DALLAS, DENVER])
+
+    def assertCloseCoords(self, actual, expected, places):
+        self.assertEqual(len(actual), len(expected))
+        for a, b in zip(actual, expected):
+            self.assertAlmostEqual(a[0], b[0], places=places)
+            self.assertAlmostEqual(a[1], b[1], places=places)
+
+    def test_default_options_keep_geojson(self):
+        self.assertEqual(route_to_dict(self.route, GeometryOptions()), route_to_dict(self.route))
+        self.assertNotIn("geometry_format", route_to_dict(self.route))
+
+    def test_polyline_formats(self):
+        for name, precision in (("polyline", 5), ("polyline6", 6)):
+            with self.subTest(format=name):
+                body = route_to_dict(self.route, GeometryOptions(name))
+                self.assertEqual(body["geometry_format"], name)
+                self.assertCloseCoords(
+                    _decode_polyline(body["geometry"], precision), self.route.geometry, precision
+                )
+                for leg, item in zip(self.route.legs, body["legs"]):
+                    self.assertCloseCoords(
+                        _decode_polyline(item["geometry"], precision), leg.geometry, precision
+                    )
+
+    def test_zoom_keeps_a_subset_with_leg_ends(self):
+        geometry = _random_polyline(random.Random(12), 3000)
+        legs = [RouteLeg(500, 9, geometry[:1201]), RouteLeg(700, 13, geometry[1200:])]
+        route = Route(geometry, 1200, 22, legs, [geometry[0], geometry[1200], geometry[-1]])
+
+        body = route_to_dict(route, GeometryOptions(zoom=3, leg_geometry=False))
+        kept = body["geometry"]
+        self.assertLess(len(kept), len(geometry) // 2)
+        vertices = {tuple(point) for point in geometry}
+        self.assertTrue(all(tuple(point) in vertices for point in kept))
+        self.assertEqual(kept[0], geometry[0])
+
+        ends = [item["geometry_end_index"] for item in body["legs"]]
+        self.assertNotIn("geometry", body["legs"][0])
+        # The pickup vertex survives simplification and legs end on it and the last vertex.
+        self.assertEqual(kept[ends[0]], geometry[1200])
+        self.assertEqual(ends[1], len(kept) - 1)
+        self.assertEqual(kept[-1], geometry[-1])
+
+    def test_leg_geometry_off_without_zoom(self):
+        body = route_to_dict(self.route, GeometryOptions(leg_geometry=False))
+        self.assertEqual(body["geometry"], self.route.geometry)
+        ends = [item["geometry_end_index"] for item in body["legs"]]
+        self.assertEqual(ends, [len(self.route.legs[0].geometry) - 1, len(self.route.geometry) - 1])
+
+    async def test_plan_view_options(self):
+        response = await self.post_json(
+            "/api/plan/?geometry=polyline6&zoom=6&leg_geometry=0", _plan_payload()
+        )
+        self.assertEqual(response.status_code, 200)
+        route = json.loads(response.content)["route"]
+        self.assertEqual(route["geometry_format"], "polyline6")
+        self.assertIsInstance(route["geometry"], str)
+        self.assertEqual(
+            [item["geometry_end_index"] for item in route["legs"]][-1],
+            len(_decode_polyline(route["geometry"], 6)) - 1,
+        )
+
+        for query, error in (
+            ("geometry=wkt", "geometry must be one of geojson, polyline, polyline6"),
+            ("zoom=far", "zoom must be a number"),
+            ("zoom=23", "zoom must be between 0 and 22"),
+        ):
+            with self.subTest(query=query):
+                response = await self.post_json(f"/api/plan/?{query}", _plan_payload())
+                self.assertEqual(response.status_code, 400)
+                self.assertEqual(json.loads(response.content), {"error": error})
+
+
+def _joined_rows(timeline) -> list[tuple]:
+    """(status, start, end, description) per row, with back-to-back drives of one leg joined."""
+    rows = []
+    for status, start, end, _, description, *_ in timeline.rows():
+        if rows and status == DutyStatus.DRIVING and rows[-1][0] == status and rows[-1][2] == start:
+            if rows[-1][3] == description:
+                rows[-1] = (status, rows[-1][1], end, description)
+                continue
+        rows.append((status, start, end, description))
+    return rows
+
+
+class ReplanTests(ViewTestCase):
+    """Checkpoints, remaining routes and re-plans of a stored plan."""
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.trip = _trip(40)
+        cls.route = routing.get_backend().route([CHICAGO, DALLAS, DENVER])
+        cls.body, cls.record = planner.plan_trip_record(cls.trip, cls.route)
+
+    def replan(self, now):
+        checkpoint = planner.replan_checkpoint(self.record, now)
+        route = planner.remaining_route(self.record, checkpoint)
+        body, record = planner.replan_trip_record(self.record, checkpoint, route)
+        return checkpoint, route, json.loads(body), record
+
+    def test_unchanged_replan_reproduces_the_plan(self):
+        rows = list(self.record.timeline.rows())
+        expected = json.loads(self.body)
+        for row in rows[1:-1]:
+            # Inside each row: drives are cut there, stops and rests run to their end.
+            now = row[1] + timedelta(minutes=7)
+            with self.subTest(row=row[:2]):
+                checkpoint, route, body, record = self.replan(now)
+                self.assertEqual(len(checkpoint.prefix), rows.index(row) + 1)
+                self.assertEqual(_joined_rows(record.timeline), _joined_rows(self.record.timeline))
+                self.assertEqual(record.route_start_row, len(checkpoint.prefix))
+                # Log sheets differ only in the drive split at now.
+                self.assertEqual(
+                    [{**log, "segments": None} for log in body["log_sheets"]],
+                    [{**log, "segments": None} for log in expected["log_sheets"]],
+                )
+                self.assertEqual(len(body["stops_and_rests"]), len(expected["stops_and_rests"]))
+                for stop, planned in zip(body["stops_and_rests"], expected["stops_and_rests"]):
+                    self.assertEqual({**stop, "coordinates": None}, {**planned, "coordinates": None})
+                    # The remaining polyline scales to its road miles on its own.
+                    self.assertLess(_haversine_miles(stop["coordinates"], planned["coordinates"]), 0.1)
+
+                # A re-plan of the re-plan, on its own remaining route, still matches.
+                later = planner.replan_checkpoint(record, rows[-2][2] - timedelta(minutes=1))
+                _, again = planner.replan_trip_record(
+                    record, later, planner.remaining_route(record, later)
+                )
+                self.assertEqual(_joined_rows(again.timeline), _joined_rows(self.record.timeline))
+
+    def test_remaining_route(self):
+        rows = list(self.record.timeline.rows())
+        drive = next(row for row in rows if row[4] == "Driving to dropoff")
+        now = drive[1] + (drive[2] - drive[1]) / 2
+        checkpoint = planner.replan_checkpoint(self.record, now)
+        route = planner.remaining_route(self.record, checkpoint)
+
+        self.assertEqual(checkpoint.snapshot.leg_index, 1)
+        self.assertEqual(len(route.legs), 1)
+        self.assertAlmostEqual(route.distance_miles, sum(leg.distance_miles for leg in checkpoint.legs))
+        self.assertLess(route.distance_miles, self.route.legs[1].distance_miles)
+        self.assertEqual(route.geometry[-1], self.route.geometry[-1])
+        self.assertEqual(route.waypoints, [route.geometry[0], DENVER])
+        # The cut point is the planned position: as far along the leg as the miles driven.
+        placer = planner.StopPlacer(self.route, self.record.legs)
+        leg_index = placer.index(self.route.legs[1].geometry)
+        scale = placer.scale(leg_index, self.route.legs[1].distance_miles)
+        expected = leg_index.point_at_distance(checkpoint.snapshot.leg_miles * scale)
+        self.assertAlmostEqual(route.geometry[0][0], expected[0], places=9)
+        self.assertAlmostEqual(route.geometry[0][1], expected[1], places=9)
+        self.assertEqual(planner.remaining_waypoints(self.record, checkpoint), [DENVER])
+
+    def test_checkpoint_outside_the_plan(self):
+        timeline = self.record.timeline
+        with self.assertRaisesRegex(ValueError, "before the start"):
+            planner.replan_checkpoint(self.record, self.trip.start_time - timedelta(minutes=1))
+        with self.assertRaisesRegex(ValueError, "already complete"):
+            planner.replan_checkpoint(self.record, timeline.time_at(timeline.end_us[-1]))
+
+    def test_pack_record_round_trip(self):
+        packed = plan_store.pack_record(self.record)
+        self.assertIsInstance(packed.route, tuple)
+        unpacked = plan_store.unpack_record(packed)
+        self.assertEqual(unpacked.route, self.route)
+        self.assertEqual(unpacked.legs, self.record.legs)
+        self.assertEqual(list(unpacked.timeline.rows()), list(self.record.timeline.rows()))
+
+        plan_store.save_plan("roundtrip", self.record)
+        loaded = plan_store.load_plan("roundtrip")
+        self.assertEqual(loaded.route, self.route)
+        self.assertEqual(list(loaded.timeline.rows()), list(self.record.timeline.rows()))
+        self.assertIsNone(plan_store.load_plan("missing"))
+
+    async def test_replan_view(self):
+        response = await self.post_json("/api/plan/", _plan_payload(current_cycle_used_hrs=40))
+        self.assertEqual(response.status_code, 200)
+        plan = json.loads(response.content)
+        rows = [seg for log in plan["log_sheets"] for seg in log["segments"]]
+
+        now = rows[len(rows) // 2]["start_time"]
+        response = await self.post_json("/api/plan/replan/", {"plan_id": plan["plan_id"], "now": now})
+        self.assertEqual(response.status_code, 200)
+        replanned = json.loads(response.content)
+        self.assertNotEqual(replanned["plan_id"], plan["plan_id"])
+        self.assertEqual(replanned["stops_and_rests"][0], plan["stops_and_rests"][0])
+        self.assertLess(replanned["route"]["distance_miles"], plan["route"]["distance_miles"])
+
+        for now, error in (
+            (rows[-1]["end_time"], "plan is already complete at now"),
+            ("2024-03-01T00:00:00+00:00", "now is before the start of the plan's current route"),
+        ):
+            with self.subTest(now=now):
+                response = await self.post_json(
+                    "/api/plan/replan/", {"plan_id": replanned["plan_id"], "now": now}
+                )
+                self.assertEqual(response.status_code, 400)
+                self.assertEqual(json.loads(response.content), {"error": error})
+
+        response = await self.post_json("/api/plan/replan/", {"plan_id": "0" * 32})
+        self.assertEqual(response.status_code, 404)
@@ -1,13 +1,29 @@
 """
 Build a timeline of duty segments from a trip request and route.
 Applies HOS: 11hr drive, 14hr window, 30min non-driving break,
-10hr reset, optional split-sleeper pair, and 70hr/8day with restart handling.
+10hr reset, optional split-sleeper pair, and 70hr/8day with restart handling
+(exact per-day window when the request carries on-duty history). Legs with
+StopSites fuel at the last truck stop before each fuel interval runs out and
+take breaks and rests at the last site before the HOS limit.
 """
 
-from dataclasses import dataclass
-from datetime import timedelta
+from bisect import bisect_right
+from dataclasses import asdict, dataclass, fields, replace
+from datetime import datetime, timedelta
+from functools import lru_cache
+from typing import Iterator
 
-from .schemas import DutyStatus, Route, TimelineSegment, TripRequest
+from .log_sheet_generator import DayBoundaries
+from .schemas import (
+    CODE_BY_STATUS,
+    CompactTimeline,
+    DutyStatus,
+    Route,
+    StopSites,
+    TripRequest,
+    TripStop,
+    home_terminal_zone,
+)
 
 DRIVE_LIMIT_MIN = 11 * 60
 WINDOW_LIMIT_MIN = 14 * 60
@@ -21,6 +37,13 @@ FUEL_INTERVAL_MILES = 1000
 FUEL_STOP_MIN = 30
 SPLIT_SHORT_REST_MIN = 2 * 60
 SPLIT_LONG_SLEEPER_MIN = 7 * 60
+FUEL_STOP_DESCRIPTION = "Fuel stop"
+RESTART_DESCRIPTION = "34-hour restart"
+CYCLE_DAYS = 8
+CYCLE_WAIT_DESCRIPTION = "Off duty (70hr cycle)"
+CYCLE_WAIT_REST_DESCRIPTION = "Off duty (70hr cycle, 10-hour rest)"
+# A break or rest moves back to a stop site at most this much driving before the limit.
+SITE_SNAP_MAX_EARLY_MIN = 60
 
 ON_DUTY_STATUSES = {
     DutyStatus.DRIVING,
@@ -28,9 +51,13 @@ ON_DUTY_STATUSES = {
 }
 
 
+_ONE_MICROSECOND = timedelta(microseconds=1)
+
+
 @dataclass
 class HOSState:
-    current: object
+    epoch: datetime
+    elapsed_us: int  # time since epoch; timeline offsets use the same clock
     drive_since_reset: float
     window_since_reset: float
     driving_since_break: float
@@ -38,37 +65,268 @@ class HOSState:
     rolling_cycle_min: float
     cycle_decay_per_min: float
     split_stage: int = 0  # 0 none, 1 short break taken, waiting for sleeper part
+    # Exact 70hr/8-day tracking (None: rolling_cycle_min decays linearly):
+    # on-duty minutes per day in a ring of CYCLE_DAYS slots, the newest day
+    # held, and the home terminal zone whose midnights bound the days (None:
+    # the epoch's own zone). Day 0 is the start day. rolling_cycle_min is
+    # then the sum of the ring.
+    cycle_day_min: list[float] | None = None
+    cycle_day: int = 0
+    cycle_zone: str | None = None
+
+    @property
+    def current(self) -> datetime:
+        return self.epoch + timedelta(microseconds=self.elapsed_us)
+
+
+# Where build_timeline_checkpoints can take snapshots: after each drive
+# between stops, after each fuel stop, after each leg's pickup/dropoff.
+CHECKPOINT_KINDS = ("drive", "fuel", "leg")
+
+
+@dataclass(frozen=True)
+class HOSSnapshot:
+    """
+    Immutable copy of the HOS clocks at one point of a simulation, with where
+    the trip stood then: legs finished, miles into the current leg, miles
+    since the last fuel stop and timeline rows written so far. to_dict /
+    from_dict round-trip it through JSON; resume_from_snapshot continues the
+    simulation from it.
+    """
+
+    epoch: datetime
+    elapsed_us: int
+    drive_since_reset: float
+    window_since_reset: float
+    driving_since_break: float
+    non_driving_streak: float
+    rolling_cycle_min: float
+    cycle_decay_per_min: float
+    split_stage: int = 0
+    cycle_day_min: tuple[float, ...] | None = None
+    cycle_day: int = 0
+    cycle_zone: str | None = None
+    kind: str = ""  # checkpoint kind that took it
+    leg_index: int = 0
+    leg_miles: float = 0.0
+    miles_since_fuel: float = 0.0
+    row: int = 0
+
+    @property
+    def current(self) -> datetime:
+        return self.epoch + timedelta(microseconds=self.elapsed_us)
+
+    @classmethod
+    def of(cls, state: HOSState, **position) -> "HOSSnapshot":
+        values = {f.name: getattr(state, f.name) for f in fields(HOSState)}
+        if values["cycle_day_min"] is not None:
+            values["cycle_day_min"] = tuple(values["cycle_day_min"])
+        return cls(**values, **position)
+
+    def state(self) -> HOSState:
+        """A fresh mutable HOSState to simulate from."""
+        values = {f.name: getattr(self, f.name) for f in fields(HOSState)}
+        if values["cycle_day_min"] is not None:
+            values["cycle_day_min"] = list(values["cycle_day_min"])
+        return HOSState(**values)
+
+    def to_dict(self) -> dict:
+        data = asdict(self)
+        data["epoch"] = self.epoch.isoformat()
+        # The clock runs in the epoch's zone; an ISO offset alone would lose its DST changes.
+        data["epoch_zone"] = getattr(self.epoch.tzinfo, "key", None)
+        data["current_time"] = self.current.isoformat()
+        return data
+
+    @classmethod
+    def from_dict(cls, data: dict) -> "HOSSnapshot":
+        values = {f.name: data[f.name] for f in fields(cls) if f.name in data}
+        if isinstance(values.get("epoch"), str):
+            values["epoch"] = datetime.fromisoformat(values["epoch"].replace("Z", "+00:00"))
+            if data.get("epoch_zone"):
+                values["epoch"] = values["epoch"].astimezone(home_terminal_zone(data["epoch_zone"]))
+        if values.get("cycle_day_min") is not None:
+            values["cycle_day_min"] = tuple(values["cycle_day_min"])
+        return cls(**values)
+
+
+@lru_cache(maxsize=4096)
+def _duration_us(duration_min: float) -> int:
+    """Minutes to whole microseconds, rounded exactly as timedelta(minutes=...) does."""
+    return timedelta(minutes=duration_min) // _ONE_MICROSECOND
+
+
+# One steady-state duty day from a fresh reset: 8 hr drive, 30 min break,
+# 3 hr drive to the 11 hr limit, 10 hr rest. Durations match what the
+# step-by-step loop computes (floats for drive chunks, ints for stops).
+_DAY_FIRST_DRIVE_MIN = float(BREAK_AFTER_DRIVE_MIN)
+_DAY_SECOND_DRIVE_MIN = float(DRIVE_LIMIT_MIN - BREAK_AFTER_DRIVE_MIN)
+_DAY_FIRST_DRIVE_US = _duration_us(_DAY_FIRST_DRIVE_MIN)
+_DAY_BREAK_US = _duration_us(BREAK_DURATION_MIN)
+_DAY_SECOND_DRIVE_US = _duration_us(_DAY_SECOND_DRIVE_MIN)
+_DAY_REST_US = _duration_us(REST_DURATION_MIN)
+_DRIVING_CODE = CODE_BY_STATUS[DutyStatus.DRIVING]
+_OFF_DUTY_CODE = CODE_BY_STATUS[DutyStatus.OFF_DUTY]
+_SLEEPER_CODE = CODE_BY_STATUS[DutyStatus.SLEEPER_BERTH]
+
+
+def _cycle_after(cycle_min: float, decay_per_min: float, elapsed_min: float, on_duty_add_min: float) -> float:
+    if elapsed_min > 0 and decay_per_min > 0:
+        cycle_min = max(0.0, cycle_min - (decay_per_min * elapsed_min))
+    return cycle_min + max(0.0, on_duty_add_min)
+
+
+_DAY_US = 24 * 3600 * 1_000_000
+# Cycle room below this counts as none: a shorter drive would not advance the µs clock.
+_CYCLE_SLACK_MIN = 1e-6
+
+
+@lru_cache(maxsize=1024)
+def _cycle_midnights_us(epoch: datetime, epoch_tz, zone_name: str | None, count: int) -> tuple[int, ...]:
+    """
+    Where the first count cycle days start, in µs from epoch: the local
+    midnights DayBoundaries cuts the log sheets at. epoch_tz is part of the
+    key because aware datetimes at the same instant compare equal.
+    """
+    zone = home_terminal_zone(zone_name) if zone_name else epoch_tz
+    days = DayBoundaries(zone, epoch)
+    return tuple((days.midnight(day) - epoch) // _ONE_MICROSECOND for day in range(count))
+
+
+def _cycle_day_start_us(state: HOSState, day: int) -> int:
+    """Start of cycle day `day` on the state's clock; DST days are 23 or 25 hours."""
+    count = (day // DayBoundaries.BLOCK_DAYS + 1) * DayBoundaries.BLOCK_DAYS
+    return _cycle_midnights_us(state.epoch, state.epoch.tzinfo, state.cycle_zone, count)[day]
+
+
+def _cycle_day_at(state: HOSState, offset_us: int) -> int:
+    """The cycle day containing offset_us (at or after the epoch)."""
+    day = max(0, offset_us // _DAY_US)
+    while day > 0 and _cycle_day_start_us(state, day) > offset_us:
+        day -= 1
+    while _cycle_day_start_us(state, day + 1) <= offset_us:
+        day += 1
+    return day
+
+
+def _roll_cycle_days(state: HOSState, day: int):
+    """Make day the newest in the ring, dropping days that leave the window."""
+    ring = state.cycle_day_min
+    if day - state.cycle_day >= CYCLE_DAYS:
+        ring[:] = [0.0] * CYCLE_DAYS
+        state.rolling_cycle_min = 0.0
+    else:
+        for passed in range(state.cycle_day + 1, day + 1):
+            slot = passed % CYCLE_DAYS
+            state.rolling_cycle_min -= ring[slot]
+            ring[slot] = 0.0
+    state.cycle_day = day
 
 
 def _advance_cycle(state: HOSState, elapsed_min: float, on_duty_add_min: float):
-    if elapsed_min > 0 and state.cycle_decay_per_min > 0:
-        state.rolling_cycle_min = max(
-            0.0,
-            state.rolling_cycle_min - (state.cycle_decay_per_min * elapsed_min),
+    """Account a segment starting at state.elapsed_us against the 70hr/8-day cycle."""
+    if state.cycle_day_min is None:
+        state.rolling_cycle_min = _cycle_after(
+            state.rolling_cycle_min,
+            state.cycle_decay_per_min,
+            elapsed_min,
+            on_duty_add_min,
         )
-    state.rolling_cycle_min += max(0.0, on_duty_add_min)
+        return
+
+    start_us = state.elapsed_us
+    end_us = start_us + _duration_us(elapsed_min)
+    if on_duty_add_min > 0:
+        # On-duty time counts toward the day it falls in; split at midnights.
+        chunk_start = start_us
+        day = _cycle_day_at(state, start_us)
+        while chunk_start < end_us:
+            chunk_end = min(end_us, _cycle_day_start_us(state, day + 1))
+            if day > state.cycle_day:
+                _roll_cycle_days(state, day)
+            chunk_min = (chunk_end - chunk_start) / 60_000_000
+            state.cycle_day_min[day % CYCLE_DAYS] += chunk_min
+            state.rolling_cycle_min += chunk_min
+            chunk_start = chunk_end
+            day += 1
+    day = _cycle_day_at(state, end_us)
+    if day > state.cycle_day:
+        _roll_cycle_days(state, day)
+
+
+def _cycle_wait_us(state: HOSState, wanted_min: float) -> int:
+    """
+    Time until the 8-day window has room for wanted_min more on-duty
+    minutes; whole days drop off at each midnight, so the answer is the
+    first midnight that frees enough of them.
+    """
+    ring = state.cycle_day_min
+    total = state.rolling_cycle_min
+    for ahead in range(1, CYCLE_DAYS + 1):
+        total -= ring[(state.cycle_day + ahead) % CYCLE_DAYS]
+        if total < CYCLE_LIMIT_MIN - _CYCLE_SLACK_MIN and total + wanted_min <= CYCLE_LIMIT_MIN:
+            return _cycle_day_start_us(state, state.cycle_day + ahead) - state.elapsed_us
+    return CYCLE_DAYS * _DAY_US
+
+
+def _cycle_room_min(state: HOSState, horizon_min: float) -> float:
+    """
+    On-duty minutes that fit in the 8-day window from now if worked without
+    a break, counting days that roll off at midnights along the way
+    (only the first horizon_min minutes are looked at).
+    """
+    ring = state.cycle_day_min
+    room = CYCLE_LIMIT_MIN - state.rolling_cycle_min
+    for ahead in range(1, CYCLE_DAYS + 1):
+        until_midnight = (
+            _cycle_day_start_us(state, state.cycle_day + ahead) - state.elapsed_us
+        ) / 60_000_000
+        if room < until_midnight or until_midnight >= horizon_min:
+            break
+        room += ring[(state.cycle_day + ahead) % CYCLE_DAYS]
+    return room
+
+
+def _cycle_room_wanted(required_min: float, work_after_min: float) -> float:
+    """
+    Room to wait for when the cycle is full: the rest of the trip's on-duty
+    work, up to one full duty window, so a wait is not followed straight by
+    another one for the next few hours that roll off.
+    """
+    return max(required_min, min(required_min + work_after_min, WINDOW_LIMIT_MIN))
 
 
 def _add_segment(
-    segments: list[TimelineSegment],
+    segments: CompactTimeline,
     state: HOSState,
     status: DutyStatus,
     duration_min: float,
     description: str,
     *,
     count_toward_window: bool = True,
+    distance_miles: float = 0.0,
 ):
-    end = state.current + timedelta(minutes=duration_min)
+    end_us = state.elapsed_us + _duration_us(duration_min)
     segments.append(
-        TimelineSegment(
-            status=status,
-            start_time=state.current,
-            end_time=end,
-            duration_minutes=duration_min,
-            description=description,
-        )
+        status,
+        state.elapsed_us,
+        end_us,
+        duration_min,
+        description,
+        distance_miles,
     )
 
+    _apply_segment(state, status, duration_min, count_toward_window)
+    state.elapsed_us = end_us
+
+
+def _apply_segment(
+    state: HOSState,
+    status: DutyStatus,
+    duration_min: float,
+    count_toward_window: bool,
+):
+    """Clock and limit bookkeeping for one segment (everything but elapsed time)."""
     on_duty_add = duration_min if status in ON_DUTY_STATUSES else 0.0
     _advance_cycle(state, duration_min, on_duty_add)
 
@@ -84,10 +342,8 @@ def _add_segment(
         if state.non_driving_streak >= BREAK_DURATION_MIN:
             state.driving_since_break = 0.0
 
-    state.current = end
-
 
-def _insert_10h_reset(segments: list[TimelineSegment], state: HOSState, reason: str = "10-hour rest"):
+def _insert_10h_reset(segments: CompactTimeline, state: HOSState, reason: str = "10-hour rest"):
     _add_segment(
         segments,
         state,
@@ -96,6 +352,10 @@ def _insert_10h_reset(segments: list[TimelineSegment], state: HOSState, reason:
         reason,
         count_toward_window=False,
     )
+    _after_10h_reset(state)
+
+
+def _after_10h_reset(state: HOSState):
     state.drive_since_reset = 0.0
     state.window_since_reset = 0.0
     state.driving_since_break = 0.0
@@ -103,24 +363,63 @@ def _insert_10h_reset(segments: list[TimelineSegment], state: HOSState, reason:
     state.split_stage = 0
 
 
-def _insert_34h_restart(segments: list[TimelineSegment], state: HOSState):
+def _insert_34h_restart(segments: CompactTimeline, state: HOSState):
     _add_segment(
         segments,
         state,
         DutyStatus.SLEEPER_BERTH,
         RESTART_34H_MIN,
-        "34-hour restart",
+        RESTART_DESCRIPTION,
         count_toward_window=False,
     )
+    _after_34h_restart(state)
+
+
+def _after_34h_restart(state: HOSState):
     state.drive_since_reset = 0.0
     state.window_since_reset = 0.0
     state.driving_since_break = 0.0
     state.non_driving_streak = RESTART_34H_MIN
     state.rolling_cycle_min = 0.0
+    if state.cycle_day_min is not None:
+        state.cycle_day_min[:] = [0.0] * CYCLE_DAYS
     state.split_stage = 0
 
 
-def _insert_split_short(segments: list[TimelineSegment], state: HOSState):
+def _wait_for_cycle(segments: CompactTimeline, state: HOSState, wanted_min: float):
+    """
+    Exact-cycle counterpart of a 34-hour restart: stay off duty until the
+    earliest midnight at which the 8-day window has room for wanted_min, or
+    take the restart when that would be sooner. A wait of 10 hours or more
+    also serves as the 10-hour reset.
+    """
+    wait_us = _cycle_wait_us(state, wanted_min)
+    if wait_us >= _duration_us(RESTART_34H_MIN):
+        _insert_34h_restart(segments, state)
+        return
+    wait_min = wait_us / 60_000_000
+    if wait_min >= REST_DURATION_MIN:
+        _add_segment(
+            segments,
+            state,
+            DutyStatus.OFF_DUTY,
+            wait_min,
+            CYCLE_WAIT_REST_DESCRIPTION,
+            count_toward_window=False,
+        )
+        _after_10h_reset(state)
+    else:
+        _add_segment(
+            segments,
+            state,
+            DutyStatus.OFF_DUTY,
+            wait_min,
+            CYCLE_WAIT_DESCRIPTION,
+            count_toward_window=True,
+        )
+
+
+def _insert_split_short(segments: CompactTimeline, state: HOSState):
     _add_segment(
         segments,
         state,
@@ -129,10 +428,14 @@ def _insert_split_short(segments: list[TimelineSegment], state: HOSState):
         "Split sleeper break (2 hr off duty)",
         count_toward_window=False,
     )
+    _after_split_short(state)
+
+
+def _after_split_short(state: HOSState):
     state.split_stage = 1
 
 
-def _insert_split_long(segments: list[TimelineSegment], state: HOSState):
+def _insert_split_long(segments: CompactTimeline, state: HOSState):
     _add_segment(
         segments,
         state,
@@ -141,6 +444,10 @@ def _insert_split_long(segments: list[TimelineSegment], state: HOSState):
         "Split sleeper berth (7 hr)",
         count_toward_window=False,
     )
+    _after_split_long(state)
+
+
+def _after_split_long(state: HOSState):
     # Paired split breaks are excluded from driving window calculations.
     state.window_since_reset = max(
         0.0,
@@ -150,28 +457,143 @@ def _insert_split_long(segments: list[TimelineSegment], state: HOSState):
 
 
 def _ensure_cycle_capacity_for_on_duty(
-    segments: list[TimelineSegment],
+    segments: CompactTimeline,
     state: HOSState,
     required_min: float,
+    work_after_min: float = 0.0,
 ):
     while state.rolling_cycle_min + required_min > CYCLE_LIMIT_MIN:
-        _insert_34h_restart(segments, state)
+        if state.cycle_day_min is None:
+            _insert_34h_restart(segments, state)
+        else:
+            _wait_for_cycle(segments, state, _cycle_room_wanted(required_min, work_after_min))
+
+
+def _drive_full_days(
+    segments: CompactTimeline,
+    state: HOSState,
+    remaining_drive: float,
+    description: str,
+    miles_per_min: float,
+) -> float:
+    """
+    Closed-form fast path for _drive_with_hos: from a fresh 10-hour reset,
+    emit whole steady-state duty days at once while more than a day of
+    driving remains and the 70hr cycle cannot trip inside the day. Produces
+    exactly the segments and state the step-by-step loop would; returns the
+    drive minutes left for the loop to finish.
+    """
+    if state.cycle_day_min is not None:
+        return remaining_drive  # days cannot be precomputed against the exact window
+    decay = state.cycle_decay_per_min
+    while (
+        state.drive_since_reset == 0
+        and state.window_since_reset == 0
+        and state.driving_since_break == 0
+        and state.split_stage == 0
+    ):
+        after_first = remaining_drive - _DAY_FIRST_DRIVE_MIN
+        if after_first < _DAY_SECOND_DRIVE_MIN:
+            break
+        after_second = after_first - _DAY_SECOND_DRIVE_MIN
+        if after_second <= 0:
+            break  # trip ends at the 11hr limit; no rest follows
+
+        # Cycle is checked before each step of the day, as the loop does.
+        cycle0 = state.rolling_cycle_min
+        cycle1 = _cycle_after(cycle0, decay, _DAY_FIRST_DRIVE_MIN, _DAY_FIRST_DRIVE_MIN)
+        cycle2 = _cycle_after(cycle1, decay, BREAK_DURATION_MIN, 0.0)
+        cycle3 = _cycle_after(cycle2, decay, _DAY_SECOND_DRIVE_MIN, _DAY_SECOND_DRIVE_MIN)
+        if max(cycle0, cycle1, cycle2, cycle3) >= CYCLE_LIMIT_MIN:
+            break
+
+        t0 = state.elapsed_us
+        t1 = t0 + _DAY_FIRST_DRIVE_US
+        t2 = t1 + _DAY_BREAK_US
+        t3 = t2 + _DAY_SECOND_DRIVE_US
+        t4 = t3 + _DAY_REST_US
+        drive_id = segments.description_id(description or "Driving")
+        segments.status_codes.extend((_DRIVING_CODE, _OFF_DUTY_CODE, _DRIVING_CODE, _SLEEPER_CODE))
+        segments.start_us.extend((t0, t1, t2, t3))
+        segments.end_us.extend((t1, t2, t3, t4))
+        segments.durations.extend(
+            (_DAY_FIRST_DRIVE_MIN, BREAK_DURATION_MIN, _DAY_SECOND_DRIVE_MIN, REST_DURATION_MIN)
+        )
+        segments.miles.extend(
+            (
+                _DAY_FIRST_DRIVE_MIN * miles_per_min,
+                0.0,
+                _DAY_SECOND_DRIVE_MIN * miles_per_min,
+                0.0,
+            )
+        )
+        segments.description_ids.extend(
+            (
+                drive_id,
+                segments.description_id("30-minute break"),
+                drive_id,
+                segments.description_id("10-hour rest (11hr drive limit)"),
+            )
+        )
+        state.elapsed_us = t4
+        state.rolling_cycle_min = _cycle_after(cycle3, decay, REST_DURATION_MIN, 0.0)
+        state.non_driving_streak = REST_DURATION_MIN
+        remaining_drive = after_second
+
+    return remaining_drive
 
 
 def _drive_with_hos(
-    segments: list[TimelineSegment],
+    segments: CompactTimeline,
     state: HOSState,
     drive_min_total: float,
     description: str,
+    *,
+    miles_per_min: float = 0.0,
+    closed_form: bool = True,
+    work_after_min: float = 0.0,
+    site_miles: list[float] | None = None,
+    start_miles: float = 0.0,
 ):
+    """
+    Drive drive_min_total minutes at miles_per_min, inserting breaks, resets
+    and restarts as HOS limits are reached. closed_form=False disables the
+    whole-day fast path and steps one break/reset at a time. work_after_min
+    is the on-duty time the trip still needs after this drive (used to size
+    waits for the exact 8-day cycle). With site_miles (ascending leg miles
+    of stop sites; the drive starts at start_miles), a drive that would run
+    into the break, 11hr or 14hr limit stops at the last site up to
+    SITE_SNAP_MAX_EARLY_MIN before it and takes that break or rest there.
+    """
     remaining_drive = drive_min_total
+    miles = start_miles
+    rest_due = None  # limit a snapped drive stopped early for: "break", "drive" or "window"
 
     while remaining_drive > 0:
-        if state.rolling_cycle_min >= CYCLE_LIMIT_MIN:
-            _insert_34h_restart(segments, state)
+        if closed_form and not site_miles:
+            remaining_drive = _drive_full_days(
+                segments,
+                state,
+                remaining_drive,
+                description,
+                miles_per_min,
+            )
+            if remaining_drive <= 0:
+                break
+
+        if state.cycle_day_min is None:
+            if state.rolling_cycle_min >= CYCLE_LIMIT_MIN:
+                _insert_34h_restart(segments, state)
+                rest_due = None
+                continue
+        elif state.rolling_cycle_min >= CYCLE_LIMIT_MIN - _CYCLE_SLACK_MIN:
+            _wait_for_cycle(
+                segments, state, _cycle_room_wanted(0.0, remaining_drive + work_after_min)
+            )
+            rest_due = None
             continue
 
-        if state.driving_since_break >= BREAK_AFTER_DRIVE_MIN:
+        if state.driving_since_break >= BREAK_AFTER_DRIVE_MIN or rest_due == "break":
             _add_segment(
                 segments,
                 state,
@@ -180,13 +602,15 @@ def _drive_with_hos(
                 "30-minute break",
                 count_toward_window=True,
             )
+            rest_due = None
             continue
 
-        if state.drive_since_reset >= DRIVE_LIMIT_MIN:
+        if state.drive_since_reset >= DRIVE_LIMIT_MIN or rest_due == "drive":
             _insert_10h_reset(segments, state, "10-hour rest (11hr drive limit)")
+            rest_due = None
             continue
 
-        if state.window_since_reset >= WINDOW_LIMIT_MIN:
+        if state.window_since_reset >= WINDOW_LIMIT_MIN or rest_due == "window":
             # Try a split-sleeper pair first when the issue is window exhaustion.
             if state.split_stage == 0:
                 _insert_split_short(segments, state)
@@ -194,6 +618,7 @@ def _drive_with_hos(
             _insert_split_long(segments, state)
             if state.window_since_reset >= WINDOW_LIMIT_MIN:
                 _insert_10h_reset(segments, state, "10-hour rest (14hr window)")
+            rest_due = None
             continue
 
         drive_window_left = WINDOW_LIMIT_MIN - state.window_since_reset
@@ -203,53 +628,218 @@ def _drive_with_hos(
             break_left = BREAK_AFTER_DRIVE_MIN
 
         chunk = min(remaining_drive, drive_window_left, drive_limit_left, break_left)
+        if state.cycle_day_min is not None:
+            chunk = min(chunk, _cycle_room_min(state, chunk))
         if chunk <= 0:
             continue
 
+        if site_miles and chunk < remaining_drive and miles_per_min > 0:
+            # Checked in the order the limits are handled above.
+            limit = (
+                "break" if chunk == break_left
+                else "drive" if chunk == drive_limit_left
+                else "window" if chunk == drive_window_left
+                else None
+            )
+            end_miles = miles + chunk * miles_per_min
+            i = bisect_right(site_miles, end_miles) - 1
+            if (
+                limit is not None
+                and i >= 0
+                and site_miles[i] > miles
+                and end_miles - site_miles[i] <= SITE_SNAP_MAX_EARLY_MIN * miles_per_min
+            ):
+                chunk = (site_miles[i] - miles) / miles_per_min
+                rest_due = limit
+
         _add_segment(
             segments,
             state,
             DutyStatus.DRIVING,
             chunk,
             description or "Driving",
+            distance_miles=chunk * miles_per_min,
         )
         remaining_drive -= chunk
+        miles += chunk * miles_per_min
 
 
 def _split_leg_by_fuel(
     distance_miles: float,
     duration_hours: float,
+    miles_since_fuel: float = 0.0,
+    fuel_miles: list[float] | None = None,
 ) -> list[tuple[float, float]]:
-    """Return list of (miles, hours) for each segment between fuel stops."""
+    """
+    Return list of (miles, hours) for each segment between fuel stops.
+    miles_since_fuel shortens the first segment for a leg resumed mid-way.
+    With fuel_miles (ascending leg miles of truck stops), each fuel stop
+    moves back to the last truck stop before it falls due, if there is one.
+    """
     if distance_miles <= 0:
         return [(0, 0.0)]
 
     segments = []
     miles_left = distance_miles
     miles_per_hour = distance_miles / duration_hours if duration_hours else 0
+    interval = FUEL_INTERVAL_MILES
+    if miles_since_fuel:
+        interval = FUEL_INTERVAL_MILES - miles_since_fuel
+        if interval < 1e-6:
+            # Due now (summed miles can land a hair short of the interval).
+            segments.append((0, 0.0))
+            interval = FUEL_INTERVAL_MILES
 
     while miles_left > 0:
-        segment_miles = min(miles_left, FUEL_INTERVAL_MILES)
+        segment_miles = min(miles_left, interval)
+        if fuel_miles and segment_miles < miles_left:
+            start = distance_miles - miles_left
+            i = bisect_right(fuel_miles, start + segment_miles) - 1
+            if i >= 0 and fuel_miles[i] > start:
+                segment_miles = fuel_miles[i] - start
         segment_hours = segment_miles / miles_per_hour if miles_per_hour else 0
         segments.append((segment_miles, segment_hours))
         miles_left -= segment_miles
+        interval = FUEL_INTERVAL_MILES
 
     return segments
 
 
-def build_timeline(request: TripRequest, route: Route) -> list[TimelineSegment]:
+def _miles_per_min(miles: float, hours: float) -> float:
+    return miles / (hours * 60) if hours else 0.0
+
+
+def _leg_work_min(leg: "TripLeg", fuel_segments) -> float:
+    """On-duty minutes a leg needs: driving, fuel stops and its service stop."""
+    if fuel_segments is None:
+        work = leg.duration_hours * 60
+    else:
+        work = sum(hours * 60 for _, hours in fuel_segments)
+        work += FUEL_STOP_MIN * (len(fuel_segments) - 1)
+    return work + (leg.stop_minutes if leg.stop_description else 0)
+
+
+@dataclass
+class TripLeg:
+    """One drive the engine simulates, and the service stop that ends it."""
+
+    distance_miles: float
+    duration_hours: float
+    drive_description: str
+    stop_description: str | None = None  # None: the leg ends without a stop
+    stop_minutes: float = PICKUP_DROPOFF_MIN
+    fuel_stops: bool = True
+    miles_since_fuel: float = 0.0  # for a leg resumed part-way
+    sites: StopSites | None = None  # truck stops / rest areas to stop at
+
+
+def trip_legs(
+    route: Route,
+    stops: list[TripStop] | None = None,
+    sites: list[StopSites | None] | None = None,
+) -> list[TripLeg]:
     """
-    Build full timeline: drive to pickup, 1hr pickup, drive to dropoff
-    (with fuel stops and HOS breaks/rest), 1hr dropoff.
+    Engine legs for a route: one per route leg, each ending with the time
+    spent at its stop (stops default to a pickup and a dropoff), or one
+    plain drive when the route has no legs. sites are each leg's StopSites.
     """
-    segments: list[TimelineSegment] = []
+    if not route.legs:
+        return [
+            TripLeg(
+                route.distance_miles,
+                route.duration_hours,
+                "Driving",
+                fuel_stops=False,
+            )
+        ]
+    if stops is None:
+        stops = [TripStop("", kind="pickup"), TripStop("", kind="dropoff")]
+    if sites is None:
+        sites = [None] * len(route.legs)
+    return [
+        TripLeg(
+            leg.distance_miles,
+            leg.duration_hours,
+            f"Driving to {stop.kind}",
+            stop.description,
+            stop_minutes=stop.dwell_minutes,
+            sites=leg_sites,
+        )
+        for leg, stop, leg_sites in zip(route.legs, stops, sites)
+    ]
+
+
+def request_legs(request: TripRequest, route: Route) -> list[TripLeg]:
+    """trip_legs for the stops the request asks for, with its stop sites."""
+    return trip_legs(
+        route,
+        getattr(request, "stops", None),
+        getattr(request, "stop_sites", None),
+    )
+
+
+def remaining_legs(
+    legs: list[TripLeg],
+    leg_index: int,
+    leg_miles: float,
+    miles_since_fuel: float,
+) -> list[TripLeg]:
+    """legs from leg_index on, the first shortened by the leg_miles already driven."""
+    remaining = legs[leg_index:]
+    if not remaining:
+        return []
+    leg = remaining[0]
+    if leg_miles <= 0:
+        return [replace(leg, miles_since_fuel=miles_since_fuel)] + remaining[1:]
+    sites = leg.sites.after(leg_miles) if leg.sites is not None else None
+    miles_left = leg.distance_miles - leg_miles
+    if miles_left <= 1e-6:
+        # Float sums of miles driven can leave a sliver; count it as arrived.
+        miles_left = 0.0
+    hours_left = leg.duration_hours * miles_left / leg.distance_miles if leg.distance_miles > 0 else 0.0
+    first = replace(
+        leg,
+        distance_miles=miles_left,
+        duration_hours=hours_left,
+        miles_since_fuel=miles_since_fuel,
+        sites=sites,
+    )
+    return [first] + remaining[1:]
+
+
+def initial_state(request: TripRequest) -> HOSState:
+    """
+    HOS clocks at the trip start. With cycle_history_hrs the 70hr/8-day
+    window is tracked exactly, by days midnight to midnight in the home
+    terminal zone (the days the log sheets show); otherwise
+    current_cycle_used_hrs is assumed to roll off evenly over 8 days.
+    """
+    history = getattr(request, "cycle_history_hrs", None)
+    if history is not None:
+        ring = [0.0] * CYCLE_DAYS
+        # Oldest first, the last entry is the day before the start day.
+        for days_ago, hours in enumerate(reversed(list(history)[-(CYCLE_DAYS - 1) :]), 1):
+            ring[-days_ago % CYCLE_DAYS] = max(0.0, float(hours)) * 60
+        return HOSState(
+            epoch=request.start_time,
+            elapsed_us=0,
+            drive_since_reset=0.0,
+            window_since_reset=0.0,
+            driving_since_break=0.0,
+            non_driving_streak=0.0,
+            rolling_cycle_min=sum(ring),
+            cycle_decay_per_min=0.0,
+            cycle_day_min=ring,
+            cycle_day=0,
+            cycle_zone=getattr(request, "home_terminal_timezone", None) or None,
+        )
 
     initial_cycle_min = max(0.0, request.current_cycle_used_hrs * 60)
     # Approximate rolling-window drop-off rate for unknown pre-trip history.
     decay_per_min = initial_cycle_min / (8 * 24 * 60) if initial_cycle_min > 0 else 0.0
-
-    state = HOSState(
-        current=request.start_time,
+    return HOSState(
+        epoch=request.start_time,
+        elapsed_us=0,
         drive_since_reset=0.0,
         window_since_reset=0.0,
         driving_since_break=0.0,
@@ -258,62 +848,242 @@ def build_timeline(request: TripRequest, route: Route) -> list[TimelineSegment]:
         cycle_decay_per_min=decay_per_min,
     )
 
-    if not route.legs:
-        _drive_with_hos(segments, state, route.duration_hours * 60, "Driving")
-        return segments
-
-    # Leg 0: current -> pickup
-    leg0 = route.legs[0]
-    fuel_segments = _split_leg_by_fuel(leg0.distance_miles, leg0.duration_hours)
-    for i, (seg_miles, seg_hours) in enumerate(fuel_segments):
-        _drive_with_hos(segments, state, seg_hours * 60, "Driving to pickup")
-        if i < len(fuel_segments) - 1 and seg_miles >= FUEL_INTERVAL_MILES:
-            _ensure_cycle_capacity_for_on_duty(segments, state, FUEL_STOP_MIN)
-            _add_segment(
+
+# Segments the engine inserts with their own effect on the HOS clocks, keyed
+# by description so a recorded timeline can be replayed into an HOSState.
+_RESET_EFFECTS = {
+    "10-hour rest": _after_10h_reset,
+    "10-hour rest (11hr drive limit)": _after_10h_reset,
+    "10-hour rest (14hr window)": _after_10h_reset,
+    RESTART_DESCRIPTION: _after_34h_restart,
+    "Split sleeper break (2 hr off duty)": _after_split_short,
+    "Split sleeper berth (7 hr)": _after_split_long,
+    CYCLE_WAIT_REST_DESCRIPTION: _after_10h_reset,
+}
+# Rows that count as rests in scenario summaries: the ones that reset clocks.
+REST_DESCRIPTIONS = frozenset(_RESET_EFFECTS)
+
+
+def replay_row(
+    state: HOSState,
+    status: DutyStatus,
+    end_us: int,
+    duration_min: float,
+    description: str,
+):
+    """Advance state over one recorded timeline row, as the engine did when it appended it."""
+    effect = _RESET_EFFECTS.get(description)
+    _apply_segment(state, status, duration_min, count_toward_window=effect is None)
+    if effect is not None:
+        effect(state)
+    state.elapsed_us = end_us
+
+
+def _timeline_steps(
+    segments: CompactTimeline,
+    state: HOSState,
+    legs: list[TripLeg],
+    closed_form: bool,
+) -> Iterator[tuple]:
+    """
+    Run the simulation into segments, pausing after every step that appends
+    rows so callers can consume the timeline while it is being built. Each
+    pause yields (kind, leg_index, leg_miles, miles_since_fuel): the step
+    just finished (see CHECKPOINT_KINDS) and where the trip stands after it.
+    """
+    fuel_plans = [
+        _split_leg_by_fuel(
+            leg.distance_miles,
+            leg.duration_hours,
+            leg.miles_since_fuel,
+            leg.sites.fuel_miles if leg.sites is not None else None,
+        )
+        if leg.fuel_stops
+        else None
+        for leg in legs
+    ]
+    # On-duty minutes still ahead, for sizing waits on the exact 8-day cycle.
+    work_left = sum(
+        _leg_work_min(leg, fuel_segments) for leg, fuel_segments in zip(legs, fuel_plans)
+    )
+    for index, (leg, fuel_segments) in enumerate(zip(legs, fuel_plans)):
+        if fuel_segments is None:
+            work_left -= leg.duration_hours * 60
+            _drive_with_hos(
                 segments,
                 state,
-                DutyStatus.ON_DUTY_NOT_DRIVING,
-                FUEL_STOP_MIN,
-                "Fuel stop",
-                count_toward_window=True,
+                leg.duration_hours * 60,
+                leg.drive_description,
+                miles_per_min=_miles_per_min(leg.distance_miles, leg.duration_hours),
+                closed_form=closed_form,
+                work_after_min=work_left,
             )
+            yield "drive", index, leg.distance_miles, leg.miles_since_fuel + leg.distance_miles
+        else:
+            leg_miles = 0.0
+            miles_since_fuel = leg.miles_since_fuel
+            for i, (seg_miles, seg_hours) in enumerate(fuel_segments):
+                work_left -= seg_hours * 60
+                _drive_with_hos(
+                    segments,
+                    state,
+                    seg_hours * 60,
+                    leg.drive_description,
+                    miles_per_min=_miles_per_min(seg_miles, seg_hours),
+                    closed_form=closed_form,
+                    work_after_min=work_left,
+                    site_miles=leg.sites.miles if leg.sites is not None else None,
+                    start_miles=leg_miles,
+                )
+                leg_miles += seg_miles
+                miles_since_fuel += seg_miles
+                yield "drive", index, leg_miles, miles_since_fuel
+                if i < len(fuel_segments) - 1:
+                    work_left -= FUEL_STOP_MIN
+                    _ensure_cycle_capacity_for_on_duty(
+                        segments, state, FUEL_STOP_MIN, work_left
+                    )
+                    _add_segment(
+                        segments,
+                        state,
+                        DutyStatus.ON_DUTY_NOT_DRIVING,
+                        FUEL_STOP_MIN,
+                        FUEL_STOP_DESCRIPTION,
+                        count_toward_window=True,
+                    )
+                    miles_since_fuel = 0.0
+                    yield "fuel", index, leg_miles, 0.0
 
-    # 1 hr at pickup
-    _ensure_cycle_capacity_for_on_duty(segments, state, PICKUP_DROPOFF_MIN)
-    _add_segment(
-        segments,
-        state,
-        DutyStatus.ON_DUTY_NOT_DRIVING,
-        PICKUP_DROPOFF_MIN,
-        "Pickup (1 hr)",
-        count_toward_window=True,
-    )
-
-    # Leg 1: pickup -> dropoff
-    leg1 = route.legs[1]
-    fuel_segments = _split_leg_by_fuel(leg1.distance_miles, leg1.duration_hours)
-    for i, (seg_miles, seg_hours) in enumerate(fuel_segments):
-        _drive_with_hos(segments, state, seg_hours * 60, "Driving to dropoff")
-        if i < len(fuel_segments) - 1 and seg_miles >= FUEL_INTERVAL_MILES:
-            _ensure_cycle_capacity_for_on_duty(segments, state, FUEL_STOP_MIN)
+        if leg.stop_description:
+            # On duty at the stop (1 hr at pickup / dropoff by default)
+            work_left -= leg.stop_minutes
+            _ensure_cycle_capacity_for_on_duty(
+                segments, state, leg.stop_minutes, work_left
+            )
             _add_segment(
                 segments,
                 state,
                 DutyStatus.ON_DUTY_NOT_DRIVING,
-                FUEL_STOP_MIN,
-                "Fuel stop",
+                leg.stop_minutes,
+                leg.stop_description,
                 count_toward_window=True,
             )
+            yield "leg", index + 1, 0.0, 0.0
 
-    # 1 hr at dropoff
-    _ensure_cycle_capacity_for_on_duty(segments, state, PICKUP_DROPOFF_MIN)
-    _add_segment(
-        segments,
-        state,
-        DutyStatus.ON_DUTY_NOT_DRIVING,
-        PICKUP_DROPOFF_MIN,
-        "Dropoff (1 hr)",
-        count_toward_window=True,
-    )
 
+def build_timeline(
+    request: TripRequest,
+    route: Route,
+    *,
+    closed_form: bool = True,
+) -> CompactTimeline:
+    """
+    Build full timeline: drive to each stop in turn (with fuel stops and
+    HOS breaks/rest) and stay on duty there for its dwell time; by default
+    drive to pickup, 1hr pickup, drive to dropoff, 1hr dropoff.
+    closed_form selects the whole-day fast path for long drive stretches;
+    both modes produce identical timelines.
+    """
+    segments = CompactTimeline(request.start_time)
+    state = initial_state(request)
+    for _ in _timeline_steps(segments, state, request_legs(request, route), closed_form):
+        pass
+    return segments
+
+
+def build_timeline_checkpoints(
+    request: TripRequest,
+    route: Route,
+    *,
+    checkpoint_at=("leg",),
+    closed_form: bool = True,
+) -> tuple[CompactTimeline, list[HOSSnapshot]]:
+    """
+    build_timeline plus an HOSSnapshot after every step whose kind is in
+    checkpoint_at (see CHECKPOINT_KINDS), in time order. Positions in the
+    snapshots refer to request_legs(request, route).
+    """
+    unknown = set(checkpoint_at) - set(CHECKPOINT_KINDS)
+    if unknown:
+        raise ValueError(f"unknown checkpoint kind {sorted(unknown)[0]!r}")
+    segments = CompactTimeline(request.start_time)
+    state = initial_state(request)
+    snapshots = []
+    for kind, leg_index, leg_miles, miles_since_fuel in _timeline_steps(
+        segments, state, request_legs(request, route), closed_form
+    ):
+        if kind in checkpoint_at:
+            snapshots.append(
+                HOSSnapshot.of(
+                    state,
+                    kind=kind,
+                    leg_index=leg_index,
+                    leg_miles=leg_miles,
+                    miles_since_fuel=miles_since_fuel,
+                    row=len(segments),
+                )
+            )
+    return segments, snapshots
+
+
+def iter_timeline(
+    request: TripRequest,
+    route: Route,
+    *,
+    closed_form: bool = True,
+    offsets: bool = False,
+) -> Iterator[tuple]:
+    """
+    build_timeline as a generator of row tuples, yielded as each step appends
+    them; with offsets, as CompactTimeline.offset_rows from request.start_time.
+    """
+    segments = CompactTimeline(request.start_time)
+    rows = segments.offset_rows if offsets else segments.rows
+    state = initial_state(request)
+    emitted = 0
+    for _ in _timeline_steps(segments, state, request_legs(request, route), closed_form):
+        yield from rows(emitted)
+        emitted = len(segments)
+
+
+def resume_timeline(
+    prefix: CompactTimeline,
+    state: HOSState,
+    legs: list[TripLeg],
+    *,
+    closed_form: bool = True,
+) -> CompactTimeline:
+    """
+    Continue a timeline from state (on prefix's clock) over the remaining
+    legs; prefix is left untouched and its rows are kept verbatim.
+    """
+    segments = prefix.head(len(prefix))
+    for _ in _timeline_steps(segments, state, legs, closed_form):
+        pass
     return segments
+
+
+def resume_from_snapshot(
+    snapshot: HOSSnapshot,
+    legs: list[TripLeg],
+    prefix: CompactTimeline | None = None,
+    *,
+    closed_form: bool = True,
+) -> CompactTimeline:
+    """
+    Simulate the rest of a trip from snapshot. legs are the legs the
+    snapshot's position refers to (e.g. trip_legs(route, stops)); they may differ
+    after it, which is how what-if variants share a prefix. With prefix, its
+    first snapshot.row rows are kept ahead of the new ones; without, the
+    timeline holds only the rows after the snapshot.
+    """
+    if prefix is None:
+        prefix = CompactTimeline(snapshot.epoch)
+    else:
+        prefix = prefix.head(snapshot.row)
+    return resume_timeline(
+        prefix,
+        snapshot.state(),
+        remaining_legs(legs, snapshot.leg_index, snapshot.leg_miles, snapshot.miles_since_fuel),
+        closed_form=closed_form,
+    )
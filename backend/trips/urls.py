@@ -1,9 +1,21 @@
 from django.urls import path
 
-from .views import PlaceSuggestionsView, PlanTripView, debug_mapbox_view
+from .views import (
+    BatchPlanView,
+    PlaceSuggestionsView,
+    PlanTripView,
+    ReplanTripView,
+    ScenarioPlanView,
+    debug_mapbox_view,
+    metrics_view,
+)
 
 urlpatterns = [
     path("plan/", PlanTripView.as_view(), name="plan_trip"),
+    path("plan/replan/", ReplanTripView.as_view(), name="replan_trip"),
+    path("plan/scenarios/", ScenarioPlanView.as_view(), name="plan_scenarios"),
+    path("plan/batch/", BatchPlanView.as_view(), name="plan_batch"),
     path("places/", PlaceSuggestionsView.as_view(), name="place_suggestions"),
     path("debug/", debug_mapbox_view, name="debug_mapbox"),
+    path("metrics/", metrics_view, name="metrics"),
 ]
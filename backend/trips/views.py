@@ -1,24 +1,36 @@
+import asyncio
 import json
+import os
 from datetime import datetime
-from math import hypot
+from zoneinfo import ZoneInfo, ZoneInfoNotFoundError
 
 from django.conf import settings
-from django.http import JsonResponse
+from django.http import HttpResponse, HttpResponseNotModified, JsonResponse, StreamingHttpResponse
 from django.utils import timezone
 from django.views import View
 from django.views.decorators.csrf import csrf_exempt
-from django.views.decorators.http import require_http_methods
 from django.utils.decorators import method_decorator
 
-from .log_sheet_generator import build_log_sheets
-from .mapbox_client import get_route, search_places
-from .schemas import DutyStatus, TripRequest
-from .serializers import (
-    daily_log_to_dict,
-    route_to_dict,
-    timeline_segment_to_dict,
+from . import plan_cache, plan_store
+from .cache import cache_stats
+from .encoders import with_plan_id
+from .mapbox_client import ageocode_many, asearch_places
+from .planner import (
+    iter_plan_ndjson,
+    plan_trip_json,
+    plan_trip_record,
+    remaining_route,
+    remaining_waypoints,
+    replan_checkpoint,
+    replan_trip_record,
+    run_in_process_pool,
 )
-from .timeline_engine import build_timeline
+from .geometry import POLYLINE_PRECISION
+from .pois import route_stop_sites
+from .routing import aget_route, aroute_waypoints, get_backend, trip_locations
+from .scenarios import distinct_states, scenario_grid, scenarios_to_dict, simulate_states
+from .schemas import STOP_KINDS, GeometryOptions, TripRequest, TripStop
+from .timeline_engine import PICKUP_DROPOFF_MIN, request_legs
 
 
 def _parse_location_coords(value):
@@ -29,6 +41,246 @@ def _parse_location_coords(value):
     return [float(value[0]), float(value[1])]
 
 
+def _parse_datetime(value, name: str) -> datetime:
+    """ISO datetime string (or datetime) made aware in the current time zone."""
+    try:
+        if isinstance(value, str):
+            value = datetime.fromisoformat(value.replace("Z", "+00:00"))
+        if timezone.get_current_timezone() and value.tzinfo is None:
+            value = timezone.make_aware(value)
+    except (ValueError, TypeError, AttributeError):
+        raise ValueError(f"{name} must be an ISO datetime string")
+    return value
+
+
+def _parse_text(body: dict, name: str) -> str:
+    """An optional string field, stripped; "" when missing."""
+    value = body.get(name)
+    if value is None:
+        return ""
+    if not isinstance(value, str):
+        raise ValueError(f"{name} must be a string")
+    return value.strip()
+
+
+def _parse_trip_request(body) -> TripRequest:
+    """Validate a plan payload and build a TripRequest; ValueError carries the 400 message."""
+    if not isinstance(body, dict):
+        raise ValueError("Request body must be a JSON object")
+
+    current_location = _parse_text(body, "current_location")
+    pickup_location = _parse_text(body, "pickup_location")
+    dropoff_location = _parse_text(body, "dropoff_location")
+    current_cycle_used_hrs = body.get("current_cycle_used_hrs", 0)
+
+    stops = _parse_stops(body.get("stops"))
+    if stops:
+        if not current_location:
+            raise ValueError("current_location is required")
+        pickup_location = stops[0].location
+        dropoff_location = stops[-1].location
+    elif not current_location or not pickup_location or not dropoff_location:
+        raise ValueError(
+            "current_location, pickup_location, and dropoff_location are required"
+        )
+
+    try:
+        current_cycle_used_hrs = float(current_cycle_used_hrs)
+    except (TypeError, ValueError):
+        raise ValueError("current_cycle_used_hrs must be a number")
+    if current_cycle_used_hrs < 0 or current_cycle_used_hrs > 70:
+        raise ValueError("current_cycle_used_hrs must be between 0 and 70")
+
+    try:
+        current_location_coords = _parse_location_coords(
+            body.get("current_location_coords")
+        )
+        pickup_location_coords = _parse_location_coords(
+            body.get("pickup_location_coords")
+        )
+        dropoff_location_coords = _parse_location_coords(
+            body.get("dropoff_location_coords")
+        )
+    except TypeError as exc:
+        raise ValueError(str(exc))
+    if stops:
+        pickup_location_coords = stops[0].coords
+        dropoff_location_coords = stops[-1].coords
+
+    start_time = body.get("start_time")
+    if start_time is None:
+        start_time = timezone.now()
+        if timezone.get_current_timezone():
+            start_time = start_time.astimezone(timezone.get_current_timezone())
+    else:
+        start_time = _parse_datetime(start_time, "start_time")
+
+    home_terminal_timezone = (
+        _parse_text(body, "home_terminal_timezone")
+        or getattr(settings, "HOME_TERMINAL_TIMEZONE", "")
+        or None
+    )
+    if home_terminal_timezone is not None:
+        try:
+            ZoneInfo(str(home_terminal_timezone))
+        except (ZoneInfoNotFoundError, ValueError):
+            raise ValueError("home_terminal_timezone must be an IANA time zone name")
+        home_terminal_timezone = str(home_terminal_timezone)
+
+    cycle_history_hrs = body.get("cycle_history_hrs")
+    if cycle_history_hrs is not None:
+        if not isinstance(cycle_history_hrs, list) or len(cycle_history_hrs) > 7:
+            raise ValueError("cycle_history_hrs must be a list of at most 7 daily hours")
+        try:
+            cycle_history_hrs = [float(hours) for hours in cycle_history_hrs]
+        except (TypeError, ValueError):
+            raise ValueError("cycle_history_hrs must contain numbers")
+        if any(hours < 0 or hours > 24 for hours in cycle_history_hrs):
+            raise ValueError("cycle_history_hrs entries must be between 0 and 24")
+
+    return TripRequest(
+        current_location=current_location,
+        pickup_location=pickup_location,
+        dropoff_location=dropoff_location,
+        current_cycle_used_hrs=current_cycle_used_hrs,
+        start_time=start_time,
+        current_location_coords=current_location_coords,
+        pickup_location_coords=pickup_location_coords,
+        dropoff_location_coords=dropoff_location_coords,
+        home_terminal_timezone=home_terminal_timezone,
+        cycle_history_hrs=cycle_history_hrs,
+        stops=stops,
+    )
+
+
+def _parse_stops(value) -> list[TripStop] | None:
+    """
+    The optional multi-stop list: [{"location": ..., "coords": [lng, lat],
+    "kind": "pickup" | "dropoff" | "stop", "dwell_minutes": 60}, ...] in
+    driving order after current_location; only location is required.
+    """
+    if value is None:
+        return None
+    max_stops = getattr(settings, "PLAN_MAX_STOPS", 100)
+    if not isinstance(value, list) or not value or len(value) > max_stops:
+        raise ValueError(f"stops must be a list of 1 to {max_stops} stops")
+    stops = []
+    for item in value:
+        if not isinstance(item, dict):
+            raise ValueError("each stop must be an object")
+        location = str(item.get("location") or "").strip()
+        if not location:
+            raise ValueError("each stop needs a location")
+        try:
+            coords = _parse_location_coords(item.get("coords"))
+        except TypeError as exc:
+            raise ValueError(str(exc))
+        kind = item.get("kind") or "stop"
+        if kind not in STOP_KINDS:
+            raise ValueError("stop kind must be one of " + ", ".join(STOP_KINDS))
+        try:
+            dwell_minutes = float(item.get("dwell_minutes", PICKUP_DROPOFF_MIN))
+        except (TypeError, ValueError):
+            raise ValueError("stop dwell_minutes must be a number")
+        if dwell_minutes <= 0 or dwell_minutes > 24 * 60:
+            raise ValueError("stop dwell_minutes must be more than 0 and at most 1440")
+        stops.append(TripStop(location, coords, kind, dwell_minutes))
+    return stops
+
+
+def _parse_geometry_options(request) -> GeometryOptions:
+    """
+    Route geometry response mode from query params: geometry=geojson|polyline|polyline6,
+    zoom=<0-22> to simplify for that map zoom, leg_geometry=0 to drop per-leg copies.
+    """
+    geometry_format = (request.GET.get("geometry") or "geojson").strip().lower()
+    if geometry_format != "geojson" and geometry_format not in POLYLINE_PRECISION:
+        raise ValueError("geometry must be one of geojson, polyline, polyline6")
+
+    zoom = request.GET.get("zoom")
+    if zoom not in (None, ""):
+        try:
+            zoom = float(zoom)
+        except ValueError:
+            raise ValueError("zoom must be a number")
+        if not 0 <= zoom <= 22:
+            raise ValueError("zoom must be between 0 and 22")
+    else:
+        zoom = None
+
+    leg_geometry = (request.GET.get("leg_geometry") or "1").strip().lower()
+    return GeometryOptions(
+        format=geometry_format,
+        zoom=zoom,
+        leg_geometry=leg_geometry not in ("0", "false", "no"),
+    )
+
+
+def _parse_scenario_axes(body, trip: TripRequest) -> tuple[list, list]:
+    """start_times and cycle_used_hrs lists; each defaults to the trip's own value."""
+    start_times = body.get("start_times")
+    if start_times is None:
+        start_times = [trip.start_time]
+    elif not isinstance(start_times, list) or not start_times:
+        raise ValueError("start_times must be a non-empty list")
+    else:
+        start_times = [_parse_datetime(value, "start_times entries") for value in start_times]
+
+    cycle_used_hrs = body.get("cycle_used_hrs")
+    if cycle_used_hrs is None:
+        cycle_used_hrs = [trip.current_cycle_used_hrs]
+    elif not isinstance(cycle_used_hrs, list) or not cycle_used_hrs:
+        raise ValueError("cycle_used_hrs must be a non-empty list")
+    else:
+        try:
+            cycle_used_hrs = [float(hours) for hours in cycle_used_hrs]
+        except (TypeError, ValueError):
+            raise ValueError("cycle_used_hrs must contain numbers")
+        if any(hours < 0 or hours > 70 for hours in cycle_used_hrs):
+            raise ValueError("cycle_used_hrs entries must be between 0 and 70")
+
+    max_items = getattr(settings, "PLAN_SCENARIO_MAX_ITEMS", 2000)
+    if len(start_times) * len(cycle_used_hrs) > max_items:
+        raise ValueError(
+            f"start_times x cycle_used_hrs may contain at most {max_items} scenarios"
+        )
+    return start_times, cycle_used_hrs
+
+
+def _ndjson_line(index: int, result: bytes = b"", error: str = "") -> bytes:
+    """One batch output line; result is already JSON-encoded by the worker."""
+    if error:
+        return json.dumps({"index": index, "error": error}).encode() + b"\n"
+    return b'{"index": %d, "result": ' % index + result + b"}\n"
+
+
+async def _add_stop_sites(trip: TripRequest, route):
+    """Attach the truck stops / rest areas along route to trip (no-op without POI_PATH)."""
+    if getattr(settings, "POI_PATH", ""):
+        trip.stop_sites = await asyncio.to_thread(route_stop_sites, route)
+
+
+def _wants_stream(request) -> bool:
+    """Opt-in NDJSON streaming via ?stream=1 or Accept: application/x-ndjson."""
+    if (request.GET.get("stream") or "").strip().lower() in ("1", "true", "yes"):
+        return True
+    return "application/x-ndjson" in (request.headers.get("Accept") or "")
+
+
+async def _stream_lines(lines):
+    """Serve a sync line generator, advancing it in a worker thread so the event loop stays free."""
+    lines = iter(lines)
+    try:
+        while True:
+            line = await asyncio.to_thread(next, lines, None)
+            if line is None:
+                break
+            yield line
+    except Exception as exc:  # noqa: BLE001
+        # Headers are already sent; report the failure as the last line.
+        yield json.dumps({"error": str(exc) or exc.__class__.__name__}).encode() + b"\n"
+
+
 def _resolve_mapbox_token(request, body=None):
     """Prefer env token, then request-provided fallback for hosted deployments."""
     env_token = (getattr(settings, "MAPBOX_ACCESS_TOKEN", "") or "").strip()
@@ -42,123 +294,32 @@ def _resolve_mapbox_token(request, body=None):
     return ""
 
 
-def _point_along_geometry(geometry, progress: float):
-    """Return [lng, lat] for a fractional progress (0..1) along route geometry."""
-    if not geometry:
-        return None
-    if len(geometry) == 1:
-        return geometry[0]
-
-    progress = max(0.0, min(1.0, float(progress)))
-    segment_lengths = []
-    total_length = 0.0
-    for i in range(1, len(geometry)):
-        x0, y0 = geometry[i - 1]
-        x1, y1 = geometry[i]
-        seg_len = hypot(x1 - x0, y1 - y0)
-        segment_lengths.append(seg_len)
-        total_length += seg_len
-
-    if total_length <= 0:
-        return geometry[-1]
-
-    target = total_length * progress
-    walked = 0.0
-    for i, seg_len in enumerate(segment_lengths, start=1):
-        next_walked = walked + seg_len
-        if next_walked >= target:
-            if seg_len <= 0:
-                return geometry[i]
-            t = (target - walked) / seg_len
-            x0, y0 = geometry[i - 1]
-            x1, y1 = geometry[i]
-            return [x0 + (x1 - x0) * t, y0 + (y1 - y0) * t]
-        walked = next_walked
-
-    return geometry[-1]
-
-
-def _build_stops_and_rests(timeline, route):
-    """
-    Serialize non-driving timeline segments and attach coordinates.
-    Pickup/dropoff use waypoint coordinates; other stops use leg-level drive progress
-    (current->pickup or pickup->dropoff) for better spatial precision.
-    """
-    leg_durations_min = [
-        (leg.duration_hours or 0.0) * 60
-        for leg in (route.legs or [])
-    ]
-    driven_leg_min = [0.0 for _ in leg_durations_min]
-    active_leg = 0
-    total_driving_min = sum(leg_durations_min)
-    cumulative_driving_min = 0.0
-    items = []
-
-    for seg in timeline:
-        if seg.status == DutyStatus.DRIVING:
-            desc = (seg.description or "").lower()
-            if "dropoff" in desc and len(driven_leg_min) > 1:
-                active_leg = 1
-            cumulative_driving_min += seg.duration_minutes
-            if driven_leg_min:
-                idx = min(active_leg, len(driven_leg_min) - 1)
-                driven_leg_min[idx] += seg.duration_minutes
-            continue
-
-        item = timeline_segment_to_dict(seg)
-        desc = (seg.description or "").lower()
-        coord = None
-
-        if "pickup" in desc and len(route.waypoints) >= 2:
-            coord = route.waypoints[1]
-            active_leg = 1
-        elif "dropoff" in desc and len(route.waypoints) >= 3:
-            coord = route.waypoints[2]
-        elif route.legs and driven_leg_min:
-            idx = min(active_leg, len(route.legs) - 1)
-            leg = route.legs[idx]
-            leg_total = leg_durations_min[idx] if idx < len(leg_durations_min) else 0.0
-            if leg_total > 0:
-                leg_progress = max(0.0, min(1.0, driven_leg_min[idx] / leg_total))
-                if leg.geometry:
-                    coord = _point_along_geometry(leg.geometry, leg_progress)
-                elif route.geometry:
-                    # If leg geometry is missing from directions payload, convert
-                    # leg-local progress into full-route progress before interpolation.
-                    mins_before_leg = sum(leg_durations_min[:idx])
-                    global_progress = (
-                        0.0
-                        if total_driving_min <= 0
-                        else (mins_before_leg + driven_leg_min[idx]) / total_driving_min
-                    )
-                    coord = _point_along_geometry(route.geometry, global_progress)
-            elif route.geometry:
-                progress = (
-                    0.0
-                    if total_driving_min <= 0
-                    else cumulative_driving_min / total_driving_min
-                )
-                coord = _point_along_geometry(route.geometry, progress)
-        elif route.geometry:
-            progress = (
-                0.0
-                if total_driving_min <= 0
-                else cumulative_driving_min / total_driving_min
-            )
-            coord = _point_along_geometry(route.geometry, progress)
+def _cache_bypassed(request) -> bool:
+    """Client opt-out of cached upstream results via Cache-Control: no-cache."""
+    cache_control = (request.headers.get("Cache-Control") or "").lower()
+    return "no-cache" in cache_control or "no-store" in cache_control
 
-        item["coordinates"] = coord
-        items.append(item)
 
-    return items
+def _plan_response(request, body: bytes, etag: str):
+    """The plan body with its ETag, or 304 when If-None-Match already names it."""
+    if plan_cache.etag_matches(request.headers.get("If-None-Match"), etag):
+        response = HttpResponseNotModified()
+    else:
+        response = HttpResponse(body, content_type="application/json")
+    response["ETag"] = etag
+    return response
 
 
 @method_decorator(csrf_exempt, name="dispatch")
-@method_decorator(require_http_methods(["POST"]), name="dispatch")
 class PlanTripView(View):
-    """POST /api/plan/ – plan a trip and return route, stops, and log sheets."""
+    """
+    POST /api/plan/ – plan a trip and return route, stops, and log sheets.
+    With ?stream=1 the plan is streamed as NDJSON (see iter_plan_ndjson).
+    Repeat requests are answered from the plan cache (see plan_cache);
+    responses carry an ETag and honour If-None-Match with 304.
+    """
 
-    def post(self, request):
+    async def post(self, request):
         try:
             body = json.loads(request.body)
         except (json.JSONDecodeError, TypeError):
@@ -167,111 +328,303 @@ class PlanTripView(View):
                 status=400,
             )
 
-        current_location = body.get("current_location", "").strip()
-        pickup_location = body.get("pickup_location", "").strip()
-        dropoff_location = body.get("dropoff_location", "").strip()
-        current_cycle_used_hrs = body.get("current_cycle_used_hrs", 0)
+        try:
+            trip_request = _parse_trip_request(body)
+            geometry_options = _parse_geometry_options(request)
+        except ValueError as exc:
+            return JsonResponse({"error": str(exc)}, status=400)
 
-        if not current_location or not pickup_location or not dropoff_location:
-            return JsonResponse(
-                {"error": "current_location, pickup_location, and dropoff_location are required"},
-                status=400,
-            )
+        cache_key = None
+        if plan_cache.enabled() and not _wants_stream(request):
+            cache_key = plan_cache.plan_key(trip_request, geometry_options)
+            if not _cache_bypassed(request):
+                cached = await plan_cache.aget_plan(cache_key)
+                if cached is not None:
+                    return _plan_response(request, *cached)
 
-        try:
-            current_cycle_used_hrs = float(current_cycle_used_hrs)
-            if current_cycle_used_hrs < 0 or current_cycle_used_hrs > 70:
-                return JsonResponse(
-                    {"error": "current_cycle_used_hrs must be between 0 and 70"},
-                    status=400,
-                )
-        except (TypeError, ValueError):
+        token = _resolve_mapbox_token(request, body)
+        route = await aget_route(
+            trip_request,
+            token=token,
+            use_cache=not _cache_bypassed(request),
+        )
+        if route is None:
             return JsonResponse(
-                {"error": "current_cycle_used_hrs must be a number"},
+                {"error": "Could not find route. Check addresses and try again."},
                 status=400,
             )
+        await _add_stop_sites(trip_request, route)
 
-        try:
-            current_location_coords = _parse_location_coords(
-                body.get("current_location_coords")
+        if _wants_stream(request):
+            return StreamingHttpResponse(
+                _stream_lines(iter_plan_ndjson(trip_request, route, geometry_options)),
+                content_type="application/x-ndjson",
             )
-            pickup_location_coords = _parse_location_coords(
-                body.get("pickup_location_coords")
+        plan_id = None
+        if not plan_store.enabled():
+            plan_body = await asyncio.to_thread(plan_trip_json, trip_request, route, geometry_options)
+        else:
+            plan_body, record = await asyncio.to_thread(
+                plan_trip_record, trip_request, route, geometry_options
             )
-            dropoff_location_coords = _parse_location_coords(
-                body.get("dropoff_location_coords")
+            plan_id = plan_store.new_plan_id()
+            await plan_store.asave_plan(plan_id, record)
+        etag = plan_cache.etag_for(plan_body)
+        if plan_id is not None:
+            plan_body = with_plan_id(plan_body, plan_id)
+        if cache_key is not None:
+            await plan_cache.asave_plan(
+                cache_key,
+                plan_body,
+                etag,
+                plan_store.ttl_seconds() if plan_id is not None else None,
             )
+        return _plan_response(request, plan_body, etag)
+
+
+@method_decorator(csrf_exempt, name="dispatch")
+class ReplanTripView(View):
+    """
+    POST /api/plan/replan/ – update a stored plan from a checkpoint.
+    Body: {"plan_id": ..., "now": ISO datetime (default: current time),
+    "current_location_coords": [lng, lat] (optional)}. Rows before now are
+    kept as planned; the rest of the trip is re-simulated from the HOS state
+    at now. With current_location_coords the remaining legs are re-routed
+    from there; otherwise the stored route is continued from the planned
+    position. Responds like /api/plan/ with a new plan_id.
+    """
+
+    async def post(self, request):
+        try:
+            body = json.loads(request.body)
+        except (json.JSONDecodeError, TypeError):
+            return JsonResponse({"error": "Invalid JSON"}, status=400)
+        if not isinstance(body, dict):
+            return JsonResponse({"error": "Request body must be a JSON object"}, status=400)
+
+        plan_id = str(body.get("plan_id") or "").strip()
+        try:
+            if not plan_id:
+                raise ValueError("plan_id is required")
+            now = body.get("now")
+            now = timezone.now() if now is None else _parse_datetime(now, "now")
+            position = _parse_location_coords(body.get("current_location_coords"))
+            geometry_options = _parse_geometry_options(request)
         except (TypeError, ValueError) as exc:
             return JsonResponse({"error": str(exc)}, status=400)
 
-        start_time = body.get("start_time")
-        if start_time is None:
-            start_time = timezone.now()
-            if timezone.get_current_timezone():
-                start_time = start_time.astimezone(timezone.get_current_timezone())
+        record = await plan_store.aload_plan(plan_id) if plan_id.isalnum() else None
+        if record is None:
+            return JsonResponse({"error": "Unknown or expired plan_id"}, status=404)
+
+        try:
+            checkpoint = replan_checkpoint(record, now)
+        except ValueError as exc:
+            return JsonResponse({"error": str(exc)}, status=400)
+
+        if position is None:
+            route = remaining_route(record, checkpoint)
         else:
-            try:
-                if isinstance(start_time, str):
-                    start_time = datetime.fromisoformat(
-                        start_time.replace("Z", "+00:00")
-                    )
-                if timezone.get_current_timezone() and start_time.tzinfo is None:
-                    start_time = timezone.make_aware(start_time)
-            except (ValueError, TypeError):
+            token = _resolve_mapbox_token(request, body)
+            route = None
+            if token or not get_backend().requires_token:
+                route = await aroute_waypoints(
+                    [position] + remaining_waypoints(record, checkpoint),
+                    token,
+                    use_cache=not _cache_bypassed(request),
+                )
+            if route is None:
                 return JsonResponse(
-                    {"error": "start_time must be an ISO datetime string"},
+                    {"error": "Could not find route from current_location_coords."},
                     status=400,
                 )
 
-        trip_request = TripRequest(
-            current_location=current_location,
-            pickup_location=pickup_location,
-            dropoff_location=dropoff_location,
-            current_cycle_used_hrs=current_cycle_used_hrs,
-            start_time=start_time,
-            current_location_coords=current_location_coords,
-            pickup_location_coords=pickup_location_coords,
-            dropoff_location_coords=dropoff_location_coords,
-        )
+        new_plan_id = plan_store.new_plan_id()
+        try:
+            plan_body, new_record = await asyncio.to_thread(
+                replan_trip_record, record, checkpoint, route, geometry_options, new_plan_id
+            )
+        except ValueError as exc:
+            return JsonResponse({"error": str(exc)}, status=400)
+        await plan_store.asave_plan(new_plan_id, new_record)
+        return HttpResponse(plan_body, content_type="application/json")
+
+
+@method_decorator(csrf_exempt, name="dispatch")
+class ScenarioPlanView(View):
+    """
+    POST /api/plan/scenarios/ – what-if sweep over one trip.
+    Body: a plan payload plus "start_times" (ISO datetimes) and
+    "cycle_used_hrs" (numbers); every combination is simulated on one route.
+    Responds with one summary per scenario (arrival, rests, duty hours),
+    start times outermost, and the index of the earliest arrival. With
+    cycle_history_hrs in the payload the cycle hours axis has no effect.
+    """
+
+    async def post(self, request):
+        try:
+            body = json.loads(request.body)
+        except (json.JSONDecodeError, TypeError):
+            return JsonResponse({"error": "Invalid JSON"}, status=400)
+
+        try:
+            trip_request = _parse_trip_request(body)
+            start_times, cycle_used_hrs = _parse_scenario_axes(body, trip_request)
+        except ValueError as exc:
+            return JsonResponse({"error": str(exc)}, status=400)
 
         token = _resolve_mapbox_token(request, body)
-        route = get_route(trip_request, token=token)
+        route = await aget_route(
+            trip_request,
+            token=token,
+            use_cache=not _cache_bypassed(request),
+        )
         if route is None:
             return JsonResponse(
                 {"error": "Could not find route. Check addresses and try again."},
                 status=400,
             )
+        await _add_stop_sites(trip_request, route)
+
+        requests = scenario_grid(trip_request, start_times, cycle_used_hrs)
+        states, state_index = distinct_states(requests)
+        legs = request_legs(trip_request, route)
+        # One chunk per worker; only the legs and start states cross processes.
+        workers = getattr(settings, "PLAN_PROCESS_POOL_WORKERS", 0)
+        chunk_size = -(-len(states) // (workers or os.cpu_count() or 1))
+        chunks = await asyncio.gather(
+            *(
+                run_in_process_pool(workers, simulate_states, states[i : i + chunk_size], legs)
+                for i in range(0, len(states), chunk_size)
+            )
+        )
+        body = scenarios_to_dict(
+            requests, state_index, [summary for chunk in chunks for summary in chunk]
+        )
+        body["route"] = {
+            "distance_miles": route.distance_miles,
+            "duration_hours": route.duration_hours,
+        }
+        return JsonResponse(body)
+
+
+@method_decorator(csrf_exempt, name="dispatch")
+class BatchPlanView(View):
+    """
+    POST /api/plan/batch/ – plan many trips in one call.
+    Body: {"trips": [<plan payload>, ...]}. Streams NDJSON, one line per trip
+    as it finishes: {"index": i, "result": {...}} or {"index": i, "error": "..."}.
+    """
 
-        timeline = build_timeline(trip_request, route)
-        log_sheets = build_log_sheets(timeline, trip_request)
-        stops_and_rests = _build_stops_and_rests(timeline, route)
-
-        return JsonResponse(
-            {
-                "route": route_to_dict(route),
-                "stops_and_rests": stops_and_rests,
-                "log_sheets": [daily_log_to_dict(log) for log in log_sheets],
-            },
-            safe=False,
+    async def post(self, request):
+        try:
+            body = json.loads(request.body)
+        except (json.JSONDecodeError, TypeError):
+            return JsonResponse({"error": "Invalid JSON"}, status=400)
+
+        trips = body.get("trips") if isinstance(body, dict) else None
+        max_items = getattr(settings, "PLAN_BATCH_MAX_ITEMS", 5000)
+        if not isinstance(trips, list) or not trips:
+            return JsonResponse({"error": "trips must be a non-empty list"}, status=400)
+        if len(trips) > max_items:
+            return JsonResponse(
+                {"error": f"trips may contain at most {max_items} items"},
+                status=400,
+            )
+        try:
+            geometry_options = _parse_geometry_options(request)
+        except ValueError as exc:
+            return JsonResponse({"error": str(exc)}, status=400)
+
+        token = _resolve_mapbox_token(request, body)
+        if not token and get_backend().requires_token:
+            return JsonResponse({"error": "Mapbox token is not configured"}, status=400)
+
+        return StreamingHttpResponse(
+            self._stream(trips, token, not _cache_bypassed(request), geometry_options),
+            content_type="application/x-ndjson",
         )
 
+    async def _stream(self, trips, token, use_cache, geometry_options):
+        requests_by_index = {}
+        for index, payload in enumerate(trips):
+            try:
+                requests_by_index[index] = _parse_trip_request(payload)
+            except ValueError as exc:
+                yield _ndjson_line(index, error=str(exc))
+
+        concurrency = getattr(settings, "PLAN_BATCH_CONCURRENCY", 16)
+        queries = [
+            query
+            for trip in requests_by_index.values()
+            for query, coords in trip_locations(trip)
+            if not coords
+        ]
+        # Without a token (local routing) only coords and gazetteer names resolve.
+        geocoded = await ageocode_many(queries, token, use_cache, concurrency)
+
+        for index, trip in list(requests_by_index.items()):
+            missing = [
+                query
+                for query, coords in trip_locations(trip)
+                if not coords and not geocoded[query]
+            ]
+            if missing:
+                del requests_by_index[index]
+                yield _ndjson_line(index, error=f"Could not geocode {missing[0]!r}")
+                continue
+            trip.current_location_coords = trip.current_location_coords or geocoded[trip.current_location]
+            trip.pickup_location_coords = trip.pickup_location_coords or geocoded[trip.pickup_location]
+            trip.dropoff_location_coords = trip.dropoff_location_coords or geocoded[trip.dropoff_location]
+            for stop in trip.stops or []:
+                stop.coords = stop.coords or geocoded[stop.location]
+
+        workers = getattr(settings, "PLAN_PROCESS_POOL_WORKERS", 0)
+        semaphore = asyncio.Semaphore(max(1, concurrency))
+
+        async def plan_one(index, trip):
+            try:
+                async with semaphore:
+                    route = await aget_route(trip, token=token, use_cache=use_cache)
+                if route is None:
+                    return _ndjson_line(index, error="Could not find route")
+                await _add_stop_sites(trip, route)
+                result = await run_in_process_pool(
+                    workers, plan_trip_json, trip, route, geometry_options
+                )
+                return _ndjson_line(index, result=result)
+            except Exception as exc:  # noqa: BLE001
+                return _ndjson_line(index, error=str(exc) or exc.__class__.__name__)
+
+        tasks = [
+            asyncio.ensure_future(plan_one(index, trip))
+            for index, trip in requests_by_index.items()
+        ]
+        try:
+            for next_done in asyncio.as_completed(tasks):
+                yield await next_done
+        finally:
+            for task in tasks:
+                task.cancel()
+
 
 @method_decorator(csrf_exempt, name="dispatch")
-@method_decorator(require_http_methods(["GET"]), name="dispatch")
 class PlaceSuggestionsView(View):
     """GET /api/places/?q=... - autocomplete location suggestions."""
 
-    def get(self, request):
+    async def get(self, request):
         query = (request.GET.get("q") or "").strip()
         if len(query) < 2:
             return JsonResponse({"suggestions": []})
 
         token = _resolve_mapbox_token(request)
-        if not token:
-            return JsonResponse({"suggestions": []})
-
         try:
-            suggestions = search_places(query, token, limit=5)
+            suggestions = await asearch_places(
+                query,
+                token,
+                limit=5,
+                use_cache=not _cache_bypassed(request),
+            )
         except Exception:  # noqa: BLE001
             suggestions = []
 
@@ -290,3 +643,27 @@ def debug_mapbox_view(request):
             "mapbox_effective": bool(env_token or request_token),
         }
     )
+
+
+def metrics_view(request):
+    """GET /api/metrics/ - cache counters in Prometheus text exposition format."""
+    lines = []
+    metrics = (
+        ("hits", "counter", "Cache lookups served from memory."),
+        ("misses", "counter", "Cache lookups that fell through to the next tier."),
+        ("evictions", "counter", "Entries dropped to stay within max_entries."),
+        ("entries", "gauge", "Entries currently held."),
+        ("hit_ratio", "gauge", "hits / (hits + misses) since process start."),
+    )
+    stats = cache_stats()
+    for field, kind, help_text in metrics:
+        suffix = "_total" if kind == "counter" else ""
+        name = f"trips_cache_{field}{suffix}"
+        lines.append(f"# HELP {name} {help_text}")
+        lines.append(f"# TYPE {name} {kind}")
+        for cache_name, values in sorted(stats.items()):
+            lines.append(f'{name}{{cache="{cache_name}"}} {values[field]}')
+    return HttpResponse(
+        "\n".join(lines) + "\n",
+        content_type="text/plain; version=0.0.4; charset=utf-8",
+    )